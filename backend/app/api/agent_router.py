@@ -1,75 +1,504 @@
 import asyncio
-import json
-from fastapi import APIRouter
+import contextlib
+import logging
+import time
+import uuid
+from typing import Optional, Set
+from fastapi import APIRouter, Header, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
+from langchain_core.messages import AIMessageChunk
+from ..config import DISCONNECT_POLL_INTERVAL, RUN_QUEUE_RETRY_AFTER, SSE_GZIP, SSE_GZIP_LEVEL, SSE_HEARTBEAT_INTERVAL
 from ..orchestor.state_models import PromptRequest, AgentState
-from ..orchestor.graph import agent_executor
+from ..orchestor import graph
+from ..orchestor.nodes import restore_kernel
+from ..orchestor.nodes.input_processing import coalescing_key
+from ..services.event_stream_service import StateDelta, event_logs, gzip_frames, with_heartbeats
+from ..services.metrics_service import RunMetrics, current_run, run_duration
+from ..services.sandbox_service import shutdown_kernel
+from ..services.scheduler_service import QueueFull, RunTicket, run_scheduler
+from ..services.single_flight_service import Subscriber, run_coalescer
+
+logger = logging.getLogger(__name__)
 
 # Create an instance of APIRouter. This is the object that app.main will import and use.
 router = APIRouter()
 
+# Graph nodes whose LLM tokens are forwarded in token-streaming mode, and the
+# SSE event type each one's deltas are sent as.
+TOKEN_STREAM_EVENTS = {
+    "planner": "plan_delta",
+    "generate_code": "code_delta",
+}
+
+# Graph nodes whose results are streamed when they end. Routers and the graph
+# itself also emit chain events, which are internal and not forwarded.
+STREAMED_NODES = {"classify", "planner", "generate_code", "execute_code", "execute_batch", "diagnose_error"}
+
+# Runs currently being streamed by this process; a run can't be resumed while it is active
+_active_runs: Set[str] = set()
+
+# Cleanup of finished or abandoned runs, kept referenced until it completes
+_cleanup_tasks: Set[asyncio.Task] = set()
+
+# Marks the end of a run's event queue
+_END = object()
+
+
+def run_config(run_id: str) -> dict:
+    """LangGraph config addressing a run's checkpoints (the run id is the thread id)."""
+    return {"configurable": {"thread_id": run_id}}
+
+
+async def _run_graph(
+    inputs: Optional[dict],
+    run_id: str,
+    events: asyncio.Queue,
+    metrics: RunMetrics,
+    stream_mode: Optional[list] = None,
+    persistent_kernel: bool = False,
+) -> None:
+    """
+    Drives the graph and queues its events; runs in its own task so it can be cancelled.
+
+    With a `stream_mode` the graph's own stream is queued, as (mode, chunk) pairs;
+    otherwise the callback events of every runnable in the graph.
+    A resumed persistent-kernel run first gets its kernel back: the kernel was shut
+    down when its last stream ended, so the code it had run is replayed.
+    """
+    # The task has its own context: the nodes and the LLM/sandbox calls they make record into `metrics`
+    current_run.set(metrics)
+    try:
+        if inputs is None and persistent_kernel:
+            snapshot = await graph.agent_executor.aget_state(run_config(run_id))
+            if snapshot.values.get("kernel_history"):
+                await restore_kernel(run_id, snapshot.values["kernel_history"])
+        if stream_mode:
+            async for item in graph.agent_executor.astream(inputs, run_config(run_id), stream_mode=stream_mode):
+                events.put_nowait(item)
+            return
+        # Use astream_events to get a detailed, real-time feed of events from the graph.
+        # This is more powerful than a simple .stream() or .invoke() as it tells us
+        # exactly what's happening inside the agent's "mind".
+        async for event in graph.agent_executor.astream_events(inputs, run_config(run_id), version="v2"):
+            events.put_nowait(event)
+    except Exception as e:
+        events.put_nowait(e)
+    finally:
+        events.put_nowait(_END)
+
+
+async def _watch_disconnect(request: Request, graph_task: asyncio.Task, cancellation: dict) -> None:
+    """Cancels the run as soon as the client goes away, even while no event is being sent."""
+    while not graph_task.done():
+        if await request.is_disconnected():
+            cancellation["reason"] = "client disconnected"
+            graph_task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def _finish_run(
+    graph_task: Optional[asyncio.Task],
+    run_id: str,
+    persistent_kernel: bool,
+    reason: Optional[str],
+    ticket: Optional[RunTicket],
+) -> None:
+    """Stops an abandoned run and records why, then frees its run slot and kernel."""
+    if graph_task is None:
+        # Abandoned while still queued: nothing ran, only the queue place is given up
+        if ticket is not None:
+            ticket.release()
+        return
+    if reason is not None:
+        # Cancellation reaches in-flight Ollama requests and the sandbox, which kills the script
+        graph_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await graph_task
+        logger.warning(f"Run {run_id} cancelled: {reason}")
+        try:
+            await graph.agent_executor.aupdate_state(run_config(run_id), {"cancellation_reason": reason})
+        except Exception as e:
+            logger.debug(f"Cancellation reason of run {run_id} not checkpointed: {e}")
+    if ticket is not None:
+        ticket.release()
+    # The run's kernel holds its in-memory data; free it as soon as the run is over
+    if persistent_kernel:
+        await shutdown_kernel(run_id)
+
+
+async def agent_event_stream(
+    inputs: Optional[dict],
+    run_id: str,
+    stream_tokens: bool,
+    persistent_kernel: bool,
+    request: Optional[Request] = None,
+    ticket: Optional[RunTicket] = None,
+    timings: bool = False,
+    lean: bool = False,
+):
+    """
+    The generator function that yields events for the streaming response.
+
+    Every event is an SSE frame with an id, numbered across all streams of the
+    run and kept in the run's event log, so a client that lost the stream can
+    get the events it missed (see /runs/{run_id}/events).
+    """
+    log = event_logs.open(run_id)
+    events = _agent_events(inputs, run_id, stream_tokens, persistent_kernel, request, ticket, timings, lean)
+    try:
+        async for data in events:
+            yield log.emit(data)
+    finally:
+        log.close()
+        await events.aclose()
+
+
+async def _agent_events(
+    inputs: Optional[dict],
+    run_id: str,
+    stream_tokens: bool,
+    persistent_kernel: bool,
+    request: Optional[Request],
+    ticket: Optional[RunTicket],
+    timings: bool,
+    lean: bool,
+):
+    """
+    The events of a run, as dicts with a 'type' and 'data' field.
+
+    `inputs` starts a new run; None resumes the run from its last checkpoint.
+    With a scheduler `ticket`, the graph only starts once the run is admitted;
+    until then 'queued' events report the run's place in the queue.
+    If the client disconnects (or the response is torn down) before the run ends,
+    the run is cancelled, including its LLM calls and sandbox process, and the
+    reason is saved with its checkpoint.
+    With `timings`, a completed run ends with a 'timings' event summarizing where
+    its time went (per node, LLM and sandbox) and the tokens it used.
+    With `lean`, the events come from the graph's state updates instead of the
+    callback events of every runnable, and a node's event only carries the state
+    fields that changed since the previous one (see StateDelta).
+    """
+    _active_runs.add(run_id)
+    if ticket is not None:
+        # From here on the stream's cleanup gives the run slot back
+        ticket.claimed = True
+    events: asyncio.Queue = asyncio.Queue()
+    cancellation = {"reason": None}
+    graph_task = watchdog = None
+    metrics = None
+    # Sandbox output arrives as 'custom' chunks, tokens as 'messages' chunks
+    stream_mode = (["updates", "custom", "messages"] if stream_tokens else ["updates", "custom"]) if lean else None
+    delta = StateDelta()
+
+    def start_graph() -> asyncio.Task:
+        nonlocal metrics
+        metrics = RunMetrics()
+        task = asyncio.create_task(
+            _run_graph(inputs, run_id, events, metrics, stream_mode, persistent_kernel), name=f"agent-run-{run_id}"
+        )
+        if request is not None:
+            nonlocal watchdog
+            watchdog = asyncio.create_task(_watch_disconnect(request, task, cancellation))
+        return task
+
+    try:
+        if ticket is None or ticket.admitted.is_set():
+            graph_task = start_graph()
+
+        # Tell the client which run this is, so it can fetch or resume it later
+        yield {"type": "run", "data": {"run_id": run_id, "resumed": inputs is None}}
+
+        if graph_task is None:
+            async for position in ticket.wait_for_turn():
+                yield {"type": "queued", "data": {"position": position}}
+            graph_task = start_graph()
+
+        while (event := await events.get()) is not _END:
+            if isinstance(event, Exception):
+                raise event
+
+            if lean:
+                mode, chunk = event
+                if mode == "updates":
+                    for node_name, update in chunk.items():
+                        if node_name in STREAMED_NODES:
+                            yield {"type": node_name, **delta.diff(update or {})}
+                elif mode == "custom":
+                    yield chunk  # Already an event, e.g. 'execution_output'
+                else:
+                    message, metadata = chunk
+                    delta_type = TOKEN_STREAM_EVENTS.get(metadata.get("langgraph_node"))
+                    if delta_type and isinstance(message, AIMessageChunk) and message.content:
+                        yield {"type": delta_type, "data": {"delta": message.content}}
+                continue
+
+            kind = event["event"]
+
+            # Forward raw LLM tokens as they are generated (opt-in)
+            if kind == "on_chat_model_stream" and stream_tokens:
+                delta_type = TOKEN_STREAM_EVENTS.get(event.get("metadata", {}).get("langgraph_node"))
+                token = event["data"]["chunk"].content
+                if delta_type and token:
+                    yield {"type": delta_type, "data": {"delta": token}}
+                continue
+
+            # Sandbox output is relayed line by line while a step is still running
+            if kind == "on_custom_event" and event["name"] == "execution_output":
+                yield {"type": "execution_output", "data": event["data"]}
+                continue
+            
+            # We are primarily interested in the 'on_chain_end' event, which fires
+            # whenever a node in our graph finishes its execution.
+            if kind == "on_chain_end":
+                node_name = event["name"]  # The name of the node that just finished (e.g., "planner")
+                output = event["data"].get("output")
+                
+                # Skip routers and other internal chains
+                if node_name not in STREAMED_NODES:
+                    continue
+
+                # Send the data packet to the frontend.
+                # The 'type' corresponds to the node name, giving the frontend context.
+                # The 'data' is the actual output from that node.
+                yield {"type": node_name, "data": output}
+
+    except Exception as e:
+        # If any error occurs during the stream, send an error event to the frontend.
+        yield {"type": "error", "data": {"message": f"An error occurred in the agent stream: {str(e)}"}}
+    
+    finally:
+        _active_runs.discard(run_id)
+        if watchdog is not None:
+            watchdog.cancel()
+        if cancellation["reason"] is None and (graph_task is None or not graph_task.done()):
+            cancellation["reason"] = "event stream closed"
+        # Cleanup gets its own task: awaiting here would be interrupted if the response was cancelled
+        cleanup = asyncio.create_task(
+            _finish_run(graph_task, run_id, persistent_kernel, cancellation["reason"], ticket)
+        )
+        _cleanup_tasks.add(cleanup)
+        cleanup.add_done_callback(_cleanup_tasks.discard)
+
+    # Signal the end of the stream
+    if cancellation["reason"] is None:
+        run_duration.observe(time.perf_counter() - metrics.started)
+        if timings:
+            yield {"type": "timings", "data": metrics.summary()}
+        yield {"type": "stream_end", "data": {"message": "Agent processing complete."}}
+
+
+class RunStreamingResponse(StreamingResponse):
+    """
+    Event stream of a run that holds a scheduler ticket, or of a shared run.
+
+    The stream gives the run slot back when it ends, but Starlette can tear a
+    response down before ever advancing its body (e.g. the client leaves during
+    http.response.start), in which case the generator's cleanup never runs; the
+    ticket is released here instead. Likewise a client of a shared run stops
+    following it here, however the response ended.
+
+    Quiet streams get heartbeat comments, and with `gzip` the stream is
+    compressed, flushed after every event.
+    """
+
+    def __init__(self, content, ticket: Optional[RunTicket] = None, gzip: bool = False):
+        self.source = content
+        body = with_heartbeats(content, SSE_HEARTBEAT_INTERVAL)
+        headers = {"Cache-Control": "no-cache"}
+        if gzip:
+            body = gzip_frames(body, SSE_GZIP_LEVEL)
+            headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+        super().__init__(body, media_type="text/event-stream", headers=headers)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if isinstance(self.source, Subscriber):
+                self.source.unsubscribe()
+            if self.ticket is not None and not self.ticket.claimed:
+                self.ticket.release()
+
+
+def _admit_run(http_request: Request) -> RunTicket:
+    """Takes a place in the run queue for the calling client, or rejects the request with 429."""
+    client_id = http_request.headers.get("x-client-id") or (http_request.client.host if http_request.client else "anonymous")
+    try:
+        return run_scheduler.enqueue(client_id)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(RUN_QUEUE_RETRY_AFTER)})
+
+
+def _accepts_gzip(http_request: Request) -> bool:
+    return SSE_GZIP and "gzip" in http_request.headers.get("accept-encoding", "")
+
+
 # Define the endpoint for processing prompts.
 # We use .post() because the client is sending data (the prompt) to the server.
 @router.post("/process_prompt")
-async def process_prompt(request: PromptRequest):
+async def process_prompt(
+    request: PromptRequest,
+    http_request: Request,
+    stream_tokens: bool = Query(False, description="Also stream planner/coder tokens as plan_delta/code_delta events"),
+    timings: bool = Query(False, description="End the stream with a 'timings' event breaking down the run's latency"),
+    lean: bool = Query(False, description="Stream node events as the state fields they changed instead of whole outputs"),
+):
     """
     This endpoint receives a user's prompt and streams back the agent's thought process
     and results in real-time using Server-Sent Events (SSE).
 
     The stream sends JSON objects with a 'type' and 'data' field, allowing the
     frontend to dynamically update the UI based on the agent's current activity.
+    The first event ('run') carries the run id used by the /runs endpoints.
+
+    With `?stream_tokens=true`, the planner and coder output is additionally sent
+    token by token as it is generated. The final parsed result of each node is
+    still emitted when the node ends.
+
+    With `?timings=true`, the stream ends with a 'timings' event: time spent per
+    node, LLM calls, tokens and sandbox resource usage of the run.
+
+    With `?lean=true`, node events only carry the state fields that changed since
+    the previous event: `data` holds fields set to a new value, `merge` the new
+    keys of dict fields (e.g. step_results) and `append` the new items of list
+    fields. It is the cheaper mode for the backend when many streams are open.
+
+    Every event has an id; the events after a given one can be fetched again from
+    /runs/{run_id}/events. Quiet streams get ': ping' comments.
+
+    Runs are admitted by the run scheduler: when all run slots are busy the stream
+    sends 'queued' events with the run's position until it starts, and when the
+    queue is full the request is rejected with 429 and a Retry-After header.
+
+    With `coalesce` set, a request whose normalized prompt and options match a
+    coalesced run still in flight doesn't start another run: it receives that
+    run's events, starting with a replay of those already sent. The shared run is
+    cancelled once all of its clients have left.
     """
+    def start_run(ticket: RunTicket, watch: Optional[Request]):
+        run_id = uuid.uuid4().hex
 
-    async def event_stream():
-        """The generator function that yields events for the streaming response."""
-        try:
-            # The initial state for the LangGraph agent is the user's original prompt.
-            inputs = {"original_prompt": request.prompt}
-            
-            # Use astream_events to get a detailed, real-time feed of events from the graph.
-            # This is more powerful than a simple .stream() or .invoke() as it tells us
-            # exactly what's happening inside the agent's "mind".
-            async for event in agent_executor.astream_events(inputs, version="v1"):
-                kind = event["event"]
-                
-                # We are primarily interested in the 'on_chain_end' event, which fires
-                # whenever a node in our graph finishes its execution.
-                if kind == "on_chain_end":
-                    node_name = event["name"]  # The name of the node that just finished (e.g., "planner")
-                    output = event["data"].get("output")
-                    
-                    # Skip streaming for the internal router node
-                    if node_name == "router":
-                        continue
-
-                    # Prepare the data packet to send to the frontend
-                    # The 'type' corresponds to the node name, giving the frontend context.
-                    # The 'data' is the actual output from that node.
-                    response_data = {
-                        "type": node_name,
-                        "data": output
-                    }
-                    
-                    # Yield the data in the Server-Sent Event format: "data: {json_string}\n\n"
-                    # The two newlines are critical for the protocol.
-                    yield f"data: {json.dumps(response_data)}\n\n"
+        # The initial state for the LangGraph agent is the user's original prompt.
+        inputs = {
+            "original_prompt": request.prompt,
+            "run_id": run_id,
+            "use_cache": request.use_cache,
+            "pipeline": request.pipeline,
+            "parallel": request.parallel,
+            "persistent_kernel": request.persistent_kernel,
+        }
+        return agent_event_stream(inputs, run_id, stream_tokens, request.persistent_kernel, watch, ticket, timings, lean)
 
-        except Exception as e:
-            # If any error occurs during the stream, send an error event to the frontend.
-            error_data = {
-                "type": "error",
-                "data": {"message": f"An error occurred in the agent stream: {str(e)}"}
-            }
-            yield f"data: {json.dumps(error_data)}\n\n"
-        
-        finally:
-            # Signal the end of the stream
-            end_data = {
-                "type": "stream_end",
-                "data": {"message": "Agent processing complete."}
-            }
-            yield f"data: {json.dumps(end_data)}\n\n"
+    if request.coalesce:
+        leader_ticket = None
+
+        def start_shared_run():
+            nonlocal leader_ticket
+            leader_ticket = _admit_run(http_request)
+            # No disconnect watch: the run belongs to all of its clients, not the first one
+            return start_run(leader_ticket, None)
+
+        subscriber = run_coalescer.join(coalescing_key(request, stream_tokens, timings, lean), start_shared_run)
+        if leader_ticket is not None:
+            # The shared run owns the ticket, not the leader's response: its stream releases it
+            # once started, and a flight cancelled before its stream ever started releases it here
+            def release_unstarted():
+                if not leader_ticket.claimed:
+                    leader_ticket.release()
+
+            subscriber.flight.add_done_callback(release_unstarted)
+        return RunStreamingResponse(subscriber, gzip=_accepts_gzip(http_request))
 
     # Return a StreamingResponse, which keeps the HTTP connection open and sends
     # data as it's generated by the event_stream generator.
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
\ No newline at end of file
+    ticket = _admit_run(http_request)
+    return RunStreamingResponse(start_run(ticket, http_request), ticket, _accepts_gzip(http_request))
+
+
+async def _get_run_snapshot(run_id: str):
+    try:
+        snapshot = await graph.agent_executor.aget_state(run_config(run_id))
+    except ValueError:
+        raise HTTPException(status_code=503, detail="Run checkpointing is disabled.")
+    if not snapshot.values:
+        raise HTTPException(status_code=404, detail=f"Run '{run_id}' not found.")
+    return snapshot
+
+
+@router.get("/runs/{run_id}")
+async def get_run(run_id: str):
+    """
+    Returns the last checkpointed state of a run: its plan, the code and result of
+    every completed step, and whether it finished. Works after the client that
+    started the run has disconnected, and after a backend restart.
+    """
+    snapshot = await _get_run_snapshot(run_id)
+    values = snapshot.values
+    if run_id in _active_runs:
+        status = "running"
+    elif snapshot.next:
+        status = "cancelled" if values.get("cancellation_reason") else "interrupted"
+    else:
+        status = "failed" if values.get("error") else "completed"
+
+    return {
+        "run_id": run_id,
+        "status": status,
+        "next": list(snapshot.next),
+        "updated_at": snapshot.created_at,
+        "original_prompt": values.get("original_prompt"),
+        "plan": values.get("plan", []),
+        "current_step": values.get("current_step", 0),
+        "step_code": values.get("step_code", {}),
+        "step_results": values.get("step_results", {}),
+        "execution_result": values.get("execution_result"),
+        "error": values.get("error"),
+        "cancellation_reason": values.get("cancellation_reason"),
+    }
+
+
+@router.post("/runs/{run_id}/resume")
+async def resume_run(
+    run_id: str,
+    http_request: Request,
+    stream_tokens: bool = Query(False, description="Also stream planner/coder tokens as plan_delta/code_delta events"),
+    timings: bool = Query(False, description="End the stream with a 'timings' event breaking down the run's latency"),
+    lean: bool = Query(False, description="Stream node events as the state fields they changed instead of whole outputs"),
+):
+    """
+    Continues an interrupted run from its last completed step, streaming events
+    like /process_prompt. The plan and the steps that already ran are not redone,
+    but a persistent-kernel run re-runs their code in a fresh kernel first, so its
+    remaining steps find the variables the earlier ones defined.
+    Event ids continue from the run's earlier streams.
+    """
+    if run_id in _active_runs:
+        raise HTTPException(status_code=409, detail=f"Run '{run_id}' is still running.")
+    snapshot = await _get_run_snapshot(run_id)
+    if not snapshot.next:
+        raise HTTPException(status_code=409, detail=f"Run '{run_id}' has already finished.")
+
+    ticket = _admit_run(http_request)
+    return RunStreamingResponse(
+        agent_event_stream(
+            None, run_id, stream_tokens, bool(snapshot.values.get("persistent_kernel")), http_request, ticket, timings, lean
+        ),
+        ticket,
+        _accepts_gzip(http_request),
+    )
+
+
+@router.get("/runs/{run_id}/events")
+async def get_run_events(run_id: str, http_request: Request, last_event_id: Optional[int] = Header(None)):
+    """
+    Replays a run's events after the one whose id is in the Last-Event-ID header
+    (all kept events without it), then follows the run while it is still being
+    streamed. Only the recent events of recent runs are kept; following doesn't
+    keep a run alive once its own client has left.
+    """
+    log = event_logs.get(run_id)
+    if log is None:
+        raise HTTPException(status_code=404, detail=f"No events of run '{run_id}' are kept.")
+    return RunStreamingResponse(log.follow(last_event_id or 0), gzip=_accepts_gzip(http_request))
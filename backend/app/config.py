@@ -7,12 +7,132 @@ load_dotenv()
 # --- Core Settings ---
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
 
+# How long a cached /api/tags snapshot is considered fresh, and how often it is refreshed in the background
+OLLAMA_TAGS_TTL = float(os.getenv("OLLAMA_TAGS_TTL", "30"))
+OLLAMA_TAGS_REFRESH_INTERVAL = float(os.getenv("OLLAMA_TAGS_REFRESH_INTERVAL", "15"))
+
 # --- NEW: Multi-Model Configuration ---
 # Define the model for each specific task.
 PLANNER_MODEL = os.getenv("PLANNER_MODEL", "llama3.2:3b-instruct")
 CODER_MODEL = os.getenv("CODER_MODEL", "codellama:7b-instruct")
-ROUTER_MODEL = os.getenv("ROUTER_MODEL", "llama3.2:1b-instruct") # For future LLM-based routing
+ROUTER_MODEL = os.getenv("ROUTER_MODEL", "llama3.2:1b-instruct") # Classifies prompts for the planner fast path
+
+# --- Generation Options ---
+# Ollama options per model role. An empty value keeps the model's own default.
+# num_predict caps the tokens generated per call, so a runaway generation can't hold
+# the model indefinitely; num_ctx is also used when the model is loaded by the warmup.
+def _option(name: str, default: str, cast):
+    value = os.getenv(name, default).strip()
+    return cast(value) if value else None
+
+MODEL_OPTIONS = {
+    "planner": {
+        "num_predict": _option("PLANNER_NUM_PREDICT", "1024", int),
+        "num_ctx": _option("PLANNER_NUM_CTX", "", int),
+        "temperature": _option("PLANNER_TEMPERATURE", "0.2", float),
+    },
+    "coder": {
+        "num_predict": _option("CODER_NUM_PREDICT", "2048", int),
+        "num_ctx": _option("CODER_NUM_CTX", "", int),
+        "temperature": _option("CODER_TEMPERATURE", "0.2", float),
+    },
+    "router": {
+        "num_predict": _option("ROUTER_NUM_PREDICT", "4", int),  # Only a one-word label is expected
+        "num_ctx": _option("ROUTER_NUM_CTX", "", int),
+        "temperature": _option("ROUTER_TEMPERATURE", "0", float),
+    },
+}
+
+# --- Planner Fast Path ---
+# Short prompts without sequencing words are shown to the router model; those it labels
+# single-step get a one-step plan and skip the planner.
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "1") == "1"
+FAST_PATH_MAX_WORDS = int(os.getenv("FAST_PATH_MAX_WORDS", "40"))
+
+# --- Model Warmup ---
+# Models are loaded at startup and periodically re-pinned so the first request after idle doesn't pay the load.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # Any Ollama keep_alive value, e.g. "30m", "-1" for forever
+MODEL_WARMUP_ENABLED = os.getenv("MODEL_WARMUP_ENABLED", "1") == "1"
+MODEL_REPIN_INTERVAL = float(os.getenv("MODEL_REPIN_INTERVAL", "600"))  # Seconds between keep-alive re-pins
+# Roles whose models are preloaded and pinned; a pinned but unused model only takes memory from the others
+_DEFAULT_WARMUP_ROLES = "planner,coder,router" if FAST_PATH_ENABLED else "planner,coder"
+MODEL_WARMUP_ROLES = [r.strip() for r in os.getenv("MODEL_WARMUP_ROLES", _DEFAULT_WARMUP_ROLES).split(",") if r.strip()]
 
 # --- Paths ---
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
-EXECUTOR_SCRIPT_PATH = str(BASE_DIR / "backend" / "mcp_tools" / "secure_code_executor.py")
\ No newline at end of file
+EXECUTOR_SCRIPT_PATH = str(BASE_DIR / "backend" / "mcp_tools" / "secure_code_executor.py")
+
+# --- Executor Pool ---
+# Long-lived secure_code_executor MCP sessions shared by all graph runs.
+EXECUTOR_POOL_SIZE = int(os.getenv("EXECUTOR_POOL_SIZE", "2"))
+EXECUTOR_POOL_MAX_USES = int(os.getenv("EXECUTOR_POOL_MAX_USES", "50"))  # Recycle a session after N executions
+EXECUTOR_POOL_HEALTH_INTERVAL = float(os.getenv("EXECUTOR_POOL_HEALTH_INTERVAL", "30"))  # Seconds between idle pings
+EXECUTOR_POOL_ACQUIRE_TIMEOUT = float(os.getenv("EXECUTOR_POOL_ACQUIRE_TIMEOUT", "60"))
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "30"))  # Wall-clock limit per plan step, in seconds
+OUTPUT_RELAY_MAX_PENDING = int(os.getenv("OUTPUT_RELAY_MAX_PENDING", "1000"))  # Live output lines buffered per step
+MAX_PARALLEL_STEPS = int(os.getenv("MAX_PARALLEL_STEPS", "4"))  # Independent plan steps run at once (parallel mode)
+MAX_REPAIR_ATTEMPTS = int(os.getenv("MAX_REPAIR_ATTEMPTS", "2"))  # Code regenerations for a failing step before giving up
+
+# --- Sandbox Workers ---
+# Addresses of sandbox worker daemons (mcp_tools/sandbox_worker.py), "host:port" or "unix:/path",
+# comma-separated. When set, plan steps run on the least loaded healthy worker instead of the
+# local executor pool. Workers are checked every SANDBOX_WORKER_HEALTH_INTERVAL seconds.
+SANDBOX_WORKERS = [w.strip() for w in os.getenv("SANDBOX_WORKERS", "").split(",") if w.strip()]
+SANDBOX_WORKER_TOKEN = os.getenv("SANDBOX_WORKER_TOKEN", "")  # Shared secret, sent with every request
+SANDBOX_WORKER_HEALTH_INTERVAL = float(os.getenv("SANDBOX_WORKER_HEALTH_INTERVAL", "10"))
+SANDBOX_WORKER_CONNECT_TIMEOUT = float(os.getenv("SANDBOX_WORKER_CONNECT_TIMEOUT", "5"))
+
+# --- Admission Control ---
+# Runs beyond MAX_CONCURRENT_RUNS wait in a queue served round-robin across clients
+# (X-Client-ID header, else client address); /process_prompt answers 429 once it is full.
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "2"))
+MAX_QUEUED_RUNS = int(os.getenv("MAX_QUEUED_RUNS", "32"))
+MAX_QUEUED_RUNS_PER_CLIENT = int(os.getenv("MAX_QUEUED_RUNS_PER_CLIENT", "8"))
+RUN_QUEUE_RETRY_AFTER = int(os.getenv("RUN_QUEUE_RETRY_AFTER", "10"))  # Seconds suggested to rejected clients
+# Generation requests in flight per Ollama model; cached responses don't count
+OLLAMA_MAX_CONCURRENT_PER_MODEL = int(os.getenv("OLLAMA_MAX_CONCURRENT_PER_MODEL", "1"))
+
+# --- LLM Response Cache ---
+# Identical (model, messages, params) requests are answered from an in-memory LRU
+# backed by a SQLite file instead of calling Ollama again.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", str(BASE_DIR / "data" / "llm_cache.sqlite"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 3600)))  # Seconds; 0 disables expiry
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+# --- Task Memory ---
+# Successful runs are embedded with a local Ollama embedding model and kept in a file-backed
+# index. Past tasks at least MEMORY_EXAMPLE_THRESHOLD similar to a new prompt are shown to the
+# planner as examples; at MEMORY_REUSE_THRESHOLD the past plan and its code are reused without planning.
+MEMORY_ENABLED = os.getenv("MEMORY_ENABLED", "1") == "1"
+MEMORY_DIR = os.getenv("MEMORY_DIR", str(BASE_DIR / "data" / "memory"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+# Embeddings are cut to their first N dimensions (0 keeps them whole). Search reads the whole
+# matrix, so this sets its cost: 256 keeps it around a millisecond at 20k tasks. Suited to
+# Matryoshka-trained models such as nomic-embed-text.
+MEMORY_EMBEDDING_DIM = int(os.getenv("MEMORY_EMBEDDING_DIM", "256"))
+MEMORY_EXAMPLE_THRESHOLD = float(os.getenv("MEMORY_EXAMPLE_THRESHOLD", "0.75"))
+MEMORY_REUSE_THRESHOLD = float(os.getenv("MEMORY_REUSE_THRESHOLD", "0.95"))
+MEMORY_MAX_EXAMPLES = int(os.getenv("MEMORY_MAX_EXAMPLES", "2"))
+# Embedding requests run before planning, so they get a short timeout; after a failure the
+# memory is skipped for MEMORY_RETRY_INTERVAL seconds instead of delaying every run.
+MEMORY_EMBED_TIMEOUT = float(os.getenv("MEMORY_EMBED_TIMEOUT", "3"))
+MEMORY_RETRY_INTERVAL = float(os.getenv("MEMORY_RETRY_INTERVAL", "60"))
+
+# --- Run Checkpoints ---
+# Graph state is saved after every node so runs can be fetched and resumed after a disconnect or restart.
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS_ENABLED", "1") == "1"
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", str(BASE_DIR / "data" / "checkpoints.sqlite"))
+
+# --- Streaming ---
+# How often a running /process_prompt stream checks that its client is still connected.
+# Runs whose client went away are cancelled, including their LLM calls and sandbox processes.
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "1.0"))
+# A ': ping' comment is sent after SSE_HEARTBEAT_INTERVAL seconds without events, so proxies don't close quiet streams
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+# Gzip event streams for clients that accept it (worth it for large results over slow links)
+SSE_GZIP = os.getenv("SSE_GZIP", "0") == "1"
+SSE_GZIP_LEVEL = int(os.getenv("SSE_GZIP_LEVEL", "6"))
+# Events kept per run for clients reconnecting with Last-Event-ID, and how many runs are kept
+SSE_REPLAY_EVENTS = int(os.getenv("SSE_REPLAY_EVENTS", "1000"))
+SSE_REPLAY_RUNS = int(os.getenv("SSE_REPLAY_RUNS", "64"))
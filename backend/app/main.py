@@ -1,8 +1,43 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from .api import agent_router
+from .config import CHECKPOINTS_ENABLED, CHECKPOINT_DB_PATH
+from .orchestor import graph
+from .services import llm_services
+from .services.metrics_service import CallbackMetric, registry
+from .services.sandbox_service import executor_pool, output_relay, worker_dispatcher
+from .services.scheduler_service import run_scheduler
+from .services.single_flight_service import run_coalescer
+from .services.memory_service import task_memory
 
-app = FastAPI(title="Local Agent Backend")
+# --- Lifespan ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Starts long-lived backend resources on startup and releases them on shutdown."""
+    if worker_dispatcher.enabled:
+        # Code runs on the sandbox workers; no local executor is needed
+        await worker_dispatcher.start()
+    else:
+        # Warm up the secure executor sessions so the first plan step doesn't pay the spawn cost
+        await executor_pool.start()
+        await output_relay.start()
+    # Keep the Ollama model listing warm so node-level checks never wait on the network
+    llm_services.ollama_tags.start()
+    # Load the planner/coder/router models now and keep them pinned between requests
+    llm_services.start_model_warmup()
+    # Persist run state so interrupted runs can be resumed instead of restarted
+    if CHECKPOINTS_ENABLED:
+        await graph.enable_checkpointing(CHECKPOINT_DB_PATH)
+    yield
+    await graph.disable_checkpointing()
+    await llm_services.close_http_client()
+    await output_relay.close()
+    await executor_pool.close()
+    await worker_dispatcher.close()
+
+app = FastAPI(title="Local Agent Backend", lifespan=lifespan)
 
 # --- Middleware ---
 # Configure CORS to allow the Tauri frontend (and others) to communicate with the backend
@@ -14,9 +49,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Metrics ---
+# Service counters are read when /metrics is scraped; the histograms are recorded as runs go
+def _cache_lookups() -> dict:
+    cache = llm_services.get_response_cache()
+    if cache is None:
+        return {}
+    return {(result,): cache.stats[f"{result}s"] for result in ("memory_hit", "disk_hit", "miss")}
+
+registry.register(CallbackMetric(
+    "llm_cache_lookups_total", "LLM response cache lookups by result.", _cache_lookups, ["result"], kind="counter"))
+registry.register(CallbackMetric(
+    "agent_runs_active", "Runs currently holding a run slot.", lambda: {(): run_scheduler.active}))
+registry.register(CallbackMetric(
+    "agent_run_queue_depth", "Runs waiting for a run slot.", lambda: {(): run_scheduler.queued}))
+registry.register(CallbackMetric(
+    "agent_runs_rejected_total", "Runs rejected because the queue was full.",
+    lambda: {(): run_scheduler.stats["rejected"]}, kind="counter"))
+registry.register(CallbackMetric(
+    "agent_runs_coalesced_total", "Requests served by an identical run already in flight.",
+    lambda: {(): run_coalescer.stats["joined"]}, kind="counter"))
+registry.register(CallbackMetric(
+    "executor_sessions_idle", "Warm executor sessions waiting in the pool.", lambda: {(): executor_pool.status()["idle"]}))
+registry.register(CallbackMetric(
+    "sandbox_worker_up", "Whether each sandbox worker passed its last health check.",
+    lambda: {(worker.address,): int(worker.healthy) for worker in worker_dispatcher.workers}, ["worker"]))
+registry.register(CallbackMetric(
+    "sandbox_worker_in_flight", "Executions this backend has in flight on each sandbox worker.",
+    lambda: {(worker.address,): worker.in_flight for worker in worker_dispatcher.workers}, ["worker"]))
+
 # --- Routers ---
 app.include_router(agent_router.router, prefix="/api", tags=["Agent"])
 
 @app.get("/", tags=["Health Check"])
 def read_root():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/health", tags=["Health Check"])
+async def health():
+    status = await llm_services.health_check()
+    status["run_scheduler"] = run_scheduler.info()
+    status["coalesced_runs"] = run_coalescer.info()
+    status["task_memory"] = task_memory.info()
+    if worker_dispatcher.enabled:
+        status["sandbox_workers"] = worker_dispatcher.status()
+    return status
+
+@app.get("/metrics", tags=["Health Check"], response_class=PlainTextResponse)
+def metrics():
+    """Node, LLM, sandbox and queue metrics in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -1,31 +1,109 @@
+import logging
+import os
+from contextlib import AsyncExitStack
+from typing import Optional
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.graph import StateGraph, END
 from .state_models import AgentState
-from .nodes import planner_node, code_generator_node, sandbox_execution_node, router_node
+from .nodes import (
+    planner_node, code_generator_node, sandbox_execution_node, parallel_execution_node,
+    router_node, plan_router, batch_router,
+)
+from .nodes.classification import classification_node, classification_router
+from .nodes.error_diagnosis import error_diagnosis_node, repair_router
+from .nodes.memory_update import memory_update_node
+from ..services.metrics_service import timed_node
 
-def create_agent_graph() -> StateGraph:
-    """Builds and compiles the agent's LangGraph workflow."""
+logger = logging.getLogger(__name__)
+
+
+def create_agent_graph(checkpointer: Optional[BaseCheckpointSaver] = None) -> StateGraph:
+    """
+    Builds and compiles the agent's LangGraph workflow.
+
+    With a checkpointer, the state is saved after every node under the run's
+    thread id, so a run can be inspected and resumed after a disconnect or restart.
+    """
     workflow = StateGraph(AgentState)
 
-    # Add nodes to the graph
-    workflow.add_node("planner", planner_node)
-    workflow.add_node("generate_code", code_generator_node)
-    workflow.add_node("execute_code", sandbox_execution_node)
+    # Add nodes to the graph; every node is timed into the metrics
+    nodes = {
+        "classify": classification_node,
+        "planner": planner_node,
+        "generate_code": code_generator_node,
+        "execute_code": sandbox_execution_node,
+        "execute_batch": parallel_execution_node,
+        "diagnose_error": error_diagnosis_node,
+        "update_memory": memory_update_node,
+    }
+    for name, node in nodes.items():
+        workflow.add_node(name, timed_node(name, node))
 
     # Define the graph's edges (the flow of control)
-    workflow.set_entry_point("planner")
-    workflow.add_edge("planner", "generate_code")
+    workflow.set_entry_point("classify")
+    # Trivially single-step prompts skip the planner
+    workflow.add_conditional_edges(
+        "classify",
+        classification_router,
+        {"planner": "planner", "generate_code": "generate_code", "execute_batch": "execute_batch"}
+    )
+    # Parallel runs execute the plan as dependency batches instead of one step at a time
+    workflow.add_conditional_edges(
+        "planner",
+        plan_router,
+        {"generate_code": "generate_code", "execute_batch": "execute_batch", "end": END}
+    )
     workflow.add_edge("generate_code", "execute_code")
     
     # The conditional router decides whether to loop or end
     workflow.add_conditional_edges(
         "execute_code",
         router_node,
-        {"generate_code": "generate_code", "end": END}
+        {"generate_code": "generate_code", "diagnose_error": "diagnose_error", "update_memory": "update_memory", "end": END}
+    )
+    # A failed step is repaired and re-executed in place, without re-planning
+    workflow.add_conditional_edges(
+        "diagnose_error",
+        repair_router,
+        {"execute_code": "execute_code", "end": END}
     )
+    workflow.add_conditional_edges(
+        "execute_batch",
+        batch_router,
+        {"execute_batch": "execute_batch", "update_memory": "update_memory", "end": END}
+    )
+    # Completed runs are remembered for later similar prompts
+    workflow.add_edge("update_memory", END)
 
     # Compile the graph into a runnable application
-    app = workflow.compile()
+    app = workflow.compile(checkpointer=checkpointer)
     return app
 
-# A singleton instance of our compiled graph
-agent_executor = create_agent_graph()
\ No newline at end of file
+# A singleton instance of our compiled graph. enable_checkpointing() replaces it
+# with a checkpointed one, so callers should look it up as graph.agent_executor.
+agent_executor = create_agent_graph()
+
+_checkpointer_stack: Optional[AsyncExitStack] = None
+
+
+async def enable_checkpointing(db_path: str) -> None:
+    """Recompiles the singleton graph with a SQLite checkpointer (called from the app lifespan)."""
+    global agent_executor, _checkpointer_stack
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    stack = AsyncExitStack()
+    checkpointer = await stack.enter_async_context(AsyncSqliteSaver.from_conn_string(db_path))
+    await checkpointer.setup()
+    _checkpointer_stack = stack
+    agent_executor = create_agent_graph(checkpointer=checkpointer)
+    logger.info(f"Run checkpoints are stored in {db_path}")
+
+
+async def disable_checkpointing() -> None:
+    """Closes the checkpoint database and goes back to an uncheckpointed graph."""
+    global agent_executor, _checkpointer_stack
+    agent_executor = create_agent_graph()
+    if _checkpointer_stack is not None:
+        await _checkpointer_stack.aclose()
+        _checkpointer_stack = None
\ No newline at end of file
@@ -0,0 +1,533 @@
+import asyncio
+import json
+import logging
+import time
+from typing import List, Optional, Tuple
+from langchain_core.callbacks.manager import adispatch_custom_event
+from langchain_core.prompts import ChatPromptTemplate
+from langgraph.config import get_stream_writer
+from ..state_models import AgentState
+from .code_generation import RAW_CODE_CONTRACT, extract_code, kernel_context
+from .error_diagnosis import repair_step_code
+from .memory_update import memory_examples, reusable_plan
+from ...services import llm_services
+from ...services.llm_services import ModelRole
+from ...services.memory_service import task_memory
+from ...services.metrics_service import record_sandbox_run, record_session_wait
+from ...services.sandbox_service import (
+    call_executor_tool,
+    executor_pool,
+    output_relay,
+    split_resource_usage,
+    worker_dispatcher,
+)
+from ...services.security_service import is_code_safe
+from ...config import EXECUTOR_SCRIPT_PATH, MAX_PARALLEL_STEPS, MAX_REPAIR_ATTEMPTS, SANDBOX_TIMEOUT
+
+# --- LLM and Client Initialization ---
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- Node Definitions ---
+
+PLAN_FORMAT_SEQUENTIAL = "Respond with ONLY a single, valid JSON object with a single key 'plan', which is a list of strings."
+PLAN_FORMAT_DAG = (
+    "Respond with ONLY a single, valid JSON object with a single key 'plan', which is a list of objects "
+    'of the form {"step": "<programming task>", "depends_on": [<indices of earlier steps it needs>]}. '
+    "Steps are numbered from 0. Steps that do not need each other's results (e.g. fetching several "
+    "independent sources) must not depend on each other, so they can run in parallel."
+)
+
+# JSON schemas the planner output is constrained to (Ollama structured outputs), so the
+# response always parses; the format instructions above still tell the model what to put in it.
+PLAN_SCHEMA_SEQUENTIAL = {
+    "type": "object",
+    "properties": {"plan": {"type": "array", "items": {"type": "string"}, "minItems": 1}},
+    "required": ["plan"],
+}
+PLAN_SCHEMA_DAG = {
+    "type": "object",
+    "properties": {
+        "plan": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "step": {"type": "string"},
+                    "depends_on": {"type": "array", "items": {"type": "integer"}},
+                },
+                "required": ["step", "depends_on"],
+            },
+            "minItems": 1,
+        }
+    },
+    "required": ["plan"],
+}
+
+
+def parse_plan(plan_list: list) -> Tuple[List[str], List[List[int]]]:
+    """
+    Splits a planner 'plan' list into step descriptions and per-step dependencies.
+
+    Plain string steps depend on the step before them, so a flat plan keeps its
+    sequential order. Dependencies may only point at earlier steps, which keeps
+    the plan acyclic; anything else is dropped.
+    """
+    steps, dependencies = [], []
+    for index, item in enumerate(plan_list):
+        if isinstance(item, dict):
+            step = item.get("step") or item.get("description")
+            depends_on = item.get("depends_on") or []
+            if not isinstance(depends_on, list):
+                depends_on = [depends_on]
+            deps = sorted({d for d in depends_on if isinstance(d, int) and 0 <= d < index})
+        else:
+            step = item
+            deps = [index - 1] if index > 0 else []
+        if not isinstance(step, str) or not step.strip():
+            raise ValueError(f"Plan step {index} has no description.")
+        steps.append(step)
+        dependencies.append(deps)
+    return steps, dependencies
+
+
+async def planner_node(state: AgentState) -> dict:
+    """
+    Generates a step-by-step plan to address the user's prompt.
+
+    Similar past tasks from the task memory are shown to the planner as examples;
+    the plan of a near-identical one, and its code, is reused without calling the planner.
+    """
+    memories = await task_memory.recall(state.original_prompt)
+    reused = reusable_plan(memories, state.parallel, state.persistent_kernel)
+    if reused is not None:
+        return reused
+
+    planner_llm = await llm_services.aget_llm(ModelRole.PLANNER, use_cache=state.use_cache)
+
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", """You are an AI planner that creates programmatic solutions. 
+        
+        IMPORTANT CONSTRAINTS:
+        - Only create plans that can be executed programmatically with Python code
+        - Do NOT include manual steps like "open browser", "click on", "manually download"
+        - Focus on API calls, web scraping with requests/beautifulsoup, file operations
+        - Each step should be a specific programming task
+        - Available libraries: requests, beautifulsoup4, json, csv, pandas, numpy
+        - NO subprocess, os.system, or shell commands allowed
+        
+        For web scraping tasks:
+        - Use requests library to fetch web pages
+        - Use beautifulsoup4 to parse HTML
+        - Save results to files using standard Python file operations
+        
+        {format_instructions}"""),
+        ("user", "{examples}User Request: {prompt}")
+    ])
+    prompt = prompt_template.format_messages(
+        examples=memory_examples(memories, state.parallel),
+        prompt=state.original_prompt,
+        format_instructions=PLAN_FORMAT_DAG if state.parallel else PLAN_FORMAT_SEQUENTIAL,
+    )
+    response = await planner_llm.ainvoke(prompt, format=PLAN_SCHEMA_DAG if state.parallel else PLAN_SCHEMA_SEQUENTIAL)
+    logger.info(f"LLM Planner Raw Response: {response} (Type: {type(response)})")
+    
+    try:
+        # Handle both string and object responses
+        if hasattr(response, 'content'):
+            response_text = response.content
+        else:
+            response_text = str(response)
+            
+        plan_data = json.loads(response_text)
+        plan_list = plan_data.get('plan')
+        if not isinstance(plan_list, list) or not plan_list:
+            raise ValueError("JSON object from LLM did not contain a valid 'plan' list.")
+        if state.parallel:
+            steps, dependencies = parse_plan(plan_list)
+            return {"plan": steps, "plan_dependencies": dependencies}
+        return {"plan": plan_list}
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse LLM response as JSON: {e}")
+        logger.error(f"Raw response: {response_text}")
+        if getattr(response, "response_metadata", {}).get("done_reason") == "length":
+            logger.error("The plan was cut off by the planner's num_predict limit (PLANNER_NUM_PREDICT).")
+        return {"error": "The AI planner returned invalid JSON. Please try rephrasing your request."}
+    except Exception as e:
+        logger.error(f"CRITICAL: Failed to create a valid plan. Error: {e}", exc_info=True)
+        return {"error": "The AI planner failed to create a valid plan. Please try rephrasing."}
+
+
+async def generate_step_code(
+    plan: List[str],
+    step_index: int,
+    use_cache: bool = True,
+    kernel_history: Optional[List[str]] = None,
+) -> str:
+    """
+    Asks the coder model for the Python code of a single plan step.
+
+    `kernel_history` is the code already run in the run's persistent kernel, if any.
+    """
+    coder_llm = await llm_services.aget_llm(ModelRole.CODER, use_cache=use_cache)
+
+    current_plan_step = plan[step_index]
+    
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", """You are a Python code generation expert. 
+        
+        CRITICAL REQUIREMENTS:
+        - Write ONLY Python code that uses allowed libraries
+        - ALLOWED: requests, beautifulsoup4, json, csv, pandas, numpy, urllib, re, datetime
+        - FORBIDDEN: os, subprocess, shutil, sys.exit, exec, eval, import os, import subprocess
+        - Do NOT wrap code in functions or classes
+        - Write direct executable Python statements
+        - For web requests, always use 'requests' library
+        - For HTML parsing, use 'from bs4 import BeautifulSoup'
+        - Always include proper error handling with try/except blocks
+        - Always include print statements to show progress
+
+        {output_contract}
+        
+        Example for web scraping (a complete response):
+        import requests
+        from bs4 import BeautifulSoup
+        
+        try:
+            response = requests.get('https://example.com')
+            response.raise_for_status()
+            soup = BeautifulSoup(response.content, 'html.parser')
+            # ... parsing logic
+            print("Successfully completed task")
+        except Exception as e:
+            print(f"Error: {{e}}")"""),
+        ("user", "{session_context}Full Plan: {plan}\n\nWrite Python code for this specific step: '{current_step}'\n\nMake sure the code is safe and uses only allowed libraries.")
+    ])
+    prompt = prompt_template.format_messages(
+        plan=plan,
+        current_step=current_plan_step,
+        session_context=kernel_context(kernel_history),
+        output_contract=RAW_CODE_CONTRACT,
+    )
+    
+    response = await coder_llm.ainvoke(prompt)
+    return extract_code(response)
+
+
+async def code_generator_node(state: AgentState) -> dict:
+    """Generates Python code for the current step of the plan."""
+    if state.current_step in state.reused_code:
+        logger.info(f"Reusing the remembered code for step {state.current_step}")
+        code = state.reused_code[state.current_step]
+    # In pipelined mode the code may already have been generated while the previous step ran
+    elif state.speculative_code is not None and state.speculative_step == state.current_step:
+        logger.info(f"Using speculatively generated code for step {state.current_step}")
+        code = state.speculative_code
+    else:
+        code = await generate_step_code(
+            state.plan, state.current_step, use_cache=state.use_cache, kernel_history=state.kernel_history
+        )
+
+    logger.info(f"Generated Code for step {state.current_step}:\n{code}")
+    return {"generated_code": code, "speculative_code": None, "speculative_step": None}
+
+
+def execution_failed(result: Optional[str]) -> bool:
+    """True if an executor result reports a blocked, crashed or non-zero exit run."""
+    if not result:
+        return True
+    if result.startswith(("Execution Error", "Execution Blocked")):
+        return True
+    return not result.startswith("Execution Result (code 0)")
+
+
+async def _forward_execution_output(lines: asyncio.Queue, step: int) -> None:
+    """Publishes relayed sandbox output lines as 'execution_output' events while the step runs."""
+    try:
+        write = get_stream_writer()  # The graph's 'custom' stream, used by lean event streams
+    except RuntimeError:
+        write = None  # Not running inside a graph (e.g. the node was called directly)
+    while (item := await lines.get()) is not None:
+        data = {"step": step, **item}
+        if write is not None:
+            write({"type": "execution_output", "data": data})
+        try:
+            await adispatch_custom_event("execution_output", data)
+        except RuntimeError:
+            pass
+
+
+async def _collect_speculation(task: asyncio.Task, step: int, discard: bool) -> dict:
+    """Returns the state update for a speculative code generation, or nothing if it is discarded."""
+    if discard:
+        logger.info(f"Discarding speculative code for step {step}: the previous step failed")
+        task.cancel()
+        return {}
+    try:
+        return {"speculative_code": await task, "speculative_step": step}
+    except Exception as e:
+        logger.warning(f"Speculative code generation for step {step} failed: {e}")
+        return {}
+
+
+def _describe_execution_error(e: Exception, code: str) -> str:
+    """Logs a failed sandbox invocation and turns it into a user-facing error message."""
+    error_message = str(e) if str(e) else "An unknown error occurred during subprocess communication."
+    logger.error(f"Error during MCP tool invocation: {error_message}", exc_info=True)
+    logger.error(f"Failed code was:\n{code}")
+
+    # Provide more specific error information
+    if "Permission denied" in error_message:
+        error_message = "Permission denied - check file permissions and security settings"
+    elif "No such file" in error_message:
+        error_message = f"Executor script not found at: {EXECUTOR_SCRIPT_PATH}"
+    elif "Connection refused" in error_message:
+        error_message = "Cannot connect to MCP server - check if it's running"
+
+    return f"Failed to execute code: {error_message}"
+
+
+async def run_in_sandbox(code: str, step: int, kernel_id: Optional[str] = None) -> str:
+    """
+    Runs one step's code in a pooled executor session, or on a sandbox worker when
+    SANDBOX_WORKERS are configured, relaying its output while it runs.
+
+    With `kernel_id` the code runs as a cell of that persistent kernel, so it sees the
+    variables left by the run's earlier steps.
+    """
+    # The executor enforces the same rules; rejecting here avoids the sandbox round trip
+    is_safe, reason = is_code_safe(code)
+    if not is_safe:
+        logger.warning(f"Step {step} blocked before dispatch: {reason}")
+        return f"Execution Blocked by Static Analysis: {reason}"
+
+    if worker_dispatcher.enabled:
+        result = await _run_on_worker(code, step, kernel_id)
+    else:
+        result = await _run_on_executor(code, step, kernel_id)
+
+    result, usage = split_resource_usage(result)
+    if usage is not None:
+        record_sandbox_run(usage)
+    logger.info(f"MCP execution result for step {step}: {result}")
+    return result
+
+
+async def _run_on_worker(code: str, step: int, kernel_id: Optional[str]) -> str:
+    """Runs the code on a remote sandbox worker; its output comes back on the same connection."""
+    output_lines: asyncio.Queue = asyncio.Queue()
+    forwarder = asyncio.create_task(_forward_execution_output(output_lines, step))
+    try:
+        logger.info(f"Executing code on a sandbox worker for step {step}")
+        # Cancelling closes the worker connection, which kills the script there
+        result = await worker_dispatcher.execute(code, SANDBOX_TIMEOUT, kernel_id, output_lines)
+        try:
+            await asyncio.wait_for(forwarder, timeout=2)
+        except asyncio.TimeoutError:
+            pass
+    finally:
+        if not forwarder.done():
+            forwarder.cancel()
+    return result
+
+
+async def _run_on_executor(code: str, step: int, kernel_id: Optional[str]) -> str:
+    """Runs the code in a pooled local executor session."""
+    # Output is relayed line by line on a side channel while the script runs
+    stream_target, output_lines = await output_relay.open_stream()
+    forwarder = asyncio.create_task(_forward_execution_output(output_lines, step))
+    try:
+        # Borrow a warm executor session from the pool instead of spawning a new server
+        wait_started = time.perf_counter()
+        async with executor_pool.session() as session:
+            record_session_wait(time.perf_counter() - wait_started)
+            logger.info(f"Executing code via MCP for step {step}")
+            arguments = {"code": code, "timeout": SANDBOX_TIMEOUT, "stream_to": stream_target}
+            if kernel_id:
+                arguments["kernel_id"] = kernel_id
+            try:
+                result = await call_executor_tool(session, "execute_python_code", arguments)
+            except asyncio.CancelledError:
+                # Hanging up the relay makes the executor kill the script's process tree
+                logger.info(f"Step {step} cancelled: stopping its sandbox process")
+                output_relay.cancel_stream(stream_target)
+                raise
+        # The executor hangs up before returning; let the last relayed lines drain
+        if output_relay.is_connected(stream_target):
+            try:
+                await asyncio.wait_for(forwarder, timeout=2)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        output_relay.close_stream(stream_target)
+        if not forwarder.done():
+            forwarder.cancel()
+    return result
+
+
+
+async def restore_kernel(run_id: str, kernel_history: List[str]) -> None:
+    """
+    Re-runs the code already run in a run's persistent kernel, in order, in a fresh kernel.
+
+    The kernel is shut down when the run's stream ends and is lost on a backend
+    restart, while the checkpointed kernel_history still tells the coder its
+    variables are defined; a resumed run replays it before its next step.
+    """
+    logger.info(f"Restoring the kernel of run {run_id} from {len(kernel_history)} cells")
+    for cell, code in enumerate(kernel_history):
+        result = await run_in_sandbox(code, cell, kernel_id=run_id)
+        if execution_failed(result):
+            raise RuntimeError(f"Could not restore the kernel of run {run_id}: cell {cell} failed on replay:\n{result}")
+
+async def sandbox_execution_node(state: AgentState) -> dict:
+    """Executes the generated code using the secure MCP tool."""
+    code_to_run = state.generated_code
+    if not code_to_run:
+        return {"error": "No code was generated to execute."}
+
+    # Pipelined mode: start generating the next step's code while this one executes.
+    # Code generation only depends on the plan, so it can overlap with sandbox time.
+    next_step = state.current_step + 1
+    kernel_id = state.run_id if state.persistent_kernel else None
+    kernel_history = state.kernel_history + [code_to_run] if kernel_id else []
+    speculation = None
+    if state.pipeline and next_step < len(state.plan) and next_step not in state.reused_code:
+        speculation = asyncio.create_task(generate_step_code(
+            state.plan, next_step, use_cache=state.use_cache, kernel_history=kernel_history
+        ))
+
+    try:
+        result = await run_in_sandbox(code_to_run, state.current_step, kernel_id=kernel_id)
+        if execution_failed(result):
+            # Stay on this step; the router sends it to error diagnosis
+            if speculation is not None:
+                await _collect_speculation(speculation, next_step, discard=True)
+            return {"execution_result": result}
+
+        update = {
+            "execution_result": result,
+            "current_step": next_step,
+            "repair_attempts": 0,
+            "step_results": {**state.step_results, state.current_step: result},
+            "step_code": {**state.step_code, state.current_step: code_to_run},
+        }
+        if kernel_id:
+            update["kernel_history"] = kernel_history
+        if speculation is not None:
+            update.update(await _collect_speculation(speculation, next_step, discard=False))
+        return update
+
+    except asyncio.CancelledError:
+        if speculation is not None:
+            speculation.cancel()
+        raise
+    except Exception as e:
+        if speculation is not None:
+            speculation.cancel()
+        return {"error": _describe_execution_error(e, code_to_run)}
+
+
+def ready_steps(state: AgentState) -> List[int]:
+    """Steps that have not run yet and whose dependencies have all completed."""
+    done = state.step_results.keys()
+    return [
+        index for index, deps in enumerate(state.plan_dependencies)
+        if index not in done and all(dep in done for dep in deps)
+    ]
+
+
+async def parallel_execution_node(state: AgentState) -> dict:
+    """
+    Runs every plan step whose dependencies are satisfied, concurrently.
+
+    Each ready step gets its own code generation and sandbox execution, bounded by
+    MAX_PARALLEL_STEPS. The whole batch is joined before the node returns, so steps
+    depending on it only start on the next pass.
+    """
+    batch = ready_steps(state)
+    if not batch:
+        return {"error": "The plan has steps whose dependencies can never be satisfied."}
+
+    limit = asyncio.Semaphore(max(1, MAX_PARALLEL_STEPS))
+    # Cells of one kernel run one at a time; code generation still overlaps
+    kernel_id = state.run_id if state.persistent_kernel else None
+
+    async def run_step(index: int) -> Tuple[str, str]:
+        async with limit:
+            code = state.reused_code.get(index) or await generate_step_code(
+                state.plan, index, use_cache=state.use_cache, kernel_history=state.kernel_history
+            )
+            logger.info(f"Generated Code for step {index}:\n{code}")
+            for attempt in range(MAX_REPAIR_ATTEMPTS + 1):
+                if attempt:
+                    logger.info(f"Repairing step {index} (attempt {attempt}/{MAX_REPAIR_ATTEMPTS})")
+                    code = await repair_step_code(
+                        state.plan, index, code, result,
+                        use_cache=state.use_cache, kernel_history=state.kernel_history,
+                    )
+                try:
+                    result = await run_in_sandbox(code, index, kernel_id=kernel_id)
+                except Exception as e:
+                    raise RuntimeError(_describe_execution_error(e, code)) from e
+                if not execution_failed(result):
+                    return code, result
+            raise RuntimeError(f"still failed after {MAX_REPAIR_ATTEMPTS} repair attempt(s):\n{result}")
+
+    logger.info(f"Running plan steps {batch} concurrently")
+    outcomes = await asyncio.gather(*(run_step(index) for index in batch), return_exceptions=True)
+
+    step_results = dict(state.step_results)
+    step_code = dict(state.step_code)
+    kernel_history = list(state.kernel_history)
+    update = {}
+    for index, outcome in zip(batch, outcomes):
+        if isinstance(outcome, Exception):
+            update["error"] = f"Step {index}: {outcome}"
+            continue
+        step_code[index], step_results[index] = outcome
+        update["generated_code"] = step_code[index]
+        if kernel_id:
+            kernel_history.append(step_code[index])
+    update.update({"step_results": step_results, "step_code": step_code, "current_step": len(step_results)})
+    if kernel_id:
+        update["kernel_history"] = kernel_history
+    if "generated_code" in update:
+        update["execution_result"] = "\n\n".join(f"[step {i}] {step_results[i]}" for i in batch if i in step_results)
+    return update
+
+
+def router_node(state: AgentState) -> str:
+    """Determines the next step in the workflow."""
+    if state.error:
+        logger.error(f"Routing to end due to error: {state.error}")
+        return "end"
+    if execution_failed(state.execution_result):
+        logger.info(f"Step {state.current_step} failed. Routing to diagnose_error")
+        return "diagnose_error"
+    if state.current_step >= len(state.plan):
+        logger.info("Plan complete. Routing to update_memory.")
+        return "update_memory"
+    else:
+        logger.info(f"Routing to step {state.current_step}: generate_code")
+        return "generate_code"
+
+
+def plan_router(state: AgentState) -> str:
+    """Picks sequential or dependency-batched execution once the plan is ready."""
+    if state.error:
+        logger.error(f"Routing to end due to error: {state.error}")
+        return "end"
+    return "execute_batch" if state.parallel else "generate_code"
+
+
+def batch_router(state: AgentState) -> str:
+    """Keeps running dependency batches until every plan step has a result."""
+    if state.error:
+        logger.error(f"Routing to end due to error: {state.error}")
+        return "end"
+    if len(state.step_results) >= len(state.plan):
+        logger.info("Plan complete. Routing to update_memory.")
+        return "update_memory"
+    logger.info(f"{len(state.step_results)}/{len(state.plan)} steps done: running next batch")
+    return "execute_batch"
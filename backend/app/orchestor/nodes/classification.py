@@ -0,0 +1,76 @@
+import logging
+import re
+from langchain_core.prompts import ChatPromptTemplate
+from ..state_models import AgentState
+from ...services import llm_services
+from ...services.llm_services import ModelRole
+from ...config import FAST_PATH_ENABLED, FAST_PATH_MAX_WORDS
+
+logger = logging.getLogger(__name__)
+
+# Wording that announces several distinct steps; such prompts always go to the planner
+MULTI_STEP_MARKERS = re.compile(
+    r"\b(then|after that|afterwards|followed by|finally|step|steps|and also)\b"
+    r"|^\s*(\d+[.)]|[-*])\s",
+    re.IGNORECASE | re.MULTILINE,
+)
+SENTENCE_END = re.compile(r"[.!?;](\s|$)")
+
+
+def may_be_single_step(prompt: str) -> bool:
+    """
+    Cheap pre-filter for the fast path: short prompts with no sequencing words,
+    list items or several sentences. Only these are shown to the router model.
+    """
+    text = prompt.strip()
+    if not text or len(text.split()) > FAST_PATH_MAX_WORDS:
+        return False
+    if MULTI_STEP_MARKERS.search(text):
+        return False
+    return len(SENTENCE_END.findall(text)) <= 1
+
+
+async def is_single_step(prompt: str, use_cache: bool = True) -> bool:
+    """Asks the router model whether one short script fully handles the prompt."""
+    router_llm = await llm_services.aget_llm(ModelRole.ROUTER, use_cache=use_cache)
+
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", """You classify programming requests.
+
+        Answer SINGLE if one short Python script fully handles the request.
+        Answer MULTI if it needs several separate stages, e.g. fetching data and then processing it elsewhere.
+        Respond with ONLY the word SINGLE or MULTI."""),
+        ("user", "Request: {prompt}")
+    ])
+    response = await router_llm.ainvoke(prompt_template.format_messages(prompt=prompt))
+    answer = response.content if hasattr(response, "content") else str(response)
+    return answer.strip().upper().startswith("SINGLE")
+
+
+async def classification_node(state: AgentState) -> dict:
+    """
+    Sends trivially single-step prompts straight to code generation.
+
+    Prompts that pass the heuristic and that the router model labels SINGLE get
+    a one-step plan made of the prompt itself, skipping the planner round-trip.
+    Anything else, including a router failure, goes to the planner.
+    """
+    if not FAST_PATH_ENABLED or not may_be_single_step(state.original_prompt):
+        return {"fast_path": False}
+    try:
+        single = await is_single_step(state.original_prompt, use_cache=state.use_cache)
+    except Exception as e:
+        logger.warning(f"Router model unavailable, planning as usual: {e}")
+        return {"fast_path": False}
+    if not single:
+        return {"fast_path": False}
+
+    logger.info("Single-step prompt: skipping the planner")
+    return {"fast_path": True, "plan": [state.original_prompt.strip()], "plan_dependencies": [[]]}
+
+
+def classification_router(state: AgentState) -> str:
+    """Goes to the planner, or for a fast-path plan directly to execution like plan_router would."""
+    if not state.fast_path:
+        return "planner"
+    return "execute_batch" if state.parallel else "generate_code"
@@ -0,0 +1,45 @@
+import re
+from typing import List, Optional
+
+# Output format required from the coder model; extract_code() is the fallback for replies that break it
+RAW_CODE_CONTRACT = (
+    "OUTPUT FORMAT: your whole response is saved to a .py file and executed as is. "
+    "Respond with Python source only: no markdown code blocks, no explanations before or after the code."
+)
+
+# First fenced block of a reply. The opening fence must start a line; the closing one
+# may be missing if the reply was cut off by the num_predict limit.
+FENCED_BLOCK = re.compile(r"^```[ \t]*(?:python3?|py)?[ \t]*\n(.*?)(?:```|\Z)", re.DOTALL | re.IGNORECASE | re.MULTILINE)
+
+KERNEL_CONTEXT_TEMPLATE = (
+    "Code already executed in this session. Its variables and imports are still defined: "
+    "reuse them instead of fetching or reading the same data again.\n{code}\n\n"
+)
+
+
+def kernel_context(kernel_history: Optional[List[str]]) -> str:
+    """Prompt preamble listing the code already run in a persistent kernel, if any."""
+    if not kernel_history:
+        return ""
+    return KERNEL_CONTEXT_TEMPLATE.format(code="\n\n".join(kernel_history))
+
+
+def extract_code(response) -> str:
+    """
+    Returns the Python code from a coder model response.
+
+    Replies that follow RAW_CODE_CONTRACT are returned as is. Otherwise the
+    first markdown code block is used, dropping any prose around it.
+    """
+    # Handle both string and object responses
+    if hasattr(response, 'content'):
+        code = response.content.strip()
+    else:
+        code = str(response).strip()
+
+    # Keep only the code of a fenced reply
+    match = FENCED_BLOCK.search(code)
+    if match:
+        code = match.group(1)
+
+    return code.strip()
@@ -0,0 +1,86 @@
+import logging
+from typing import List, Optional
+from langchain_core.prompts import ChatPromptTemplate
+from ..state_models import AgentState
+from ...services import llm_services
+from ...services.llm_services import ModelRole
+from ...config import MAX_REPAIR_ATTEMPTS
+from .code_generation import RAW_CODE_CONTRACT, extract_code, kernel_context
+
+logger = logging.getLogger(__name__)
+
+# Only the end of a long failure output is sent back; that is where the traceback is
+MAX_FAILURE_CHARS = 4000
+
+
+async def repair_step_code(
+    plan: List[str],
+    step_index: int,
+    failing_code: str,
+    failure_output: str,
+    use_cache: bool = True,
+    kernel_history: Optional[List[str]] = None,
+) -> str:
+    """Asks the coder model to fix the code of one failed plan step, given its error output."""
+    coder_llm = await llm_services.aget_llm(ModelRole.CODER, use_cache=use_cache)
+
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", """You are a Python debugging expert. The code below was written for one step of a plan and failed.
+
+        Diagnose the failure from the error output and return a corrected version of the WHOLE code for this step.
+
+        CRITICAL REQUIREMENTS:
+        - Keep the same goal; change only what is needed to fix the failure
+        - ALLOWED: requests, beautifulsoup4, json, csv, pandas, numpy, urllib, re, datetime
+        - FORBIDDEN: os, subprocess, shutil, sys.exit, exec, eval, import os, import subprocess
+        - If the code was blocked by static analysis, rewrite it without the forbidden construct
+        - Always include print statements to show progress
+
+        {output_contract}"""),
+        ("user", "{session_context}Full Plan: {plan}\n\nStep: '{current_step}'\n\nFailing code:\n{code}\n\nError output:\n{failure}")
+    ])
+    prompt = prompt_template.format_messages(
+        session_context=kernel_context(kernel_history),
+        plan=plan,
+        current_step=plan[step_index],
+        code=failing_code,
+        failure=failure_output[-MAX_FAILURE_CHARS:],
+        output_contract=RAW_CODE_CONTRACT,
+    )
+
+    response = await coder_llm.ainvoke(prompt)
+    return extract_code(response)
+
+
+async def error_diagnosis_node(state: AgentState) -> dict:
+    """
+    Regenerates the code of the step that just failed from its traceback.
+
+    Only the failing step is redone: the plan and the results of earlier steps are
+    kept, and the run resumes at `current_step`. After MAX_REPAIR_ATTEMPTS tries the
+    run ends with an error instead.
+    """
+    step = state.current_step
+    if state.repair_attempts >= MAX_REPAIR_ATTEMPTS:
+        return {"error": f"Step {step} still failed after {state.repair_attempts} repair attempt(s):\n{state.execution_result}"}
+
+    attempt = state.repair_attempts + 1
+    logger.info(f"Repairing step {step} (attempt {attempt}/{MAX_REPAIR_ATTEMPTS})")
+    code = await repair_step_code(
+        state.plan,
+        step,
+        state.generated_code or "",
+        state.execution_result or "",
+        use_cache=state.use_cache,
+        kernel_history=state.kernel_history,
+    )
+    logger.info(f"Repaired Code for step {step}:\n{code}")
+    return {"generated_code": code, "repair_attempts": attempt}
+
+
+def repair_router(state: AgentState) -> str:
+    """Re-executes repaired code, or ends the run once repairs are exhausted."""
+    if state.error:
+        logger.error(f"Routing to end due to error: {state.error}")
+        return "end"
+    return "execute_code"
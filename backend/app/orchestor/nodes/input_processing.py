@@ -0,0 +1,31 @@
+import hashlib
+import json
+import re
+import unicodedata
+from ..state_models import PromptRequest
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Canonical form of a prompt for recognizing repeated submissions.
+
+    Only differences that can't change what the agent does are removed (Unicode
+    form, surrounding and repeated whitespace); case is kept, since file names
+    and identifiers in a prompt are case-sensitive.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", prompt)).strip()
+
+
+def coalescing_key(request: PromptRequest, stream_tokens: bool, timings: bool = False, lean: bool = False) -> str:
+    """Identifies the runs whose event streams are interchangeable: same normalized prompt and options."""
+    options = request.model_dump(exclude={"prompt", "coalesce"})
+    payload = json.dumps(
+        {
+            "prompt": normalize_prompt(request.prompt), "options": options,
+            "stream_tokens": stream_tokens, "timings": timings, "lean": lean,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
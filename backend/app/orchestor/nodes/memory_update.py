@@ -0,0 +1,76 @@
+import json
+import logging
+from typing import List, Optional
+from ..state_models import AgentState
+from ...services.memory_service import Memory, task_memory
+from ...config import MEMORY_REUSE_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Only the end of the final output is kept as the task's outcome
+MAX_OUTCOME_CHARS = 1000
+
+EXAMPLES_TEMPLATE = "Similar requests that were solved before, and the plans that worked:\n{examples}\n\n"
+
+
+def plan_json(memory: Memory, parallel: bool) -> str:
+    """A past plan in the JSON format the planner is asked for."""
+    if parallel:
+        dependencies = memory.plan_dependencies or [[index - 1] if index else [] for index in range(len(memory.plan))]
+        plan = [{"step": step, "depends_on": deps} for step, deps in zip(memory.plan, dependencies)]
+    else:
+        plan = memory.plan
+    return json.dumps({"plan": plan})
+
+
+def memory_examples(memories: List[tuple], parallel: bool) -> str:
+    """Planner prompt preamble with recalled past tasks as few-shot examples, if any."""
+    if not memories:
+        return ""
+    examples = "\n".join(
+        f"Request: {memory.prompt}\nPlan: {plan_json(memory, parallel)}" for _, memory in memories
+    )
+    return EXAMPLES_TEMPLATE.format(examples=examples)
+
+
+def reusable_plan(memories: List[tuple], parallel: bool, persistent_kernel: bool = False) -> Optional[dict]:
+    """
+    The plan of a recalled task similar enough to run again as is, as a state update.
+
+    The task's code comes with it, so its steps run without the coder; a step
+    whose code fails is repaired like freshly generated code. Code written for a
+    persistent kernel expects the variables of earlier steps, so it is only reused
+    by runs with the same kernel mode.
+    """
+    for score, memory in memories:
+        if score >= MEMORY_REUSE_THRESHOLD and memory.parallel == parallel:
+            logger.info(f"Reusing the plan of a past task ({score:.3f} similar): {memory.prompt!r}")
+            update = {"plan": memory.plan, "reused_plan": True}
+            if parallel:
+                update["plan_dependencies"] = memory.plan_dependencies
+            if len(memory.code) == len(memory.plan) and memory.persistent_kernel == persistent_kernel:
+                update["reused_code"] = dict(enumerate(memory.code))
+            return update
+    return None
+
+
+async def memory_update_node(state: AgentState) -> dict:
+    """
+    Stores a completed run in the task memory, so later similar prompts can use its plan and code.
+
+    Runs that failed, or that only replayed a remembered plan, are not stored.
+    """
+    if state.error or state.reused_plan or len(state.step_code) < len(state.plan):
+        return {}
+    memory = Memory(
+        prompt=state.original_prompt,
+        plan=state.plan,
+        code=[state.step_code[index] for index in range(len(state.plan))],
+        outcome=(state.execution_result or "")[-MAX_OUTCOME_CHARS:],
+        parallel=state.parallel,
+        persistent_kernel=state.persistent_kernel,
+        plan_dependencies=state.plan_dependencies if state.parallel else [],
+    )
+    if await task_memory.remember(memory):
+        logger.info("Run stored in the task memory")
+    return {}
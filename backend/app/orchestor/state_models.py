@@ -1,10 +1,16 @@
+from uuid import uuid4
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 # --- API Models (for communication with frontend) ---
 
 class PromptRequest(BaseModel):
     prompt: str
+    use_cache: bool = True  # Set to False to bypass the LLM response cache for this run
+    pipeline: bool = False  # Generate the next step's code while the current step executes
+    parallel: bool = False  # Plan steps with dependencies and run independent steps concurrently
+    persistent_kernel: bool = False  # Run all steps in one interpreter so they share variables
+    coalesce: bool = False  # Share the run of an identical prompt already in flight instead of starting another
 
 class AgentResponse(BaseModel):
     type: str  # e.g., "plan", "code", "result", "error"
@@ -14,9 +20,25 @@ class AgentResponse(BaseModel):
 
 class AgentState(BaseModel):
     original_prompt: str
+    run_id: str = Field(default_factory=lambda: uuid4().hex)
+    fast_path: bool = False  # The prompt was classified as single-step and not sent to the planner
     plan: List[str] = Field(default_factory=list)
+    reused_plan: bool = False  # The plan was taken from a near-identical past task in the task memory
+    reused_code: Dict[int, str] = Field(default_factory=dict)  # That task's code per step, run instead of generating it
     current_step: int = 0
     generated_code: Optional[str] = None
     execution_result: Optional[str] = None
     final_response: Optional[str] = None
-    error: Optional[str] = None
\ No newline at end of file
+    error: Optional[str] = None
+    use_cache: bool = True
+    pipeline: bool = False
+    speculative_code: Optional[str] = None  # Code generated ahead of time for speculative_step
+    speculative_step: Optional[int] = None
+    parallel: bool = False
+    plan_dependencies: List[List[int]] = Field(default_factory=list)  # Indices of earlier steps each step needs
+    repair_attempts: int = 0  # Repairs made so far for the current step
+    step_results: Dict[int, str] = Field(default_factory=dict)  # Execution result per completed step
+    step_code: Dict[int, str] = Field(default_factory=dict)  # Code that produced each completed step's result
+    persistent_kernel: bool = False
+    kernel_history: List[str] = Field(default_factory=list)  # Code already run in this run's kernel, in order
+    cancellation_reason: Optional[str] = None  # Why the run was stopped before finishing, e.g. "client disconnected"
\ No newline at end of file
@@ -0,0 +1,191 @@
+import asyncio
+import contextlib
+import json
+import zlib
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, Optional, Tuple
+from ..config import SSE_REPLAY_EVENTS, SSE_REPLAY_RUNS
+
+try:
+    import orjson
+except ImportError:  # The standard library encoder is used instead
+    orjson = None
+
+# Sent when a stream has been quiet for a while; comment lines are ignored by SSE clients
+HEARTBEAT = ": ping\n\n"
+
+_MISSING = object()
+
+
+def dumps(data) -> str:
+    """Compact JSON for event payloads, with orjson when it is installed."""
+    if orjson is not None:
+        # Non-string keys (step numbers) become strings, as with json.dumps
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def format_event(data: dict, event_id: Optional[int] = None) -> str:
+    """An SSE frame carrying `data` as JSON, with an `id:` line when an event id is given."""
+    frame = f"data: {dumps(data)}\n\n"
+    return frame if event_id is None else f"id: {event_id}\n{frame}"
+
+
+class StateDelta:
+    """
+    Reduces node updates to what changed since the previous event of the run.
+
+    Nodes return whole fields (every step's result so far, the kernel's full code
+    history), so each update is compared with the values already sent: unchanged
+    fields are left out, a dict that only gained or changed keys is sent as those
+    keys under `merge`, a list that only grew as its new items under `append`, and
+    anything else whole under `data`.
+    """
+
+    def __init__(self):
+        self.sent: Dict[str, object] = {}
+
+    def diff(self, update: dict) -> dict:
+        data, merge, append = {}, {}, {}
+        for field, value in update.items():
+            previous = self.sent.get(field, _MISSING)
+            if previous is not _MISSING and previous == value:
+                continue
+            if isinstance(value, dict) and isinstance(previous, dict) and previous.keys() <= value.keys():
+                merge[field] = {key: item for key, item in value.items() if previous.get(key, _MISSING) != item}
+            elif (
+                isinstance(value, list) and isinstance(previous, list)
+                and len(previous) < len(value) and value[:len(previous)] == previous
+            ):
+                append[field] = value[len(previous):]
+            else:
+                data[field] = value
+            self.sent[field] = value
+        event = {"data": data}
+        if merge:
+            event["merge"] = merge
+        if append:
+            event["append"] = append
+        return event
+
+
+class RunEventLog:
+    """
+    The recent events of one run, numbered from 1 across all of its streams.
+
+    A client that lost its stream asks for the events after the last id it saw
+    (Last-Event-ID): the ones still kept are replayed, then, while the run is
+    being streamed, new ones follow as they are emitted.
+    """
+
+    def __init__(self, max_events: int = SSE_REPLAY_EVENTS):
+        self.events: Deque[Tuple[int, str]] = deque(maxlen=max_events)
+        self.last_id = 0
+        self.live = False
+        self._changed = asyncio.Event()
+
+    def emit(self, data: dict) -> str:
+        """Numbers and encodes an event, keeps it and returns its frame."""
+        self.last_id += 1
+        frame = format_event(data, self.last_id)
+        self.events.append((self.last_id, frame))
+        self._notify()
+        return frame
+
+    def close(self) -> None:
+        """Marks the end of the run's current stream; followers return once they have caught up."""
+        self.live = False
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, after: int = 0) -> AsyncIterator[str]:
+        """Yields the kept frames with an id above `after`, then new ones until the stream ends."""
+        next_id = after + 1
+        while True:
+            while self.events and next_id <= self.last_id:
+                first_id = self.events[0][0]
+                next_id = max(next_id, first_id)  # Events older than the kept ones are gone
+                frame = self.events[next_id - first_id][1]
+                next_id += 1
+                yield frame
+            if not self.live:
+                return
+            await self._changed.wait()
+
+
+class EventLogs:
+    """Event logs of the most recent runs; the oldest logs of finished streams are dropped first."""
+
+    def __init__(self, max_runs: int = SSE_REPLAY_RUNS, max_events: int = SSE_REPLAY_EVENTS):
+        self.max_runs = max_runs
+        self.max_events = max_events
+        self._logs: "OrderedDict[str, RunEventLog]" = OrderedDict()
+
+    def open(self, run_id: str) -> RunEventLog:
+        """The log a new stream of the run emits into; a resumed run continues its earlier numbering."""
+        log = self._logs.pop(run_id, None) or RunEventLog(self.max_events)
+        log.live = True
+        self._logs[run_id] = log
+        excess = len(self._logs) - self.max_runs
+        if excess > 0:
+            for stale_id in [key for key, stale in self._logs.items() if not stale.live][:excess]:
+                del self._logs[stale_id]
+        return log
+
+    def get(self, run_id: str) -> Optional[RunEventLog]:
+        return self._logs.get(run_id)
+
+
+async def _aclose(iterator) -> None:
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+async def with_heartbeats(frames: AsyncIterator[str], interval: float) -> AsyncIterator[str]:
+    """Relays `frames`, adding a heartbeat comment whenever none was sent for `interval` seconds (0 disables)."""
+    iterator = frames.__aiter__()
+    pending: Optional[asyncio.Future] = None
+    try:
+        if interval <= 0:
+            async for frame in iterator:
+                yield frame
+            return
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield HEARTBEAT
+                continue
+            finished, pending = pending, None
+            try:
+                frame = finished.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+    finally:
+        if pending is not None:
+            # The source stops where it is waiting, as if the response itself had been cancelled
+            pending.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await pending
+        await _aclose(iterator)
+
+
+async def gzip_frames(frames: AsyncIterator[str], level: int = 6) -> AsyncIterator[bytes]:
+    """Gzips a stream, flushing after every frame so the client can decode each event as it arrives."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # +16: gzip container
+    try:
+        async for frame in frames:
+            yield compressor.compress(frame.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    finally:
+        await _aclose(frames)
+
+
+# Event logs of the runs streamed by this process
+event_logs = EventLogs()
@@ -1,20 +1,48 @@
+import asyncio
 import enum
-import requests
-from typing import Optional
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Sequence
+import httpx
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
 from langchain_ollama import OllamaLLM as Ollama
 from langchain_ollama.chat_models import ChatOllama
+from . import metrics_service
 from ..config import (
     OLLAMA_HOST,
     PLANNER_MODEL,
     CODER_MODEL,
-    ROUTER_MODEL # For future use
+    ROUTER_MODEL,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_MEMORY_ENTRIES,
+    OLLAMA_TAGS_TTL,
+    OLLAMA_TAGS_REFRESH_INTERVAL,
+    OLLAMA_KEEP_ALIVE,
+    MODEL_WARMUP_ENABLED,
+    MODEL_WARMUP_ROLES,
+    MODEL_REPIN_INTERVAL,
+    OLLAMA_MAX_CONCURRENT_PER_MODEL,
+    MODEL_OPTIONS,
 )
 
+logger = logging.getLogger(__name__)
+
 class ModelRole(enum.Enum):
     """Defines the role of the LLM for a specific task."""
     PLANNER = "planner"
     CODER = "coder"
-    ROUTER = "router" # For future complex routing logic
+    ROUTER = "router"  # Classifies prompts for the planner fast path
     # Add other roles like 'SAFETY_CHECKER' here in the future
 
 # A dictionary mapping roles to their configured model names
@@ -24,101 +52,267 @@ MODEL_MAP = {
     ModelRole.ROUTER: ROUTER_MODEL,
 }
 
-# Cache created LLM instances to avoid re-initializing
+# Ollama generation options of each role (num_predict, num_ctx, temperature); unset ones are left out
+ROLE_OPTIONS = {
+    role: {name: value for name, value in MODEL_OPTIONS.get(role.value, {}).items() if value is not None}
+    for role in ModelRole
+}
+
+# Cache created LLM instances to avoid re-initializing.
+# Keyed by (role, model_name, use_response_cache), since roles sharing a model may use different options.
 _llm_cache = {}
 
-def check_ollama_server(base_url: str) -> bool:
+
+def _dump_generations(generations: Sequence[Generation]) -> str:
+    return json.dumps([
+        {
+            "text": generation.text,
+            "generation_info": generation.generation_info,
+            "message": message_to_dict(generation.message) if isinstance(generation, ChatGeneration) else None,
+        }
+        for generation in generations
+    ], default=str)
+
+
+def _load_generations(raw: str) -> list:
+    generations = []
+    for item in json.loads(raw):
+        if item.get("message") is not None:
+            message = messages_from_dict([item["message"]])[0]
+            generations.append(ChatGeneration(message=message, generation_info=item.get("generation_info")))
+        else:
+            generations.append(Generation(text=item["text"], generation_info=item.get("generation_info")))
+    return generations
+
+
+class ResponseCache(BaseCache):
     """
-    Check if Ollama server is running and accessible.
-    
-    Args:
-        base_url: The base URL of the Ollama server
-        
-    Returns:
-        True if server is accessible, False otherwise
+    Two-tier cache of LLM responses: an in-memory LRU in front of a SQLite store.
+
+    LangChain calls lookup()/update() with the rendered messages as `prompt` and
+    the model name plus generation parameters as `llm_string`, so identical
+    (model, messages, params) requests are answered without hitting Ollama.
+    Entries expire after `ttl_seconds`, and the least recently used entries are
+    evicted once a tier holds more than its configured maximum.
     """
-    try:
-        # Test the /api/tags endpoint which lists available models
-        response = requests.get(f"{base_url}/api/tags", timeout=5)
-        return response.status_code == 200
-    except requests.RequestException:
-        return False
 
-def check_model_availability(base_url: str, model_name: str) -> bool:
+    def __init__(
+        self,
+        db_path: str,
+        ttl_seconds: float = LLM_CACHE_TTL,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        max_memory_entries: int = LLM_CACHE_MEMORY_ENTRIES,
+    ):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_memory_entries = max_memory_entries
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_access ON llm_responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, value: list, created_at: float) -> None:
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup_memory(self, key: str) -> Optional[list]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        value, created_at = entry
+        if self._expired(created_at):
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        self.stats["memory_hits"] += 1
+        return value
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[list]:
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            value = self._lookup_memory(key)
+            if value is not None:
+                return value
+
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or self._expired(row[1]):
+                if row is not None:
+                    self._conn.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.stats["misses"] += 1
+                return None
+
+            self._conn.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            value = _load_generations(row[0])
+            self._remember(key, value, row[1])
+            self.stats["disk_hits"] += 1
+            return value
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            self._remember(key, list(return_val), now)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, _dump_generations(return_val), now, now),
+            )
+            self.stats["writes"] += 1
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        count = self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM llm_responses WHERE key IN "
+                "(SELECT key FROM llm_responses ORDER BY last_access ASC LIMIT ?)",
+                (excess,),
+            )
+            self.stats["evictions"] += excess
+        if self.ttl_seconds > 0:
+            self._conn.execute("DELETE FROM llm_responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[list]:
+        # Memory hits are answered inline; only disk lookups go to a worker thread
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            value = self._lookup_memory(key)
+        if value is not None:
+            return value
+        return await super().alookup(prompt, llm_string)
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM llm_responses")
+            self._conn.commit()
+
+    def info(self) -> dict:
+        with self._lock:
+            disk_entries = self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "memory_entries": len(self._memory),
+            "disk_entries": disk_entries,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_response_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Returns the shared response cache, or None when LLM_CACHE_ENABLED is off."""
+    global _response_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _response_cache is None:
+        _response_cache = ResponseCache(LLM_CACHE_PATH)
+    return _response_cache
+
+# --- Per-Model Concurrency ---
+# Ollama serves a model's requests from one loaded copy; past a few concurrent
+# generations they only queue inside Ollama (or force a reload), so each model
+# gets a bounded number of requests in flight and the rest wait here.
+
+_model_slots: Dict[str, asyncio.Semaphore] = {}
+
+def model_slots(model_name: str) -> asyncio.Semaphore:
+    """Returns the semaphore bounding concurrent generations for one model."""
+    if model_name not in _model_slots:
+        _model_slots[model_name] = asyncio.Semaphore(OLLAMA_MAX_CONCURRENT_PER_MODEL)
+    return _model_slots[model_name]
+
+
+class ScheduledChatOllama(ChatOllama):
     """
-    Check if a specific model is available on the Ollama server.
-    
-    Args:
-        base_url: The base URL of the Ollama server
-        model_name: The name of the model to check
-        
-    Returns:
-        True if model is available, False otherwise
+    ChatOllama that waits for a free slot of its model before calling Ollama, and
+    records each generation's latency and token counts in the metrics.
     """
-    try:
-        response = requests.get(f"{base_url}/api/tags", timeout=5)
-        if response.status_code == 200:
-            models = response.json().get('models', [])
-            available_models = [model['name'] for model in models]
-            return model_name in available_models
-        return False
-    except requests.RequestException:
-        return False
-
-def get_llm(role: ModelRole, verify_connection: bool = True) -> ChatOllama:
+
+    async def _acreate_chat_stream(self, messages, stop=None, **kwargs):
+        # Both ainvoke() and astream() end up here; cache hits never do
+        start_time = time.perf_counter()
+        final_part = None
+        try:
+            async with model_slots(self.model):
+                async for part in super()._acreate_chat_stream(messages, stop, **kwargs):
+                    if not isinstance(part, str) and part.get("done"):
+                        final_part = part  # Carries Ollama's token counts and durations
+                    yield part
+        finally:
+            metrics_service.record_llm_call(self.model, time.perf_counter() - start_time, final_part)
+
+
+def get_llm(role: ModelRole, use_cache: bool = True) -> ChatOllama:
     """
     Retrieves a pre-configured Ollama LLM instance for a specific role.
 
     This function acts as a factory and cache for our LLM models, ensuring that
     we use the right model for the right task without re-initializing it every time.
+    It doesn't contact Ollama; aget_llm() checks the server and model first.
 
     Args:
         role: The ModelRole enum specifying the task for the LLM.
-        verify_connection: Whether to verify server connection before creating instance.
+        use_cache: Whether identical requests may be answered from the response cache.
+            Pass False to always call Ollama.
 
     Returns:
         A configured instance of the Ollama client.
         
     Raises:
         ValueError: If no model is configured for the role.
-        ConnectionError: If Ollama server is not accessible.
-        RuntimeError: If the specified model is not available.
     """
     model_name = MODEL_MAP.get(role)
     if not model_name:
         raise ValueError(f"No model configured for role: {role.name}")
     
-    # Check cache first
-    if model_name in _llm_cache:
-        return _llm_cache[model_name]
+    response_cache = get_response_cache() if use_cache else None
+    cache_key = (role, model_name, response_cache is not None)
 
-    # Verify server connection if requested
-    if verify_connection:
-        if not check_ollama_server(OLLAMA_HOST):
-            raise ConnectionError(
-                f"Ollama server is not accessible at {OLLAMA_HOST}. "
-                f"Please ensure Ollama is running and accessible."
-            )
-        
-        if not check_model_availability(OLLAMA_HOST, model_name):
-            raise RuntimeError(
-                f"Model '{model_name}' is not available on Ollama server. "
-                f"Please pull the model using: ollama pull {model_name}"
-            )
+    # Check cache first
+    if cache_key in _llm_cache:
+        return _llm_cache[cache_key]
 
     # If not in cache, create, configure, and cache it
     print(f"INFO: Initializing LLM for role '{role.name}' with model '{model_name}'...")
     
     try:
-        llm_instance = ChatOllama(
+        llm_instance = ScheduledChatOllama(
             model=model_name, 
             base_url=OLLAMA_HOST,
             timeout=30,  # Add timeout for better error handling
-            # Add other parameters as needed
-            # temperature=0.7,
-            # num_ctx=4096,
+            cache=response_cache if response_cache is not None else False,
+            keep_alive=OLLAMA_KEEP_ALIVE,  # Keep the model loaded between sparse requests
+            **ROLE_OPTIONS[role],
         )
-        _llm_cache[model_name] = llm_instance
+        _llm_cache[cache_key] = llm_instance
         print(f"INFO: Successfully initialized LLM for role '{role.name}'")
         return llm_instance
     except Exception as e:
@@ -131,50 +325,284 @@ def clear_llm_cache():
     _llm_cache.clear()
     print("INFO: LLM cache cleared")
 
-def get_available_models() -> Optional[list]:
+# --- Async Ollama Checks ---
+# Model availability is read from one shared /api/tags snapshot, fetched with a
+# pooled async HTTP client, instead of a blocking request per check.
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returns the shared async HTTP client used for Ollama management calls."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=OLLAMA_HOST,
+            timeout=httpx.Timeout(5.0),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+        )
+    return _http_client
+
+
+class OllamaTagsCache:
     """
-    Get list of available models from Ollama server.
-    
-    Returns:
-        List of available model names, or None if server is not accessible.
+    A TTL-cached snapshot of Ollama's /api/tags listing.
+
+    Fresh snapshots are served directly. A stale snapshot is still served while a
+    single background refresh runs, so callers only ever wait for the network
+    when no snapshot exists yet. Concurrent refreshes are coalesced into one request.
     """
-    try:
-        response = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=5)
-        if response.status_code == 200:
-            models = response.json().get('models', [])
-            return [model['name'] for model in models]
-        return None
-    except requests.RequestException:
-        return None
+
+    def __init__(self, ttl_seconds: float = OLLAMA_TAGS_TTL):
+        self.ttl_seconds = ttl_seconds
+        self.server_ok = False
+        self.models: list = []
+        self.fetched_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    @property
+    def fresh(self) -> bool:
+        return self.fetched_at is not None and time.monotonic() - self.fetched_at < self.ttl_seconds
+
+    async def _fetch(self) -> None:
+        try:
+            response = await get_http_client().get("/api/tags")
+            if response.status_code == 200:
+                self.models = [model['name'] for model in response.json().get('models', [])]
+                self.server_ok = True
+            else:
+                self.server_ok = False
+        except httpx.HTTPError:
+            self.server_ok = False
+        self.fetched_at = time.monotonic()
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._fetch())
+        return self._refresh_task
+
+    async def refresh(self) -> None:
+        """Fetches a new snapshot now, joining a refresh already in flight."""
+        await asyncio.shield(self._start_refresh())
+
+    async def get(self) -> "OllamaTagsCache":
+        """Returns the snapshot, refreshing it first only if none exists yet."""
+        if self.fetched_at is None:
+            await self.refresh()
+        elif not self.fresh:
+            self._start_refresh()
+        return self
+
+    def is_available(self, model_name: str) -> bool:
+        return self.server_ok and model_name in self.models
+
+    def start(self, interval: float = OLLAMA_TAGS_REFRESH_INTERVAL) -> None:
+        """Keeps the snapshot warm by refreshing it every `interval` seconds."""
+        if self._loop_task is None and interval > 0:
+            self._loop_task = asyncio.create_task(self._refresh_loop(interval), name="ollama-tags-refresh")
+
+    async def stop(self) -> None:
+        for task in (self._loop_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._loop_task = self._refresh_task = None
+
+    async def _refresh_loop(self, interval: float) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(interval)
+
+
+# A singleton snapshot shared by every request
+ollama_tags = OllamaTagsCache()
+
+async def aget_llm(role: ModelRole, verify_connection: bool = True, use_cache: bool = True) -> ChatOllama:
+    """
+    Returns get_llm()'s instance for a role, for use inside graph nodes.
+
+    With verify_connection, the server and the model are checked against the
+    cached /api/tags snapshot first, so the checks never block the event loop.
+
+    Raises:
+        ValueError: If no model is configured for the role.
+        ConnectionError: If Ollama server is not accessible.
+        RuntimeError: If the specified model is not available.
+    """
+    model_name = MODEL_MAP.get(role)
+    if not model_name:
+        raise ValueError(f"No model configured for role: {role.name}")
+
+    if verify_connection:
+        tags = await ollama_tags.get()
+        if not tags.server_ok:
+            # The snapshot may predate Ollama starting up; re-check once before failing
+            await tags.refresh()
+        if not tags.server_ok:
+            raise ConnectionError(
+                f"Ollama server is not accessible at {OLLAMA_HOST}. "
+                f"Please ensure Ollama is running and accessible."
+            )
+        if not tags.is_available(model_name):
+            await tags.refresh()
+        if not tags.is_available(model_name):
+            raise RuntimeError(
+                f"Model '{model_name}' is not available on Ollama server. "
+                f"Please pull the model using: ollama pull {model_name}"
+            )
+
+    return get_llm(role, use_cache=use_cache)
+
+class ModelWarmer:
+    """
+    Preloads the models of the roles in use and keeps them resident in Ollama.
+
+    An empty /api/generate request loads a model without generating anything
+    and resets its keep_alive timer. The warmer does that for every distinct
+    model of `roles` (MODEL_WARMUP_ROLES by default) at startup and again every
+    `repin_interval` seconds, and tracks which models Ollama currently has
+    loaded (via /api/ps).
+    """
+
+    def __init__(
+        self,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+        repin_interval: float = MODEL_REPIN_INTERVAL,
+        roles: Optional[Iterable[ModelRole]] = None,
+    ):
+        self.keep_alive = keep_alive
+        self.repin_interval = repin_interval
+        if roles is None:
+            roles = [ModelRole(role) for role in MODEL_WARMUP_ROLES]
+        self.status = {
+            model_name: {"warm": False, "last_warmed": None, "load_seconds": None, "error": None}
+            for model_name in {MODEL_MAP[role] for role in roles}
+        }
+        # Ollama reloads a model whose context size changes, so warm it with the size it is used with
+        self.load_options = {
+            MODEL_MAP[role]: {"num_ctx": ROLE_OPTIONS[role]["num_ctx"]}
+            for role in roles
+            if "num_ctx" in ROLE_OPTIONS[role]
+        }
+        self._task: Optional[asyncio.Task] = None
+
+    async def warm(self, model_name: str) -> bool:
+        """Loads (or re-pins) a single model. Returns True on success."""
+        entry = self.status.setdefault(model_name, {"warm": False, "last_warmed": None, "load_seconds": None, "error": None})
+        start_time = time.monotonic()
+        try:
+            request = {"model": model_name, "keep_alive": self.keep_alive}
+            if model_name in self.load_options:
+                request["options"] = self.load_options[model_name]
+            # Loading a large model from disk can take minutes on slow machines
+            response = await get_http_client().post(
+                "/api/generate",
+                json=request,
+                timeout=httpx.Timeout(300.0, connect=5.0),
+            )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            entry.update(warm=False, error=str(e) or type(e).__name__)
+            logger.warning(f"Failed to warm model '{model_name}': {entry['error']}")
+            return False
+        entry.update(
+            warm=True,
+            last_warmed=time.time(),
+            load_seconds=round(time.monotonic() - start_time, 2),
+            error=None,
+        )
+        return True
+
+    async def warm_all(self) -> None:
+        await asyncio.gather(*(self.warm(model_name) for model_name in self.status))
+
+    async def refresh_loaded(self) -> None:
+        """Updates the warm flags from the models Ollama reports as loaded (before each repin)."""
+        try:
+            response = await get_http_client().get("/api/ps")
+            response.raise_for_status()
+        except httpx.HTTPError:
+            return
+        loaded = {model['name'] for model in response.json().get('models', [])}
+        for model_name, entry in self.status.items():
+            entry["warm"] = model_name in loaded
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="model-warmer")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await self.warm_all()
+            if self.repin_interval <= 0:
+                return
+            await asyncio.sleep(self.repin_interval)
+            await self.refresh_loaded()
+
+
+# A singleton warmer started by the app lifespan when MODEL_WARMUP_ENABLED is set
+model_warmer = ModelWarmer()
+
+def start_model_warmup() -> None:
+    if MODEL_WARMUP_ENABLED:
+        model_warmer.start()
+
+async def close_http_client() -> None:
+    """Stops the background tasks and closes the shared HTTP client."""
+    global _http_client
+    await model_warmer.stop()
+    await ollama_tags.stop()
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
 
 # Health check function for the entire system
-def health_check() -> dict:
+async def health_check() -> dict:
     """
     Perform a health check of the LLM system.
+
+    Served from the cached /api/tags snapshot and the warm flags kept by the
+    model warmer's repin loop, so it costs at most one request.
     
     Returns:
         Dictionary containing health status information.
     """
+    tags = await ollama_tags.get()
     status = {
-        "ollama_server": False,
+        "ollama_server": tags.server_ok,
         "configured_models": {},
         "available_models": [],
-        "cache_size": len(_llm_cache)
+        "cache_size": len(_llm_cache),
+        # Counting the disk entries is a SQLite query, kept off the event loop
+        "response_cache": await asyncio.to_thread(get_response_cache().info) if LLM_CACHE_ENABLED else None,
+        "snapshot_age": round(time.monotonic() - tags.fetched_at, 2) if tags.fetched_at is not None else None,
     }
     
-    # Check server
-    status["ollama_server"] = check_ollama_server(OLLAMA_HOST)
-    
     if status["ollama_server"]:
         # Get available models
-        status["available_models"] = get_available_models() or []
-        
+        status["available_models"] = list(tags.models)
+
+
         # Check each configured model
         for role, model_name in MODEL_MAP.items():
             status["configured_models"][role.name] = {
                 "model_name": model_name,
-                "available": check_model_availability(OLLAMA_HOST, model_name),
-                "cached": model_name in _llm_cache
+                "available": tags.is_available(model_name),
+                "cached": any(name == model_name for _, name, _ in _llm_cache),
+                "warm": model_warmer.status.get(model_name, {}).get("warm", False),
+                "last_warmed": model_warmer.status.get(model_name, {}).get("last_warmed"),
             }
     
-    return status
\ No newline at end of file
+    return status
@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+import httpx
+import numpy as np
+from ..config import (
+    EMBEDDING_MODEL,
+    MEMORY_DIR,
+    MEMORY_EMBEDDING_DIM,
+    MEMORY_EMBED_TIMEOUT,
+    MEMORY_ENABLED,
+    MEMORY_EXAMPLE_THRESHOLD,
+    MEMORY_MAX_EXAMPLES,
+    MEMORY_RETRY_INTERVAL,
+)
+from .llm_services import get_http_client
+
+logger = logging.getLogger(__name__)
+
+# Rows preallocated when the vector file is created; it doubles whenever it fills up
+INITIAL_CAPACITY = 1024
+
+
+@dataclass
+class Memory:
+    """A past successful task: what was asked, how it was planned and the code that ran."""
+    prompt: str
+    plan: List[str]
+    code: List[str]
+    outcome: str
+    parallel: bool = False
+    persistent_kernel: bool = False  # The code relies on variables left by earlier steps
+    plan_dependencies: List[List[int]] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+
+
+class VectorIndex:
+    """
+    Append-only store of unit-length embeddings with cosine top-k search.
+
+    Vectors live in a float32 matrix memory-mapped from `vectors.f32`, so the index
+    is persistent and opening it doesn't read it into memory; the file is grown by
+    doubling. Each row's Memory is a line of `entries.jsonl`, and `meta.json`
+    records how many rows are complete, which makes a crash in the middle of an
+    append lose only that append.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._entries_path = os.path.join(directory, "entries.jsonl")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self.dim: Optional[int] = None
+        self.count = 0
+        self.entries: List[Memory] = []
+        self._matrix: Optional[np.memmap] = None
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        with open(self._entries_path) as f:
+            entries = [Memory(**json.loads(line)) for line in f if line.strip()]
+        self.count = min(meta["count"], len(entries))
+        self.entries = entries[:self.count]
+        self._map(os.path.getsize(self._vectors_path) // (4 * self.dim))
+        if len(entries) > self.count:
+            self._rewrite_entries()  # Drop the half-written append of a crash
+
+    def _map(self, capacity: int) -> None:
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def _rewrite_entries(self) -> None:
+        with open(self._entries_path, "w") as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry.__dict__) + "\n")
+
+    def _write_meta(self) -> None:
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "count": self.count}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def add(self, vector, entry: Memory) -> None:
+        vector = _normalize(vector)
+        if self.dim is None:
+            self.dim = len(vector)
+            with open(self._vectors_path, "wb") as f:
+                f.truncate(INITIAL_CAPACITY * 4 * self.dim)
+            open(self._entries_path, "w").close()
+            self._map(INITIAL_CAPACITY)
+        elif len(vector) != self.dim:
+            raise ValueError(f"Embedding has {len(vector)} dimensions, the index stores {self.dim}.")
+
+        if self.count == self._matrix.shape[0]:
+            self._matrix.flush()
+            capacity = self._matrix.shape[0] * 2
+            self._matrix = None
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(capacity * 4 * self.dim)
+            self._map(capacity)
+
+        self._matrix[self.count] = vector
+        self._matrix.flush()
+        with open(self._entries_path, "a") as f:
+            f.write(json.dumps(entry.__dict__) + "\n")
+        self.entries.append(entry)
+        self.count += 1
+        self._write_meta()
+
+    def search(self, vector, k: int = 3) -> List[tuple]:
+        """The `k` most similar entries as (cosine similarity, Memory), best first."""
+        if self.count == 0 or len(vector) != self.dim:
+            return []
+        scores = self._matrix[:self.count] @ _normalize(vector)
+        k = min(k, self.count)
+        # Partial selection is O(n); only the k winners are sorted
+        top = np.argpartition(scores, self.count - k)[self.count - k:]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.entries[i]) for i in top]
+
+
+def _normalize(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+async def embed(text: str) -> List[float]:
+    """Embeds a text with the local Ollama embedding model (EMBEDDING_MODEL)."""
+    response = await get_http_client().post(
+        "/api/embed",
+        json={"model": EMBEDDING_MODEL, "input": text},
+        timeout=httpx.Timeout(MEMORY_EMBED_TIMEOUT),
+    )
+    response.raise_for_status()
+    return response.json()["embeddings"][0]
+
+
+class TaskMemory:
+    """
+    Long-term memory of successful runs, searched by prompt similarity.
+
+    Runs entirely locally (Ollama embeddings and a file-backed index), so it works
+    without the Chroma service. The index is opened on first use, in a directory
+    per embedding model and size since other embeddings can't be compared.
+    Failures (e.g. the embedding model isn't pulled) are logged and the run goes
+    on without memory; the memory is then skipped for `retry_interval` seconds,
+    so runs don't each wait for the embedding request to fail again.
+    """
+
+    def __init__(
+        self,
+        directory: str = MEMORY_DIR,
+        model: str = EMBEDDING_MODEL,
+        dim: int = MEMORY_EMBEDDING_DIM,
+        enabled: bool = MEMORY_ENABLED,
+        retry_interval: float = MEMORY_RETRY_INTERVAL,
+    ):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", model) + (f"-{dim}" if dim > 0 else "")
+        self.directory = os.path.join(directory, name)
+        self.dim = dim
+        self.enabled = enabled
+        self.retry_interval = retry_interval
+        self.embed = embed
+        self._index: Optional[VectorIndex] = None
+        self._unavailable_until = 0.0
+
+    @property
+    def index(self) -> VectorIndex:
+        if self._index is None:
+            self._index = VectorIndex(self.directory)
+        return self._index
+
+    async def recall(self, prompt: str, k: int = MEMORY_MAX_EXAMPLES, threshold: float = MEMORY_EXAMPLE_THRESHOLD) -> List[tuple]:
+        """Past tasks at least `threshold` similar to the prompt, as (similarity, Memory), best first."""
+        if not self.available or k <= 0:
+            return []
+        try:
+            vector = await self._embed(prompt)
+            return [(score, memory) for score, memory in self.index.search(vector, k) if score >= threshold]
+        except Exception as e:
+            logger.warning(f"Task memory unavailable for {self.retry_interval:g}s, planning without it: {e!r}")
+            return []
+
+    async def remember(self, memory: Memory) -> bool:
+        """Stores a successful task. Returns False if memory is disabled or unavailable."""
+        if not self.available:
+            return False
+        try:
+            self.index.add(await self._embed(memory.prompt), memory)
+            return True
+        except Exception as e:
+            logger.warning(f"Task not stored in memory: {e!r}")
+            return False
+
+    @property
+    def available(self) -> bool:
+        """False while the memory is disabled or backing off after a failure."""
+        return self.enabled and time.monotonic() >= self._unavailable_until
+
+    async def _embed(self, text: str) -> List[float]:
+        try:
+            vector = await self.embed(text)
+        except Exception:
+            # Ollama is slow or lacks the model; don't make the next runs wait for it too
+            self._unavailable_until = time.monotonic() + self.retry_interval
+            raise
+        return vector[:self.dim] if self.dim > 0 else vector
+
+    def info(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "available": self.available,
+            "entries": self._index.count if self._index is not None else None,
+            "directory": self.directory,
+        }
+
+
+# A singleton memory shared by every run
+task_memory = TaskMemory()
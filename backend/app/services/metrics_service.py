@@ -0,0 +1,230 @@
+import bisect
+import functools
+import math
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+# Seconds; from a cached LLM answer up to a long sandbox run
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 250)
+BYTES_BUCKETS = tuple(2 ** power * 1024 * 1024 for power in range(2, 13))  # 4 MiB to 4 GiB
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing total, per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout (_bucket, _sum, _count)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: [count per bucket (+Inf last), sum]
+        self.values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _format_labels(self.labels, key, le), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labels, key), total
+            yield f"{self.name}_count", _format_labels(self.labels, key), cumulative
+
+
+class CallbackMetric:
+    """A gauge or counter whose current values are read from the service that owns them at scrape time."""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Dict[LabelValues, float]], labels: Sequence[str] = (), kind: str = "gauge"):
+        self.name, self.help, self.labels, self.kind = name, help_text, tuple(labels), kind
+        self.read = read
+
+    def samples(self):
+        for key, value in self.read().items():
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class MetricsRegistry:
+    """The backend's metrics, rendered in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                continue  # A source that can't be read right now is left out of this scrape
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+node_duration = registry.register(Histogram(
+    "agent_node_duration_seconds", "Time spent in each graph node.", ["node"]))
+run_duration = registry.register(Histogram(
+    "agent_run_duration_seconds", "Wall time of streamed runs, from start to the last event."))
+llm_request_duration = registry.register(Histogram(
+    "llm_request_duration_seconds", "Wall time of Ollama generations, including waiting for a model slot.", ["model"]))
+llm_load_duration = registry.register(Histogram(
+    "llm_load_duration_seconds", "Time Ollama spent loading the model for a generation.", ["model"]))
+llm_tokens = registry.register(Counter(
+    "llm_tokens_total", "Tokens processed by Ollama.", ["model", "type"]))
+llm_token_rate = registry.register(Histogram(
+    "llm_generation_tokens_per_second", "Completion tokens per second of Ollama generations.", ["model"], TOKEN_RATE_BUCKETS))
+sandbox_wall = registry.register(Histogram(
+    "sandbox_wall_seconds", "Wall time of sandbox executions.", ["mode"]))
+sandbox_cpu = registry.register(Histogram(
+    "sandbox_cpu_seconds", "User plus system CPU time of sandbox executions.", ["mode"]))
+sandbox_rss = registry.register(Histogram(
+    "sandbox_max_rss_bytes", "Peak resident memory of sandbox executions.", ["mode"], BYTES_BUCKETS))
+sandbox_wait = registry.register(Histogram(
+    "sandbox_session_wait_seconds", "Time plan steps waited for an executor session."))
+
+
+class RunMetrics:
+    """Timing, token and sandbox totals of one run, sent as its 'timings' event."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.nodes: Dict[str, dict] = {}
+        self.llm = {"calls": 0, "seconds": 0.0, "load_seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.sandbox = {"executions": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "max_rss_bytes": 0, "wait_seconds": 0.0}
+
+    def add_node(self, name: str, seconds: float) -> None:
+        entry = self.nodes.setdefault(name, {"calls": 0, "seconds": 0.0})
+        entry["calls"] += 1
+        entry["seconds"] += seconds
+
+    def summary(self) -> dict:
+        def rounded(values: dict) -> dict:
+            return {key: round(value, 4) if isinstance(value, float) else value for key, value in values.items()}
+
+        return {
+            "total_seconds": round(time.perf_counter() - self.started, 4),
+            "nodes": {name: rounded(entry) for name, entry in self.nodes.items()},
+            "llm": rounded(self.llm),
+            "sandbox": rounded(self.sandbox),
+        }
+
+
+# Metrics of the run whose graph task is executing; nodes and the LLM/sandbox calls they make inherit it
+current_run: ContextVar[Optional[RunMetrics]] = ContextVar("current_run", default=None)
+
+
+def timed_node(name: str, node: Callable) -> Callable:
+    """Wraps a graph node so every call is timed into agent_node_duration_seconds and the run's timings."""
+    @functools.wraps(node)
+    async def wrapper(state):
+        start = time.perf_counter()
+        try:
+            return await node(state)
+        finally:
+            elapsed = time.perf_counter() - start
+            node_duration.observe(elapsed, node=name)
+            run = current_run.get()
+            if run is not None:
+                run.add_node(name, elapsed)
+    return wrapper
+
+
+def record_llm_call(model: str, seconds: float, response: Optional[dict]) -> None:
+    """Records an Ollama generation; `response` is its final chunk, with Ollama's counters (durations in ns)."""
+    llm_request_duration.observe(seconds, model=model)
+    run = current_run.get()
+    if run is not None:
+        run.llm["calls"] += 1
+        run.llm["seconds"] += seconds
+    if not response:
+        return
+    prompt_tokens = response.get("prompt_eval_count") or 0
+    completion_tokens = response.get("eval_count") or 0
+    load_seconds = (response.get("load_duration") or 0) / 1e9
+    eval_seconds = (response.get("eval_duration") or 0) / 1e9
+    llm_tokens.inc(prompt_tokens, model=model, type="prompt")
+    llm_tokens.inc(completion_tokens, model=model, type="completion")
+    llm_load_duration.observe(load_seconds, model=model)
+    if completion_tokens and eval_seconds > 0:
+        llm_token_rate.observe(completion_tokens / eval_seconds, model=model)
+    if run is not None:
+        run.llm["prompt_tokens"] += prompt_tokens
+        run.llm["completion_tokens"] += completion_tokens
+        run.llm["load_seconds"] += load_seconds
+
+
+def record_sandbox_run(usage: dict) -> None:
+    """Records the resource usage the executor reported for one execution (see sandbox_service)."""
+    mode = usage.get("mode", "unknown")
+    sandbox_wall.observe(usage["wall"], mode=mode)
+    if "cpu" in usage:
+        sandbox_cpu.observe(usage["cpu"], mode=mode)
+    if "max_rss_kb" in usage:
+        sandbox_rss.observe(usage["max_rss_kb"] * 1024, mode=mode)
+    run = current_run.get()
+    if run is not None:
+        run.sandbox["executions"] += 1
+        run.sandbox["wall_seconds"] += usage["wall"]
+        run.sandbox["cpu_seconds"] += usage.get("cpu", 0.0)
+        run.sandbox["max_rss_bytes"] = max(run.sandbox["max_rss_bytes"], int(usage.get("max_rss_kb", 0) * 1024))
+
+
+def record_session_wait(seconds: float) -> None:
+    sandbox_wait.observe(seconds)
+    run = current_run.get()
+    if run is not None:
+        run.sandbox["wait_seconds"] += seconds
@@ -0,0 +1,662 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import secrets
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from mcp import ClientSession
+from ..config import (
+    EXECUTOR_SCRIPT_PATH,
+    EXECUTOR_POOL_SIZE,
+    EXECUTOR_POOL_MAX_USES,
+    EXECUTOR_POOL_HEALTH_INTERVAL,
+    EXECUTOR_POOL_ACQUIRE_TIMEOUT,
+    OUTPUT_RELAY_MAX_PENDING,
+    SANDBOX_WORKERS,
+    SANDBOX_WORKER_CONNECT_TIMEOUT,
+    SANDBOX_WORKER_HEALTH_INTERVAL,
+    SANDBOX_WORKER_TOKEN,
+)
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the resource usage line the executor appends to completed runs
+RESOURCES_PREFIX = "[resources]"
+
+# Largest reply line accepted from a sandbox worker (see mcp_tools/sandbox_worker.py)
+WORKER_MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+# Connection settings for the secure executor MCP server.
+# The stdio transport only passes a minimal environment to the server, so the
+# executor's own EXECUTOR_* settings (fork server, preloads...) are forwarded explicitly.
+EXECUTOR_SERVER_CONFIG = {
+    "secure_executor": {
+        "command": sys.executable,  # The backend's interpreter has the executor's dependencies
+        "args": [EXECUTOR_SCRIPT_PATH],
+        "transport": "stdio",
+        "env": {k: v for k, v in os.environ.items() if k.startswith("EXECUTOR_")},
+    }
+}
+
+
+class ExecutorSession:
+    """
+    A single long-lived secure_code_executor process with an open MCP session.
+
+    The stdio MCP client is an anyio context manager and must be entered and
+    exited from the same task, so every session owns a background task that
+    keeps the context open until close() is called.
+    """
+
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        self.session = None
+        self.uses = 0
+        self.created_at = time.monotonic()
+        self.broken = False
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._startup_error: Optional[BaseException] = None
+
+    async def start(self) -> None:
+        """Spawns the executor process and waits for the MCP handshake to finish."""
+        self._task = asyncio.create_task(self._run(), name=f"executor-session-{self.session_id}")
+        await self._ready.wait()
+        if self._startup_error is not None:
+            raise self._startup_error
+
+    async def _run(self) -> None:
+        client = MultiServerMCPClient(EXECUTOR_SERVER_CONFIG)
+        try:
+            async with client.session("secure_executor") as session:
+                self.session = session
+                self._ready.set()
+                await self._closing.wait()
+        except Exception as e:
+            if not self._ready.is_set():
+                self._startup_error = e
+            logger.error(f"Executor session {self.session_id} terminated: {e}")
+        finally:
+            self.session = None
+            self.broken = True
+            self._ready.set()
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and not self.broken
+
+    async def ping(self, timeout: float = 5.0) -> bool:
+        """Returns True if the executor still answers MCP requests."""
+        if not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"Executor session {self.session_id} failed health check: {e}")
+            self.broken = True
+            return False
+
+    async def close(self) -> None:
+        """Closes the MCP session and terminates the executor process."""
+        self._closing.set()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._task, timeout=5)
+        except Exception:
+            self._task.cancel()
+            with contextlib.suppress(BaseException):
+                await self._task
+
+
+class ExecutorPool:
+    """
+    A bounded pool of ExecutorSession objects with acquire/release semantics.
+
+    Sessions are created lazily (or up front by start()), handed out to one
+    caller at a time, and recycled after `max_uses` executions, on any
+    transport error, or when a periodic health check fails.
+    """
+
+    def __init__(
+        self,
+        size: int = EXECUTOR_POOL_SIZE,
+        max_uses: int = EXECUTOR_POOL_MAX_USES,
+        health_check_interval: float = EXECUTOR_POOL_HEALTH_INTERVAL,
+        acquire_timeout: float = EXECUTOR_POOL_ACQUIRE_TIMEOUT,
+        session_factory: Callable[[int], ExecutorSession] = ExecutorSession,
+    ):
+        if size < 1:
+            raise ValueError("Executor pool size must be at least 1")
+        self.size = size
+        self.max_uses = max_uses
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._session_factory = session_factory
+        self._semaphore = asyncio.Semaphore(size)
+        self._idle: List[ExecutorSession] = []
+        self._next_id = 0
+        self._health_task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.stats = {"created": 0, "recycled": 0, "acquired": 0}
+
+    async def start(self) -> None:
+        """Pre-spawns the pool's sessions and starts the health check loop."""
+        self._closed = False
+        for _ in range(self.size - len(self._idle)):
+            try:
+                self._idle.append(await self._create_session())
+            except Exception as e:
+                logger.warning(f"Could not pre-spawn executor session: {e}")
+                break
+        if self.health_check_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop(), name="executor-pool-health")
+        logger.info(f"Executor pool started with {len(self._idle)}/{self.size} warm sessions")
+
+    async def close(self) -> None:
+        """Stops the health check loop and shuts down every idle session."""
+        self._closed = True
+        if self._health_task is not None:
+            self._health_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._health_task
+            self._health_task = None
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(s.close() for s in idle), return_exceptions=True)
+        logger.info("Executor pool closed")
+
+    async def _create_session(self) -> ExecutorSession:
+        executor = self._session_factory(self._next_id)
+        self._next_id += 1
+        await executor.start()
+        self.stats["created"] += 1
+        return executor
+
+    async def _discard(self, executor: ExecutorSession) -> None:
+        self.stats["recycled"] += 1
+        await executor.close()
+
+    async def acquire(self) -> ExecutorSession:
+        """Checks out a healthy session, spawning one if none is idle."""
+        if self._closed:
+            raise RuntimeError("Executor pool is closed")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"No executor session became available within {self.acquire_timeout}s")
+
+        try:
+            while self._idle:
+                executor = self._idle.pop()
+                if executor.alive:
+                    break
+                await self._discard(executor)
+            else:
+                executor = await self._create_session()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        self.stats["acquired"] += 1
+        return executor
+
+    async def release(self, executor: ExecutorSession) -> None:
+        """Returns a session to the pool, recycling it if it is worn out or broken."""
+        try:
+            executor.uses += 1
+            if self._closed or not executor.alive or executor.uses >= self.max_uses:
+                await self._discard(executor)
+            else:
+                self._idle.append(executor)
+        finally:
+            self._semaphore.release()
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """
+        Async context manager yielding a ready MCP session.
+
+        Any exception raised while the session is checked out (including
+        cancellation) leaves the executor in an unknown state, so it is
+        recycled instead of being returned to the pool.
+        """
+        executor = await self.acquire()
+        try:
+            yield executor.session
+        except BaseException:
+            executor.broken = True
+            raise
+        finally:
+            await self.release(executor)
+
+    async def check_health(self) -> None:
+        """Pings every idle session and recycles the ones that do not answer."""
+        for executor in list(self._idle):
+            # Hold a pool slot while pinging so the size bound is never exceeded
+            if self._semaphore.locked():
+                return
+            async with self._semaphore:
+                if executor not in self._idle:
+                    continue
+                self._idle.remove(executor)
+                if await executor.ping():
+                    self._idle.append(executor)
+                else:
+                    await self._discard(executor)
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"Executor pool health check failed: {e}", exc_info=True)
+
+    def status(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "max_uses": self.max_uses,
+            **self.stats,
+        }
+
+
+async def call_executor_tool(session: ClientSession, name: str, arguments: dict) -> str:
+    """
+    Calls one of the executor's MCP tools and returns its text result.
+
+    Raises RuntimeError if the tool itself failed (e.g. bad arguments); results
+    describing a failed script are returned normally.
+    """
+    result = await session.call_tool(name, arguments)
+    text = "\n".join(part.text for part in result.content if getattr(part, "type", None) == "text")
+    if result.isError:
+        raise RuntimeError(f"Executor tool '{name}' failed: {text}")
+    return text
+
+
+def split_resource_usage(result: str) -> Tuple[str, Optional[dict]]:
+    """
+    Separates the executor's trailing `[resources] {...}` line from a result.
+
+    Returns the result without it and the usage it reports (mode, wall and, for
+    fork-server runs, cpu and max_rss_kb), or None if the result has no such line.
+    """
+    head, separator, tail = result.rpartition("\n" + RESOURCES_PREFIX + " ")
+    if not separator or "\n" in tail:
+        return result, None
+    try:
+        return head, json.loads(tail)
+    except ValueError:
+        return result, None
+
+
+class OutputRelay:
+    """
+    Side channel that receives sandbox output while a script is still running.
+
+    The MCP tool call only returns once the script has finished, so the backend
+    listens on a local TCP port and hands every execution a random stream token.
+    The executor connects, sends the token, then one JSON object per output line:
+    {"stream": "stdout" | "stderr", "line": "..."}. Lines are delivered to the
+    caller through an asyncio.Queue, followed by None when the executor hangs up.
+    A stream holds at most `max_pending` undelivered lines: a script printing
+    faster than its lines are forwarded loses the excess, reported by a last line.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", max_pending: int = OUTPUT_RELAY_MAX_PENDING):
+        self.host = host
+        self.max_pending = max_pending
+        self.port: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._streams: Dict[str, asyncio.Queue] = {}
+        self._connected: set = set()
+        self._writers: Dict[str, asyncio.StreamWriter] = {}
+
+    async def start(self) -> None:
+        if self._server is not None:
+            return
+        self._server = await asyncio.start_server(self._handle_connection, self.host, 0, limit=1 << 20)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Sandbox output relay listening on {self.host}:{self.port}")
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            self.port = None
+
+    async def open_stream(self) -> Tuple[str, asyncio.Queue]:
+        """Registers a new stream and returns its executor target and line queue."""
+        await self.start()
+        token = secrets.token_urlsafe(16)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._streams[token] = queue
+        return f"{self.host}:{self.port}/{token}", queue
+
+    def close_stream(self, target: str) -> None:
+        token = target.rsplit("/", 1)[-1]
+        self._connected.discard(token)
+        queue = self._streams.pop(token, None)
+        if queue is not None:
+            queue.put_nowait(None)
+
+    def cancel_stream(self, target: str) -> None:
+        """
+        Hangs up on the executor attached to a stream and closes it.
+
+        The executor treats the relay connection as a lease on the execution:
+        when the backend drops it, the script's whole process tree is killed.
+        """
+        writer = self._writers.pop(target.rsplit("/", 1)[-1], None)
+        if writer is not None:
+            writer.close()
+        self.close_stream(target)
+
+    def is_connected(self, target: str) -> bool:
+        """True once the executor has attached to the stream."""
+        return target.rsplit("/", 1)[-1] in self._connected
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        token = None
+        try:
+            token = (await reader.readline()).decode("utf-8").strip()
+            queue = self._streams.get(token)
+            if queue is None:
+                return  # Unknown or expired token
+            self._connected.add(token)
+            self._writers[token] = writer
+            dropped = 0
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if queue.qsize() >= self.max_pending:
+                    dropped += 1
+                    continue
+                try:
+                    queue.put_nowait(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+            if dropped and token in self._streams:
+                queue.put_nowait({"stream": "stderr", "line": f"[{dropped} output lines dropped from the live view]"})
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Output relay connection failed: {e}")
+        finally:
+            if token in self._streams:
+                self._streams[token].put_nowait(None)
+            self._writers.pop(token, None)
+            writer.close()
+
+
+class WorkerUnavailable(ConnectionError):
+    """A sandbox worker could not be reached; nothing was sent, so the request can go to another one."""
+
+
+class SandboxWorker:
+    """
+    A sandbox worker daemon (mcp_tools/sandbox_worker.py), addressed as "host:port" or "unix:/path".
+
+    Every request opens its own connection, which is also the execution's lease:
+    closing it (e.g. when the step is cancelled) makes the worker kill the script.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        token: str = SANDBOX_WORKER_TOKEN,
+        connect_timeout: float = SANDBOX_WORKER_CONNECT_TIMEOUT,
+    ):
+        self.address = address
+        self.token = token
+        self.connect_timeout = connect_timeout
+        self.healthy = True
+        self.in_flight = 0  # Requests sent by this backend and not answered yet
+        self.reported_active = 0  # Requests the worker was serving at its last health check, from any backend
+        self.capacity = 1  # Scripts the worker runs at once, from its last health check
+        self.stats = {"executions": 0, "failures": 0}
+
+    @property
+    def load(self) -> float:
+        return max(self.in_flight, self.reported_active) / max(self.capacity, 1)
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            if self.address.startswith("unix:"):
+                connect = asyncio.open_unix_connection(self.address[len("unix:"):], limit=WORKER_MAX_MESSAGE_BYTES)
+            else:
+                host, _, port = self.address.rpartition(":")
+                connect = asyncio.open_connection(host, int(port), limit=WORKER_MAX_MESSAGE_BYTES)
+            return await asyncio.wait_for(connect, timeout=self.connect_timeout)
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            self.stats["failures"] += 1
+            raise WorkerUnavailable(f"Sandbox worker {self.address} is unreachable: {e or type(e).__name__}") from e
+
+    async def call(self, tool: str, arguments: Optional[dict] = None, on_output: Optional[Callable[[dict], None]] = None):
+        """
+        Sends one request and returns its result, passing output lines to `on_output` as they arrive.
+
+        Raises WorkerUnavailable if the worker can't be reached, and RuntimeError if
+        it failed the request or went away before answering.
+        """
+        reader, writer = await self._connect()
+        self.in_flight += 1
+        if tool == "execute_python_code":
+            self.stats["executions"] += 1
+        try:
+            request = {"tool": tool, "arguments": arguments or {}}
+            if self.token:
+                request["token"] = self.token
+            writer.write(json.dumps(request).encode("utf-8") + b"\n")
+            await writer.drain()
+            while line := await reader.readline():
+                message = json.loads(line)
+                if "stream" in message:
+                    if on_output is not None:
+                        on_output(message)
+                elif "error" in message:
+                    raise RuntimeError(f"Sandbox worker tool '{tool}' failed: {message['error']}")
+                else:
+                    return message["result"]
+            raise ConnectionError("connection closed before the result")
+        except (ConnectionError, OSError, ValueError, KeyError) as e:
+            self.healthy = False
+            self.stats["failures"] += 1
+            raise RuntimeError(f"Sandbox worker {self.address} failed during '{tool}': {e}") from e
+        finally:
+            self.in_flight -= 1
+            writer.close()
+
+    async def check(self) -> bool:
+        """Asks the worker for its status; marks it up or down accordingly."""
+        try:
+            status = await asyncio.wait_for(self.call("status"), timeout=self.connect_timeout)
+            self.capacity = int(status.get("capacity") or 1)
+            self.reported_active = int(status.get("active") or 0)
+            self.healthy = True
+        except Exception as e:
+            if self.healthy:
+                logger.warning(f"Sandbox worker {self.address} failed its health check: {e}")
+            self.healthy = False
+        return self.healthy
+
+    def info(self) -> dict:
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "capacity": self.capacity,
+            "load": round(self.load, 3),
+            **self.stats,
+        }
+
+
+class WorkerDispatcher:
+    """
+    Spreads plan step executions over sandbox workers.
+
+    Each execution goes to the least loaded healthy worker: the most of its
+    requests in flight from here and the count it last reported (other backends
+    may share it), over its capacity; ties are rotated. A worker that can't be
+    reached is marked down and the execution fails over to the next one. Workers
+    marked down are tried last, and come back once a health check succeeds. An
+    execution that already reached a worker is not retried elsewhere, since its
+    code may have had side effects. A persistent kernel lives in the worker that
+    started it, so all of its cells go there.
+    """
+
+    def __init__(
+        self,
+        addresses: List[str] = SANDBOX_WORKERS,
+        health_check_interval: float = SANDBOX_WORKER_HEALTH_INTERVAL,
+        max_pending: int = OUTPUT_RELAY_MAX_PENDING,
+        worker_factory: Callable[[str], SandboxWorker] = SandboxWorker,
+    ):
+        self.workers = [worker_factory(address) for address in addresses]
+        self.health_check_interval = health_check_interval
+        self.max_pending = max_pending
+        self._kernels: Dict[str, SandboxWorker] = {}
+        self._rotation = 0
+        self._health_task: Optional[asyncio.Task] = None
+        self.stats = {"executions": 0, "failovers": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.workers)
+
+    async def start(self) -> None:
+        """Checks every worker once and starts the health check loop."""
+        await self.check_health()
+        if self.health_check_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop(), name="sandbox-worker-health")
+        healthy = sum(worker.healthy for worker in self.workers)
+        logger.info(f"Sandbox worker dispatcher started with {healthy}/{len(self.workers)} healthy workers")
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._health_task
+            self._health_task = None
+
+    async def check_health(self) -> None:
+        await asyncio.gather(*(worker.check() for worker in self.workers))
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"Sandbox worker health check failed: {e}", exc_info=True)
+
+    def candidates(self) -> List[SandboxWorker]:
+        """The workers in the order to try them: healthy ones from the least loaded, then the ones marked down."""
+        self._rotation = (self._rotation + 1) % len(self.workers)
+        rotated = self.workers[self._rotation:] + self.workers[:self._rotation]
+        return sorted(rotated, key=lambda worker: (not worker.healthy, worker.load))
+
+    async def call(
+        self,
+        tool: str,
+        arguments: Optional[dict] = None,
+        on_output: Optional[Callable[[dict], None]] = None,
+        kernel_id: Optional[str] = None,
+    ):
+        """Sends a request to the best worker, failing over to the next ones while they can't be reached."""
+        if not self.enabled:
+            raise RuntimeError("No sandbox workers are configured")
+        pinned = self._kernels.get(kernel_id) if kernel_id else None
+        last_error = None
+        for worker in [pinned] if pinned is not None else self.candidates():
+            try:
+                result = await worker.call(tool, arguments, on_output)
+            except WorkerUnavailable as e:
+                worker.healthy = False
+                self.stats["failovers"] += 1
+                logger.warning(str(e))
+                last_error = e
+                continue
+            if kernel_id:
+                self._kernels[kernel_id] = worker
+            return result
+        if pinned is not None:
+            raise RuntimeError(f"Kernel {kernel_id} lives on sandbox worker {pinned.address}, which is unreachable")
+        raise RuntimeError(f"No sandbox worker could be reached: {last_error}")
+
+    async def execute(
+        self, code: str, timeout: float, kernel_id: Optional[str] = None, lines: Optional[asyncio.Queue] = None
+    ) -> str:
+        """
+        Runs code on a worker and returns the executor's result.
+
+        Output lines are put on `lines` while the script runs, then None, as with
+        OutputRelay (at most `max_pending` undelivered lines, the excess is dropped).
+        """
+        dropped = 0
+
+        def on_output(message: dict) -> None:
+            nonlocal dropped
+            if lines is None:
+                return
+            if lines.qsize() >= self.max_pending:
+                dropped += 1
+            else:
+                lines.put_nowait(message)
+
+        arguments = {"code": code, "timeout": timeout}
+        if kernel_id:
+            arguments["kernel_id"] = kernel_id
+        self.stats["executions"] += 1
+        try:
+            result = await self.call("execute_python_code", arguments, on_output, kernel_id)
+        finally:
+            if lines is not None:
+                if dropped:
+                    lines.put_nowait({"stream": "stderr", "line": f"[{dropped} output lines dropped from the live view]"})
+                lines.put_nowait(None)
+        return result
+
+    async def shutdown_kernel(self, kernel_id: str) -> str:
+        worker = self._kernels.pop(kernel_id, None)
+        if worker is None:
+            return "Kernel Shutdown: not running"
+        return await worker.call("shutdown_kernel", {"kernel_id": kernel_id})
+
+    def status(self) -> dict:
+        return {
+            "workers": [worker.info() for worker in self.workers],
+            "healthy": sum(worker.healthy for worker in self.workers),
+            "kernels": len(self._kernels),
+            **self.stats,
+        }
+
+
+async def shutdown_kernel(kernel_id: str) -> None:
+    """Stops a run's persistent kernel. Kernels that are missed exit after their idle timeout."""
+    try:
+        if worker_dispatcher.enabled:
+            result = await worker_dispatcher.shutdown_kernel(kernel_id)
+        else:
+            async with executor_pool.session() as session:
+                result = await call_executor_tool(session, "shutdown_kernel", {"kernel_id": kernel_id})
+        logger.info(f"Kernel {kernel_id}: {result}")
+    except Exception as e:
+        logger.warning(f"Could not shut down kernel {kernel_id}: {e}")
+
+
+# A singleton pool owned by the FastAPI app lifecycle (see app.main)
+executor_pool = ExecutorPool()
+
+# A singleton output relay, started together with the pool
+output_relay = OutputRelay()
+
+# Remote execution on the SANDBOX_WORKERS; when configured, it replaces the pool and relay
+worker_dispatcher = WorkerDispatcher()
@@ -0,0 +1,164 @@
+import asyncio
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque
+from ..config import MAX_CONCURRENT_RUNS, MAX_QUEUED_RUNS, MAX_QUEUED_RUNS_PER_CLIENT
+
+
+class QueueFull(Exception):
+    """Raised when a run can't be queued; the API answers with 429."""
+
+
+class RunTicket:
+    """A run's place in the scheduler: queued until admitted, then holding a run slot."""
+
+    def __init__(self, scheduler: "RunScheduler", client_id: str):
+        self.scheduler = scheduler
+        self.client_id = client_id
+        self.admitted = asyncio.Event()
+        self.released = False
+        self.claimed = False  # Set by the consumer that takes over releasing the ticket
+        self._changed = asyncio.Event()
+
+    @property
+    def position(self) -> int:
+        """1-based place in the queue (1 = admitted next); 0 once the run is admitted."""
+        return self.scheduler.position(self)
+
+    async def wait_for_turn(self) -> AsyncIterator[int]:
+        """Yields the queue position every time it changes, and returns once the run is admitted."""
+        last_position = None
+        while not self.admitted.is_set():
+            self._changed.clear()
+            position = self.position
+            if position != last_position:
+                last_position = position
+                yield position
+            await self._changed.wait()
+
+    def release(self) -> None:
+        """Frees the run slot, or leaves the queue if the run was never admitted. Idempotent."""
+        self.scheduler.release(self)
+
+
+class RunScheduler:
+    """
+    Admission control for graph runs.
+
+    At most `max_active` runs execute at once; the rest wait in a queue that is
+    served round-robin across clients, so one client submitting a burst can't
+    starve the others. Once `max_queued` runs (or `max_queued_per_client` for a
+    single client) are waiting, new runs are rejected with QueueFull instead of
+    piling up behind Ollama.
+    """
+
+    def __init__(
+        self,
+        max_active: int = MAX_CONCURRENT_RUNS,
+        max_queued: int = MAX_QUEUED_RUNS,
+        max_queued_per_client: int = MAX_QUEUED_RUNS_PER_CLIENT,
+    ):
+        self.max_active = max_active
+        self.max_queued = max_queued
+        self.max_queued_per_client = max_queued_per_client
+        self.active = 0
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0}
+        # Clients in round-robin order, each with its own FIFO of waiting runs
+        self._queues: "OrderedDict[str, Deque[RunTicket]]" = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def enqueue(self, client_id: str) -> RunTicket:
+        """Admits a run right away if a slot is free, otherwise queues it; raises QueueFull when full."""
+        ticket = RunTicket(self, client_id)
+        if self.active < self.max_active and not self._queues:
+            self._admit(ticket)
+            return ticket
+
+        client_queue = self._queues.get(client_id)
+        if self.queued >= self.max_queued:
+            self.stats["rejected"] += 1
+            raise QueueFull(f"The run queue is full ({self.max_queued} runs waiting).")
+        if client_queue is not None and len(client_queue) >= self.max_queued_per_client:
+            self.stats["rejected"] += 1
+            raise QueueFull(f"Too many queued runs for this client ({self.max_queued_per_client} waiting).")
+
+        self._queues.setdefault(client_id, deque()).append(ticket)
+        self.stats["queued"] += 1
+        return ticket
+
+    def position(self, ticket: RunTicket) -> int:
+        if ticket.admitted.is_set():
+            return 0
+        client_queue = self._queues.get(ticket.client_id)
+        if client_queue is None or ticket not in client_queue:
+            return 0
+        # Runs are taken one per client per round: count every run served in earlier
+        # rounds, plus the runs of clients ahead of this one in the current round
+        round_index = client_queue.index(ticket)
+        ahead = 0
+        for client_id, queue in self._queues.items():
+            if client_id == ticket.client_id:
+                ahead += round_index
+                continue
+            ahead += min(len(queue), round_index)
+            if len(queue) > round_index and self._before(client_id, ticket.client_id):
+                ahead += 1
+        return ahead + 1
+
+    def _before(self, client_id: str, other_client_id: str) -> bool:
+        for candidate in self._queues:
+            if candidate == client_id:
+                return True
+            if candidate == other_client_id:
+                return False
+        return False
+
+    def release(self, ticket: RunTicket) -> None:
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted.is_set():
+            self.active -= 1
+        else:
+            client_queue = self._queues.get(ticket.client_id)
+            if client_queue is not None and ticket in client_queue:
+                client_queue.remove(ticket)
+                if not client_queue:
+                    del self._queues[ticket.client_id]
+        self._admit_waiting()
+
+    def _admit(self, ticket: RunTicket) -> None:
+        self.active += 1
+        self.stats["admitted"] += 1
+        ticket.admitted.set()
+        ticket._changed.set()
+
+    def _admit_waiting(self) -> None:
+        while self.active < self.max_active and self._queues:
+            # Serve the client at the head of the rotation, then move it to the back
+            client_id, client_queue = next(iter(self._queues.items()))
+            self._admit(client_queue.popleft())
+            if client_queue:
+                self._queues.move_to_end(client_id)
+            else:
+                del self._queues[client_id]
+        # Every waiting run moved up (or stayed put); let their streams report it
+        for client_queue in self._queues.values():
+            for waiting in client_queue:
+                waiting._changed.set()
+
+    def info(self) -> dict:
+        return {
+            **self.stats,
+            "active": self.active,
+            "waiting": self.queued,
+            "max_active": self.max_active,
+            "max_queued": self.max_queued,
+        }
+
+
+# A singleton scheduler shared by every prompt request
+run_scheduler = RunScheduler()
+
@@ -0,0 +1,164 @@
+"""
+Static security analysis of generated code.
+
+The same rules run in two places: in the backend, before a step is dispatched, so
+blocked code is rejected without touching a sandbox; and in the secure executor
+as the last line of defence. This module therefore only depends on the standard
+library and reads its settings straight from the environment (the EXECUTOR_*
+variables are forwarded to the executor process).
+"""
+import ast
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import FrozenSet, Iterable, Optional, Tuple
+
+# --- Default Rules ---
+DENY_LIST_MODULES = frozenset({
+    'os', 'shutil', 'subprocess', 'sys', 'importlib',
+    'exec', 'eval', '__import__', 'compile', 'globals', 'locals'
+})
+DENY_LIST_FUNCTIONS = frozenset({
+    'exec', 'eval', '__import__', 'compile', 'open', 'file',
+    'input', 'raw_input', 'execfile', 'reload'
+})
+DENY_LIST_ATTRIBUTES = frozenset({
+    '__globals__', '__locals__', '__dict__', '__class__',
+    '__bases__', '__subclasses__'
+})
+
+SAFE_MESSAGE = "Code passed static analysis."
+
+
+def _deny_list_from_env(name: str, default: FrozenSet[str]) -> FrozenSet[str]:
+    """Comma-separated override of a deny list, e.g. EXECUTOR_DENY_MODULES="os,sys,socket"."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return frozenset(item.strip() for item in value.split(",") if item.strip())
+
+
+class _Violation(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+class _RuleVisitor(ast.NodeVisitor):
+    """Walks a module once and raises _Violation at the first rule it breaks."""
+
+    def __init__(self, analyzer: "SecurityAnalyzer"):
+        self.analyzer = analyzer
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            if alias.name.split('.')[0] in self.analyzer.deny_modules:
+                raise _Violation(f"Unsafe import detected: '{alias.name}'")
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        if node.module and node.module.split('.')[0] in self.analyzer.deny_modules:
+            raise _Violation(f"Unsafe import detected: '{node.module}'")
+        for alias in node.names:
+            if alias.name.split('.')[0] in self.analyzer.deny_modules:
+                raise _Violation(f"Unsafe import detected: '{alias.name}'")
+
+    def visit_Call(self, node: ast.Call) -> None:
+        func = node.func
+        if isinstance(func, ast.Name) and func.id in self.analyzer.deny_functions:
+            raise _Violation(f"Unsafe function call detected: '{func.id}()'")
+        if isinstance(func, ast.Attribute) and func.attr in self.analyzer.deny_functions:
+            raise _Violation(f"Unsafe method call detected: '{func.attr}()'")
+        self.generic_visit(node)
+
+    def visit_Attribute(self, node: ast.Attribute) -> None:
+        if node.attr in self.analyzer.deny_attributes:
+            raise _Violation(f"Unsafe attribute access detected: '{node.attr}'")
+        self.generic_visit(node)
+
+    def visit_Assign(self, node: ast.Assign) -> None:
+        for target in node.targets:
+            if isinstance(target, ast.Name) and target.id in self.analyzer.deny_functions:
+                raise _Violation(f"Attempted to override builtin: '{target.id}'")
+        self.generic_visit(node)
+
+
+class SecurityAnalyzer:
+    """
+    A compiled set of deny-list rules with a cache of verdicts.
+
+    Verdicts are keyed by the SHA-256 of the code, so a step that is retried or
+    planned again is answered without parsing it a second time.
+    """
+
+    def __init__(
+        self,
+        deny_modules: Iterable[str] = DENY_LIST_MODULES,
+        deny_functions: Iterable[str] = DENY_LIST_FUNCTIONS,
+        deny_attributes: Iterable[str] = DENY_LIST_ATTRIBUTES,
+        cache_size: int = 4096,
+    ):
+        self.deny_modules = frozenset(deny_modules)
+        self.deny_functions = frozenset(deny_functions)
+        self.deny_attributes = frozenset(deny_attributes)
+        self.cache_size = cache_size
+        self._verdicts: "OrderedDict[str, Tuple[bool, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "blocked": 0}
+
+    def analyze(self, code: str) -> Tuple[bool, str]:
+        """Runs the rules on `code` without consulting the cache."""
+        try:
+            _RuleVisitor(self).visit(ast.parse(code))
+        except _Violation as violation:
+            return False, violation.reason
+        except SyntaxError as e:
+            return False, f"Code has syntax errors: {e}"
+        except Exception as e:
+            return False, f"Code analysis failed: {e}"
+        return True, SAFE_MESSAGE
+
+    def check(self, code: str) -> Tuple[bool, str]:
+        """Returns (is_safe, reason) for `code`, from the verdict cache when possible."""
+        key = hashlib.sha256(code.encode("utf-8", errors="surrogatepass")).hexdigest()
+        with self._lock:
+            verdict = self._verdicts.get(key)
+            if verdict is not None:
+                self._verdicts.move_to_end(key)
+                self.stats["hits"] += 1
+                return verdict
+
+        verdict = self.analyze(code)
+        with self._lock:
+            self.stats["misses"] += 1
+            if not verdict[0]:
+                self.stats["blocked"] += 1
+            if self.cache_size > 0:
+                self._verdicts[key] = verdict
+                while len(self._verdicts) > self.cache_size:
+                    self._verdicts.popitem(last=False)
+        return verdict
+
+    def info(self) -> dict:
+        with self._lock:
+            return {**self.stats, "cached_verdicts": len(self._verdicts)}
+
+
+_default_analyzer: Optional[SecurityAnalyzer] = None
+
+
+def get_security_analyzer() -> SecurityAnalyzer:
+    """Returns the shared analyzer configured from the EXECUTOR_DENY_* environment."""
+    global _default_analyzer
+    if _default_analyzer is None:
+        _default_analyzer = SecurityAnalyzer(
+            deny_modules=_deny_list_from_env("EXECUTOR_DENY_MODULES", DENY_LIST_MODULES),
+            deny_functions=_deny_list_from_env("EXECUTOR_DENY_FUNCTIONS", DENY_LIST_FUNCTIONS),
+            deny_attributes=_deny_list_from_env("EXECUTOR_DENY_ATTRIBUTES", DENY_LIST_ATTRIBUTES),
+            cache_size=int(os.getenv("EXECUTOR_SECURITY_CACHE_SIZE", "4096")),
+        )
+    return _default_analyzer
+
+
+def is_code_safe(code: str) -> Tuple[bool, str]:
+    """AST-based safety check for Python code, using the shared analyzer."""
+    return get_security_analyzer().check(code)
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict
+from ..config import SSE_REPLAY_EVENTS
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """
+    One run's event stream, shared by every client that asked for it.
+
+    The source stream is consumed once, by a task of its own; the last
+    `max_events` events are kept so that subscribers joining late first receive
+    those sent so far. The run is cancelled when its last subscriber leaves.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        source: AsyncIterator[str],
+        on_done: Callable[["Flight"], None],
+        max_events: int = SSE_REPLAY_EVENTS,
+    ):
+        self.key = key
+        self.events: Deque[str] = deque(maxlen=max_events)
+        self.count = 0  # Events received so far, including those no longer kept
+        self.done = False
+        self.subscribers = 0
+        self._on_done = on_done
+        self._changed = asyncio.Event()
+        self._task = asyncio.create_task(self._pump(source), name=f"single-flight-{key[:12]}")
+        # A done callback rather than a finally: it also runs if the task is cancelled before it starts
+        self._task.add_done_callback(self._finish)
+
+    async def _pump(self, source: AsyncIterator[str]) -> None:
+        async for event in source:
+            self.events.append(event)
+            self.count += 1
+            self._notify()
+
+    def _finish(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Shared run {self.key[:12]} failed: {task.exception()}")
+        self.done = True
+        self._notify()
+        self._on_done(self)
+
+    def _notify(self) -> None:
+        # Wake every waiting subscriber; later waits use a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def add_done_callback(self, callback: Callable[[], None]) -> None:
+        """Calls `callback` once the flight is over, even if it was cancelled before its source started."""
+        self._task.add_done_callback(lambda task: callback())
+
+    def subscribe(self) -> "Subscriber":
+        return Subscriber(self)
+
+    def unsubscribe(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            # Nobody is listening any more: stop the run like a closed stream would
+            self._task.cancel()
+
+
+class Subscriber:
+    """A client's view of a Flight: replays the events so far, then follows the live stream."""
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+        self.index = 0
+        self.closed = False
+        flight.subscribers += 1
+
+    def __aiter__(self) -> "Subscriber":
+        return self
+
+    async def __anext__(self) -> str:
+        flight = self.flight
+        while self.index >= flight.count:
+            if flight.done or self.closed:
+                self.unsubscribe()
+                raise StopAsyncIteration
+            await flight._changed.wait()
+        first_kept = flight.count - len(flight.events)
+        self.index = max(self.index, first_kept)  # Events older than the kept ones are gone
+        event = flight.events[self.index - first_kept]
+        self.index += 1
+        return event
+
+    def unsubscribe(self) -> None:
+        """Stops following the flight. Idempotent."""
+        if not self.closed:
+            self.closed = True
+            self.flight.unsubscribe()
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight runs.
+
+    The first request for a key starts the run; requests for the same key that
+    arrive while it is still running subscribe to it instead of starting another.
+    A finished run is forgotten, so later requests start a fresh one.
+    """
+
+    def __init__(self, max_events: int = SSE_REPLAY_EVENTS):
+        self.max_events = max_events
+        self._flights: Dict[str, Flight] = {}
+        self.stats = {"started": 0, "joined": 0}
+
+    def join(self, key: str, start: Callable[[], AsyncIterator[str]]) -> Subscriber:
+        """Subscribes to the run in flight for `key`, calling `start` for its event stream if there is none."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key, start(), self._forget, self.max_events)
+            self._flights[key] = flight
+            self.stats["started"] += 1
+        else:
+            self.stats["joined"] += 1
+        return flight.subscribe()
+
+    def _forget(self, flight: Flight) -> None:
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def info(self) -> dict:
+        return {**self.stats, "in_flight": len(self._flights)}
+
+
+# A singleton shared by every coalesced prompt request
+run_coalescer = SingleFlight()
@@ -0,0 +1,210 @@
+"""
+An Ollama-compatible stand-in for benchmarks and tests.
+
+Implements the endpoints the backend uses (/api/tags, /api/ps, /api/generate,
+/api/chat, /api/embed) with canned answers and simulated timing: a model load
+on first use, a prompt evaluation delay, then tokens streamed at a fixed rate.
+The answer to a chat request is picked from what is asked for:
+
+- a request constrained to a JSON schema (the planner) gets a plan with
+  `plan_steps` steps, as strings or as {"step", "depends_on"} objects;
+- a request asking for SINGLE or MULTI (the router) gets `router_answer`;
+- anything else (the coder, error diagnosis) gets `code`.
+
+Run it on its own with:
+    python -m benchmarks.fake_ollama --port 11435 --tokens-per-second 40
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import List
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Characters per simulated token; close to what Llama-style tokenizers average on English and code
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class FakeOllamaConfig:
+    models: List[str] = field(default_factory=list)  # Listed by /api/tags; any name is served regardless
+    load_seconds: float = 0.0  # Paid by the first request to each model
+    prompt_seconds: float = 0.05  # Prompt evaluation, before the first token
+    tokens_per_second: float = 50.0  # 0 streams every token at once
+    plan_steps: int = 2
+    router_answer: str = "MULTI"
+    code: str = "print('step done')"
+    embedding_dim: int = 768
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _tokens(text: str) -> List[str]:
+    return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)] or [""]
+
+
+def _embedding(text: str, dim: int) -> List[float]:
+    """A deterministic unit vector per text, so different prompts are dissimilar and equal ones identical."""
+    values, counter = [], 0
+    while len(values) < dim:
+        digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+        values.extend(byte / 127.5 - 1.0 for byte in digest)
+        counter += 1
+    norm = sum(value * value for value in values[:dim]) ** 0.5
+    return [value / norm for value in values[:dim]]
+
+
+def chat_answer(body: dict, config: FakeOllamaConfig) -> str:
+    """The canned answer to a chat request, chosen by the role it comes from."""
+    schema = body.get("format")
+    if isinstance(schema, dict):
+        items = schema.get("properties", {}).get("plan", {}).get("items", {})
+        if items.get("type") == "object":
+            plan = [{"step": f"Step {index + 1} of the task", "depends_on": []} for index in range(config.plan_steps)]
+        else:
+            plan = [f"Step {index + 1} of the task" for index in range(config.plan_steps)]
+        return json.dumps({"plan": plan})
+    text = " ".join(str(message.get("content", "")) for message in body.get("messages", []))
+    if "SINGLE or MULTI" in text:
+        return config.router_answer
+    return config.code
+
+
+def create_app(config: FakeOllamaConfig) -> FastAPI:
+    app = FastAPI(title="Fake Ollama")
+    loaded = set()
+    stats = {"chat": 0, "generate": 0, "embed": 0}
+
+    async def load(model: str) -> int:
+        """Simulates loading a model on first use; returns the load time in ns."""
+        if model in loaded:
+            return 0
+        loaded.add(model)
+        await asyncio.sleep(config.load_seconds)
+        return int(config.load_seconds * 1e9)
+
+    @app.get("/api/version")
+    async def version():
+        return {"version": "0.0.0-fake"}
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [{"name": model, "model": model, "size": 0, "digest": ""} for model in config.models]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": model, "model": model} for model in sorted(loaded)]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return {**stats, "loaded": sorted(loaded), "config": asdict(config)}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        # The backend only uses it to load (warm) models, with no prompt
+        body = await request.json()
+        stats["generate"] += 1
+        load_duration = await load(body["model"])
+        return {
+            "model": body["model"], "created_at": _now(), "response": "", "done": True,
+            "done_reason": "load", "load_duration": load_duration,
+        }
+
+    @app.post("/api/embed")
+    async def embed(request: Request):
+        body = await request.json()
+        stats["embed"] += 1
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        return {"model": body["model"], "embeddings": [_embedding(text, config.embedding_dim) for text in inputs]}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        body = await request.json()
+        stats["chat"] += 1
+        model = body["model"]
+        answer_tokens = _tokens(chat_answer(body, config))
+        prompt_tokens = sum(len(_tokens(str(message.get("content", "")))) for message in body.get("messages", []))
+        delay = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+        def final(started: float, load_duration: int, eval_started: float, content: str = "") -> dict:
+            eval_duration = int((time.perf_counter() - eval_started) * 1e9)
+            return {
+                "model": model, "created_at": _now(), "message": {"role": "assistant", "content": content},
+                "done": True, "done_reason": "stop",
+                "total_duration": int((time.perf_counter() - started) * 1e9),
+                "load_duration": load_duration,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(config.prompt_seconds * 1e9),
+                "eval_count": len(answer_tokens),
+                "eval_duration": max(eval_duration, 1),
+            }
+
+        if not body.get("stream", True):
+            started = time.perf_counter()
+            load_duration = await load(model)
+            await asyncio.sleep(config.prompt_seconds)
+            eval_started = time.perf_counter()
+            await asyncio.sleep(delay * len(answer_tokens))
+            return JSONResponse(final(started, load_duration, eval_started, "".join(answer_tokens)))
+
+        async def stream():
+            started = time.perf_counter()
+            load_duration = await load(model)
+            await asyncio.sleep(config.prompt_seconds)
+            eval_started = time.perf_counter()
+            for token in answer_tokens:
+                chunk = {"model": model, "created_at": _now(), "message": {"role": "assistant", "content": token}, "done": False}
+                yield json.dumps(chunk) + "\n"
+                if delay:
+                    await asyncio.sleep(delay)
+            yield json.dumps(final(started, load_duration, eval_started)) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    return app
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    """Command-line options for every FakeOllamaConfig field, shared with the benchmark runner."""
+    defaults = FakeOllamaConfig()
+    parser.add_argument("--load-seconds", type=float, default=defaults.load_seconds, help="Simulated model load time")
+    parser.add_argument("--prompt-seconds", type=float, default=defaults.prompt_seconds, help="Delay before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second, help="Generation speed")
+    parser.add_argument("--plan-steps", type=int, default=defaults.plan_steps, help="Steps in every plan")
+    parser.add_argument("--router-answer", default=defaults.router_answer, choices=["SINGLE", "MULTI"])
+    parser.add_argument("--code", default=defaults.code, help="Code returned to every code generation request")
+
+
+def config_from_arguments(args: argparse.Namespace, models: List[str] = ()) -> FakeOllamaConfig:
+    return FakeOllamaConfig(
+        models=list(models),
+        load_seconds=args.load_seconds,
+        prompt_seconds=args.prompt_seconds,
+        tokens_per_second=args.tokens_per_second,
+        plan_steps=args.plan_steps,
+        router_answer=args.router_answer,
+        code=args.code,
+    )
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", default="", help="Comma-separated model names to list in /api/tags")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    models = [model.strip() for model in args.models.split(",") if model.strip()]
+    uvicorn.run(create_app(config_from_arguments(args, models)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+"""
+Offline end-to-end benchmark of the agent pipeline.
+
+Starts the fake Ollama (benchmarks.fake_ollama) and the backend (uvicorn
+app.main:app, pointed at it) as subprocesses, drives /api/process_prompt at a
+given concurrency and reports:
+
+- latency, time to the first event and to the first node event, per run;
+- throughput (completed runs per second);
+- p50/p95/p99 time per graph node, LLM and sandbox time, from each run's
+  'timings' event;
+- sandbox spawn cost: starting an executor session and running a trivial
+  script, with and without the fork server.
+
+No GPU or model is needed, so results only move when the backend does. They are
+saved as JSON under benchmarks/results/ (or --output) for comparison between
+commits. Run from backend/:
+
+    python -m benchmarks.run_benchmark --runs 40 --concurrency 4
+    python -m benchmarks.run_benchmark --compare benchmarks/results/<baseline>.json
+
+The backend is configured through the environment as usual (e.g.
+MAX_CONCURRENT_RUNS); its caches, task memory and checkpoints go to a
+temporary directory so runs don't share state with a real installation.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+import httpx
+from .fake_ollama import add_config_arguments
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+# Events that report on the stream itself rather than on the run's progress
+BOOKKEEPING_EVENTS = {"run", "queued"}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """The q-th percentile (0-100) of `values`, interpolating linearly between ranks."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def distribution(values: List[float]) -> dict:
+    """Count, mean and p50/p95/p99 of a sample, in the sample's unit."""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4),
+        **{f"p{q}": round(percentile(values, q), 4) for q in (50, 95, 99)},
+        "max": round(max(values), 4),
+    }
+
+
+def summarize(runs: List[dict], wall_seconds: float) -> dict:
+    """Aggregates the per-run measurements of a load test."""
+    completed = [run for run in runs if run["completed"]]
+    nodes: Dict[str, List[float]] = {}
+    llm: Dict[str, List[float]] = {}
+    sandbox: Dict[str, List[float]] = {}
+    for run in completed:
+        timings = run.get("timings") or {}
+        for name, entry in timings.get("nodes", {}).items():
+            nodes.setdefault(name, []).append(entry["seconds"])
+        for key in ("seconds", "prompt_tokens", "completion_tokens"):
+            llm.setdefault(key, []).append(timings.get("llm", {}).get(key, 0))
+        for key in ("wall_seconds", "cpu_seconds", "wait_seconds"):
+            sandbox.setdefault(key, []).append(timings.get("sandbox", {}).get(key, 0))
+
+    return {
+        "runs": len(runs),
+        "completed": len(completed),
+        "failed": len(runs) - len(completed),
+        "errors": sorted({run["error"] for run in runs if run.get("error")})[:10],
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_runs_per_second": round(len(completed) / wall_seconds, 4) if wall_seconds > 0 else None,
+        "latency_seconds": distribution([run["latency"] for run in completed]),
+        "time_to_first_event_seconds": distribution([run["first_event"] for run in runs if run.get("first_event") is not None]),
+        "time_to_first_node_event_seconds": distribution(
+            [run["first_node_event"] for run in runs if run.get("first_node_event") is not None]
+        ),
+        "nodes_seconds": {name: distribution(values) for name, values in sorted(nodes.items())},
+        "llm": {key: distribution(values) for key, values in llm.items()},
+        "sandbox": {key: distribution(values) for key, values in sandbox.items()},
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_process(arguments: List[str], env: dict, log_path: Path) -> subprocess.Popen:
+    log = open(log_path, "wb")
+    return subprocess.Popen(arguments, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float, log_path: Path) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}, see {log_path}")
+            try:
+                if (await client.get(url, timeout=2)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} not ready after {timeout}s, see {log_path}")
+
+
+async def run_one(client: httpx.AsyncClient, index: int, args: argparse.Namespace) -> dict:
+    """Streams one run and times its events, as seen by the client."""
+    prompt = args.prompt.format(index=index)
+    result = {"index": index, "completed": False, "first_event": None, "first_node_event": None, "events": 0}
+    start = time.perf_counter()
+    try:
+        async with client.stream(
+            "POST",
+            "/api/process_prompt",
+            params={"timings": "true", "lean": "true" if args.lean else "false"},
+            json={"prompt": prompt, "parallel": args.parallel},
+            headers={"x-client-id": f"bench-{index}"},  # One client per run, so fairness limits don't apply
+        ) as response:
+            if response.status_code != 200:
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                elapsed = time.perf_counter() - start
+                event = json.loads(line[len("data: "):])
+                result["events"] += 1
+                if result["first_event"] is None:
+                    result["first_event"] = elapsed
+                if result["first_node_event"] is None and event["type"] not in BOOKKEEPING_EVENTS:
+                    result["first_node_event"] = elapsed
+                if event["type"] == "timings":
+                    result["timings"] = event["data"]
+                elif event["type"] == "error":
+                    result["error"] = event["data"].get("message", "error")
+                elif event["type"] == "stream_end":
+                    result["completed"] = "error" not in result
+    except httpx.HTTPError as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency"] = time.perf_counter() - start
+    return result
+
+
+async def drive_load(base_url: str, args: argparse.Namespace) -> dict:
+    """Sends `args.runs` prompts, at most `args.concurrency` at a time."""
+    slots = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(args.run_timeout), limits=limits) as client:
+        async def limited(index: int) -> dict:
+            async with slots:
+                return await run_one(client, index, args)
+
+        for index in range(args.warmup):
+            await run_one(client, -1 - index, args)
+        start = time.perf_counter()
+        runs = await asyncio.gather(*(limited(index) for index in range(args.runs)))
+        wall_seconds = time.perf_counter() - start
+        metrics = (await client.get("/metrics")).text
+    summary = summarize(list(runs), wall_seconds)
+    summary["llm_cache_lookups"] = {
+        line.split('"')[1]: float(line.rsplit(" ", 1)[1])
+        for line in metrics.splitlines()
+        if line.startswith("llm_cache_lookups_total{")
+    }
+    return summary
+
+
+async def measure_sandbox(repeats: int) -> dict:
+    """Time to start an executor session and to run a trivial script in it, per execution mode."""
+    from app.services import sandbox_service
+
+    results = {}
+    server_env = sandbox_service.EXECUTOR_SERVER_CONFIG["secure_executor"]["env"]
+    original = dict(server_env)
+    try:
+        for mode, fork_server in (("fork", "1"), ("cold", "0")):
+            server_env["EXECUTOR_FORK_SERVER"] = fork_server
+            start = time.perf_counter()
+            session = sandbox_service.ExecutorSession(0)
+            await session.start()
+            session_start = time.perf_counter() - start
+            try:
+                executions, walls = [], []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    output = await sandbox_service.call_executor_tool(
+                        session.session, "execute_python_code", {"code": "print('ok')", "timeout": 30}
+                    )
+                    executions.append(time.perf_counter() - start)
+                    _, usage = sandbox_service.split_resource_usage(output)
+                    if usage is not None:
+                        walls.append(usage["wall"])
+            finally:
+                await session.close()
+            results[mode] = {
+                "session_start_seconds": round(session_start, 4),
+                "execution_round_trip_seconds": distribution(executions),
+                "execution_wall_seconds": distribution(walls),
+            }
+    finally:
+        server_env.clear()
+        server_env.update(original)
+    return results
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    from app.config import CODER_MODEL, EMBEDDING_MODEL, PLANNER_MODEL, ROUTER_MODEL
+
+    work_dir = Path(tempfile.mkdtemp(prefix="agent-bench-"))
+    ollama_port, backend_port = free_port(), free_port()
+    ollama_url, backend_url = f"http://127.0.0.1:{ollama_port}", f"http://127.0.0.1:{backend_port}"
+    models = sorted({PLANNER_MODEL, CODER_MODEL, ROUTER_MODEL, EMBEDDING_MODEL})
+
+    fake_arguments = [
+        sys.executable, "-m", "benchmarks.fake_ollama", "--port", str(ollama_port), "--models", ",".join(models),
+        "--load-seconds", str(args.load_seconds), "--prompt-seconds", str(args.prompt_seconds),
+        "--tokens-per-second", str(args.tokens_per_second), "--plan-steps", str(args.plan_steps),
+        "--router-answer", args.router_answer, "--code", args.code,
+    ]
+    backend_env = {
+        **os.environ,
+        "OLLAMA_HOST": ollama_url,
+        "LLM_CACHE_ENABLED": "1" if args.llm_cache else "0",
+        "LLM_CACHE_PATH": str(work_dir / "llm_cache.sqlite"),
+        "MEMORY_DIR": str(work_dir / "memory"),
+        "CHECKPOINT_DB_PATH": str(work_dir / "checkpoints.sqlite"),
+    }
+    backend_arguments = [
+        sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(backend_port), "--log-level", "warning",
+    ]
+
+    ollama = start_process(fake_arguments, os.environ.copy(), work_dir / "fake_ollama.log")
+    backend = None
+    try:
+        await wait_until_ready(f"{ollama_url}/api/version", ollama, 30, work_dir / "fake_ollama.log")
+        backend = start_process(backend_arguments, backend_env, work_dir / "backend.log")
+        await wait_until_ready(f"{backend_url}/", backend, args.startup_timeout, work_dir / "backend.log")
+        print(f"Backend ready, sending {args.runs} runs at concurrency {args.concurrency}...", file=sys.stderr)
+        load = await drive_load(backend_url, args)
+    finally:
+        if backend is not None:
+            stop_process(backend)
+        stop_process(ollama)
+
+    sandbox = None
+    if args.sandbox_repeats > 0:
+        print("Measuring sandbox spawn cost...", file=sys.stderr)
+        sandbox = await measure_sandbox(args.sandbox_repeats)
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "logs": str(work_dir),
+            "settings": {
+                key: value for key, value in vars(args).items() if key not in ("output", "compare")
+            },
+        },
+        "load": load,
+        "sandbox": sandbox,
+    }
+
+
+# Metrics shown by --compare, as (label, path in the results); all are lower-is-better except throughput
+COMPARED_METRICS = [
+    ("throughput (runs/s)", ("load", "throughput_runs_per_second")),
+    ("latency p50", ("load", "latency_seconds", "p50")),
+    ("latency p95", ("load", "latency_seconds", "p95")),
+    ("latency p99", ("load", "latency_seconds", "p99")),
+    ("first node event p50", ("load", "time_to_first_node_event_seconds", "p50")),
+    ("first node event p95", ("load", "time_to_first_node_event_seconds", "p95")),
+    ("sandbox session start (fork)", ("sandbox", "fork", "session_start_seconds")),
+    ("sandbox execution p50 (fork)", ("sandbox", "fork", "execution_round_trip_seconds", "p50")),
+    ("sandbox execution p50 (cold)", ("sandbox", "cold", "execution_round_trip_seconds", "p50")),
+]
+
+
+def _lookup(results: dict, path: tuple):
+    for key in path:
+        if not isinstance(results, dict) or key not in results:
+            return None
+        results = results[key]
+    return results
+
+
+def compare(current: dict, baseline: dict) -> str:
+    """A table of the main metrics of two result files, with the relative change."""
+    rows = list(COMPARED_METRICS)
+    for node in sorted(set(current["load"]["nodes_seconds"]) | set(baseline["load"]["nodes_seconds"])):
+        rows.append((f"node {node} p95", ("load", "nodes_seconds", node, "p95")))
+
+    lines = [f"{'metric':<34}{'baseline':>12}{'current':>12}{'change':>10}"]
+    for label, path in rows:
+        old, new = _lookup(baseline, path), _lookup(current, path)
+        change = f"{(new - old) / old * 100:+.1f}%" if isinstance(old, (int, float)) and old and new is not None else ""
+        lines.append(f"{label:<34}{_cell(old):>12}{_cell(new):>12}{change:>10}")
+    return "\n".join(lines)
+
+
+def _cell(value) -> str:
+    return "-" if value is None else f"{value:.4f}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20, help="Runs to send (after the warmup runs)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Runs in flight at once")
+    parser.add_argument("--warmup", type=int, default=1, help="Runs sent first and left out of the results")
+    parser.add_argument("--prompt", default="Download report {index} and count its rows",
+                        help="Prompt template; {index} makes every run's prompt distinct")
+    parser.add_argument("--parallel", action="store_true", help="Request DAG plans with parallel execution")
+    parser.add_argument("--llm-cache", action="store_true", help="Keep the LLM response cache enabled")
+    parser.add_argument("--lean", action="store_true", help="Stream runs in lean mode (state deltas)")
+    parser.add_argument("--run-timeout", type=float, default=300, help="Seconds before a run is given up")
+    parser.add_argument("--startup-timeout", type=float, default=120, help="Seconds to wait for the backend")
+    parser.add_argument("--sandbox-repeats", type=int, default=10, help="Executions per sandbox mode; 0 skips it")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<time>-<revision>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+    output = Path(args.output) if args.output else RESULTS_DIR / (
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{results['meta']['revision'] or 'unknown'}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+
+    print(json.dumps(results["load"], indent=2))
+    if results["sandbox"] is not None:
+        print(json.dumps(results["sandbox"], indent=2))
+    if args.compare:
+        print(compare(results, json.loads(Path(args.compare).read_text())))
+    print(f"Results saved to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
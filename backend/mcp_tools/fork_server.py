@@ -0,0 +1,479 @@
+"""
+Pre-forked warm interpreter for the secure code executor.
+
+A zygote process imports the allowed library set (pandas, numpy, requests, bs4...)
+once and then forks an isolated child for every execution, so short scripts no
+longer pay for cold imports. The zygote only depends on the standard library and
+is started with the same `-I -u` interpreter flags as the regular execution path.
+
+Protocol (one Unix socket connection per execution):
+    executor -> zygote : JSON request {script_path, cwd, env, limits} + [stdout_fd, stderr_fd]
+    zygote   -> executor: {"pid": <child pid>}\n  then  {"returncode": <code>, "cpu": <s>, "max_rss_kb": <kB>}\n
+
+Each connection is handled by a forked monitor process which forks the script
+child into its own session (so the executor can kill the whole process group)
+and reports its exit code and resource usage once it terminates.
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import traceback
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+try:
+    import resource
+except ImportError:  # Windows: no rlimits
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+LineCallback = Callable[[str], Awaitable[None]]
+
+# Native thread pools do not survive fork(); keep them single-threaded in the zygote
+SINGLE_THREAD_ENV = {
+    "OPENBLAS_NUM_THREADS": "1",
+    "OMP_NUM_THREADS": "1",
+    "MKL_NUM_THREADS": "1",
+}
+
+READY_MESSAGE = "FORK_SERVER_READY"
+
+# Longest line handed to output callbacks; longer runs of output without a newline are split
+MAX_LINE_BYTES = 16 * 1024
+
+# Process groups of scripts that are still running, so an exiting executor can kill them
+running_process_groups: Set[int] = set()
+
+
+def fork_server_supported() -> bool:
+    """The fork server needs fork() and Unix sockets with descriptor passing."""
+    return hasattr(os, "fork") and hasattr(socket, "AF_UNIX") and hasattr(socket, "send_fds")
+
+
+def apply_resource_limits(limits: Dict[str, int]) -> None:
+    """
+    Sets rlimits on the calling process, e.g. {"RLIMIT_AS": <bytes>, "RLIMIT_CPU": <seconds>}.
+
+    Limits of 0 and limits the platform doesn't have are skipped. The CPU limit
+    gets a hard limit one second above the soft one: SIGXCPU first, then SIGKILL.
+    """
+    if resource is None:
+        return
+    for name, value in limits.items():
+        limit = getattr(resource, name, None)
+        if not value or limit is None:
+            continue
+        hard = value + 1 if name == "RLIMIT_CPU" else value
+        _, current_hard = resource.getrlimit(limit)
+        if current_hard != resource.RLIM_INFINITY:
+            value, hard = min(value, current_hard), min(hard, current_hard)
+        resource.setrlimit(limit, (value, hard))
+
+
+# --- Zygote side ---
+
+def _preload(modules: List[str]) -> None:
+    for module_name in modules:
+        try:
+            __import__(module_name)
+        except Exception as e:
+            print(f"fork_server: could not preload '{module_name}': {e}", file=sys.stderr)
+
+
+def _run_child(request: dict, stdout_fd: int, stderr_fd: int) -> None:
+    """Runs inside the forked script process. Never returns."""
+    code = 1
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(stdout_fd, 1)
+        os.dup2(stderr_fd, 2)
+        for fd in (devnull, stdout_fd, stderr_fd):
+            os.close(fd)
+
+        os.chdir(request["cwd"])
+        apply_resource_limits(request.get("limits", {}))
+        os.environ.clear()
+        os.environ.update(request["env"])
+        for sig in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+
+        # Equivalent of `python -u`: unbuffered, utf-8 output with replacement
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = io.TextIOWrapper(io.FileIO(1, "w", closefd=False), encoding="utf-8", errors="replace", write_through=True)
+        sys.stderr = io.TextIOWrapper(io.FileIO(2, "w", closefd=False), encoding="utf-8", errors="backslashreplace", write_through=True)
+        sys.argv = [request["script_path"]]
+
+        import runpy
+        try:
+            runpy.run_path(request["script_path"], run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException as e:
+            # Hide the runpy/fork_server frames so tracebacks match a plain `python script.py`
+            tb = e.__traceback__
+            while tb is not None and tb.tb_frame.f_code.co_filename != request["script_path"]:
+                tb = tb.tb_next
+            traceback.print_exception(type(e), e, tb or e.__traceback__)
+            code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os._exit(code & 0xFF)
+
+
+def _handle_connection(conn: socket.socket) -> None:
+    """Runs inside the forked monitor process. Never returns."""
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        message, fds, _, _ = socket.recv_fds(conn, 1 << 20, 2)
+        request = json.loads(message.decode("utf-8"))
+        stdout_fd, stderr_fd = fds
+
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            _run_child(request, stdout_fd, stderr_fd)
+
+        os.close(stdout_fd)
+        os.close(stderr_fd)
+        conn.sendall(json.dumps({"pid": pid}).encode("utf-8") + b"\n")
+
+        _, status, usage = os.wait4(pid, 0)
+        exit_report = {
+            "returncode": os.waitstatus_to_exitcode(status),
+            "cpu": usage.ru_utime + usage.ru_stime,
+            "max_rss_kb": usage.ru_maxrss,  # Kilobytes on Linux
+        }
+        try:
+            conn.sendall(json.dumps(exit_report).encode("utf-8") + b"\n")
+        except OSError:
+            pass  # The executor gave up on this run (e.g. timeout)
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        os._exit(0)
+
+
+def serve(socket_path: str, preload_modules: List[str]) -> None:
+    """Zygote main loop: preload, listen, and fork a monitor per connection."""
+    os.environ.update(SINGLE_THREAD_ENV)
+    _preload(preload_modules)
+
+    # Monitors are reaped automatically; they reset SIGCHLD before forking the script
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen(64)
+    print(READY_MESSAGE, flush=True)
+
+    while True:
+        try:
+            conn, _ = server.accept()
+        except InterruptedError:
+            continue
+        pid = os.fork()
+        if pid == 0:
+            server.close()
+            _handle_connection(conn)
+        conn.close()
+
+
+# --- Executor side ---
+
+class ForkServer:
+    """Client for a zygote process owned by the secure executor."""
+
+    def __init__(self, preload_modules: List[str], startup_timeout: float = 60.0):
+        self.preload_modules = preload_modules
+        self.startup_timeout = startup_timeout
+        self._process: Optional[subprocess.Popen] = None
+        self._socket_dir: Optional[str] = None
+        self._socket_path: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self) -> None:
+        """Spawns the zygote and blocks until it has finished preloading."""
+        if self.running:
+            return
+        self.stop()
+        self._socket_dir = tempfile.mkdtemp(prefix="executor-zygote-")
+        self._socket_path = os.path.join(self._socket_dir, "zygote.sock")
+
+        self._process = subprocess.Popen(
+            [sys.executable, "-I", "-u", os.path.abspath(__file__),
+             self._socket_path, ",".join(self.preload_modules)],
+            stdout=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+            encoding="utf-8",
+        )
+
+        selector = selectors.DefaultSelector()
+        selector.register(self._process.stdout, selectors.EVENT_READ)
+        try:
+            if not selector.select(timeout=self.startup_timeout):
+                raise RuntimeError(f"Fork server did not start within {self.startup_timeout}s")
+            line = self._process.stdout.readline().strip()
+            if line != READY_MESSAGE:
+                raise RuntimeError(f"Fork server failed to start (got {line!r})")
+        except Exception:
+            self.stop()
+            raise
+        finally:
+            selector.close()
+        logger.info(f"Fork server ready (pid {self._process.pid}), preloaded: {', '.join(self.preload_modules)}")
+
+    def stop(self) -> None:
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.kill()
+            self._process.wait()
+            self._process = None
+        if self._socket_path and os.path.exists(self._socket_path):
+            os.remove(self._socket_path)
+        if self._socket_dir and os.path.isdir(self._socket_dir):
+            os.rmdir(self._socket_dir)
+        self._socket_dir = self._socket_path = None
+
+    async def run(
+        self,
+        script_path: str,
+        cwd: str,
+        env: dict,
+        timeout: float,
+        on_output: Optional[Dict[str, LineCallback]] = None,
+        capture: Optional[Dict[str, "OutputCapture"]] = None,
+        limits: Optional[Dict[str, int]] = None,
+    ) -> subprocess.CompletedProcess:
+        """
+        Runs a script in a freshly forked child, mirroring subprocess.run semantics.
+
+        `on_output` optionally maps "stdout"/"stderr" to line callbacks and `capture`
+        to bounded captures (see collect_output). `limits` are rlimits applied to the
+        child (see apply_resource_limits).
+
+        Raises:
+            subprocess.TimeoutExpired: If the script outlives `timeout`; its whole
+                process group is killed first. Cancellation kills it as well.
+            RuntimeError: If the zygote is not running or the protocol breaks.
+        """
+        if not self.running:
+            raise RuntimeError("Fork server is not running")
+
+        loop = asyncio.get_running_loop()
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        # File objects own the descriptors from here on, so closing twice is harmless
+        out_file, err_file = os.fdopen(out_r, "rb", 0), os.fdopen(err_r, "rb", 0)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        writer = None
+        pid = None
+        try:
+            try:
+                await loop.sock_connect(sock, self._socket_path)
+                request = {"script_path": script_path, "cwd": cwd, "env": env, "limits": limits or {}}
+                socket.send_fds(sock, [json.dumps(request).encode("utf-8")], [out_w, err_w])
+            finally:
+                os.close(out_w)
+                os.close(err_w)
+
+            reader, writer = await asyncio.open_unix_connection(sock=sock)
+            pid = json.loads(await reader.readline())["pid"]
+            running_process_groups.add(pid)
+
+            async def communicate():
+                callbacks, captures = on_output or {}, capture or {}
+                stdout, stderr = await asyncio.gather(
+                    read_stream(out_file, callbacks.get("stdout"), captures.get("stdout")),
+                    read_stream(err_file, callbacks.get("stderr"), captures.get("stderr")),
+                )
+                line = await reader.readline()
+                if not line:
+                    raise RuntimeError("Fork server closed the connection without an exit code")
+                return json.loads(line), stdout, stderr
+
+            try:
+                exit_report, stdout, stderr = await asyncio.wait_for(communicate(), timeout=timeout)
+            except asyncio.TimeoutError:
+                kill_process_group(pid)
+                raise subprocess.TimeoutExpired([script_path], timeout)
+            except asyncio.CancelledError:
+                kill_process_group(pid)
+                raise
+            completed = subprocess.CompletedProcess([script_path], exit_report["returncode"], stdout, stderr)
+            # The child's own rusage, which the executor can't get for the processes it spawns itself
+            completed.resources = {key: exit_report[key] for key in ("cpu", "max_rss_kb") if key in exit_report}
+            return completed
+        finally:
+            running_process_groups.discard(pid)
+            out_file.close()
+            err_file.close()
+            if writer is not None:
+                writer.close()
+            else:
+                sock.close()
+
+
+def kill_process_group(pid: int) -> None:
+    """Kills a child started in its own session together with everything it spawned."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class OutputCapture:
+    """
+    Bounded capture of one output stream.
+
+    Only the first and last `limit // 2` bytes are kept in memory, so a runaway
+    print loop can't exhaust the executor's memory. Once the stream outgrows
+    `limit`, the whole of it is also written to `spill_path` (if given), up to
+    `spill_limit` bytes (0 for no limit).
+    """
+
+    def __init__(self, limit: int, spill_path: Optional[str] = None, spill_limit: int = 0):
+        self.head_size = limit // 2
+        self.tail_size = limit - self.head_size
+        self.spill_path = spill_path
+        self.spill_limit = spill_limit
+        self.total = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._spill = None
+        self._spilled = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > self.head_size + self.tail_size
+
+    def write(self, chunk: bytes) -> None:
+        self.total += len(chunk)
+        room = self.head_size - len(self._head)
+        if room > 0:
+            self._head += chunk[:room]
+            chunk = chunk[room:]
+        self._tail += chunk
+        if self.truncated and self.spill_path is not None:
+            if self._spill is None:
+                # Nothing was dropped yet: head and tail still hold the whole stream
+                self._spill = open(self.spill_path, "wb")
+                self._write_spill(bytes(self._head) + bytes(self._tail))
+            else:
+                self._write_spill(chunk)
+        # Trimmed in batches rather than on every chunk
+        if len(self._tail) > 2 * self.tail_size:
+            del self._tail[:len(self._tail) - self.tail_size]
+
+    def _write_spill(self, data: bytes) -> None:
+        if self.spill_limit:
+            data = data[:max(self.spill_limit - self._spilled, 0)]
+        if data:
+            self._spill.write(data)
+            self._spilled += len(data)
+
+    def close(self) -> None:
+        if self._spill is not None:
+            self._spill.close()
+
+    def text(self) -> str:
+        """The captured output; a truncated stream shows its head and tail around an omission note."""
+        if not self.truncated:
+            return (bytes(self._head) + bytes(self._tail)).decode("utf-8", errors="replace")
+        tail = bytes(self._tail[-self.tail_size:]) if self.tail_size else b""
+        omitted = self.total - len(self._head) - len(tail)
+        where = f", full output in {self.spill_path}" if self._spill is not None else ""
+        return (
+            self._head.decode("utf-8", errors="replace")
+            + f"\n[... {omitted} bytes omitted{where} ...]\n"
+            + tail.decode("utf-8", errors="replace")
+        )
+
+    def info(self) -> dict:
+        """Truncation metadata for the execution result."""
+        info = {"bytes": self.total, "truncated": self.truncated}
+        if self._spill is not None:
+            info["spill_path"] = self.spill_path
+            info["spilled_bytes"] = self._spilled
+        return info
+
+
+async def collect_output(
+    reader: asyncio.StreamReader,
+    on_line: Optional[LineCallback] = None,
+    capture: Optional[OutputCapture] = None,
+) -> str:
+    """
+    Reads a stream to EOF and returns it decoded.
+
+    When `on_line` is given it is awaited with every complete line as soon as it
+    arrives (and with a trailing partial line at EOF), so output can be relayed
+    while the script is still running; lines longer than MAX_LINE_BYTES are split.
+    With a `capture` the output is kept by it (bounded) instead of in full, and
+    its text() is returned.
+    """
+    chunks = []
+    pending = b""
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            break
+        if capture is not None:
+            capture.write(chunk)
+        else:
+            chunks.append(chunk)
+        if on_line is not None:
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            while len(pending) > MAX_LINE_BYTES:
+                lines.append(pending[:MAX_LINE_BYTES])
+                pending = pending[MAX_LINE_BYTES:]
+            for line in lines:
+                for start in range(0, max(len(line), 1), MAX_LINE_BYTES):
+                    await on_line(line[start:start + MAX_LINE_BYTES].decode("utf-8", errors="replace"))
+    if on_line is not None and pending:
+        await on_line(pending.decode("utf-8", errors="replace"))
+    if capture is not None:
+        capture.close()
+        return capture.text()
+    return b"".join(chunks).decode("utf-8", errors="replace")
+
+
+async def read_stream(pipe, on_line: Optional[LineCallback] = None, capture: Optional[OutputCapture] = None) -> str:
+    """Reads a pipe file object to EOF without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    try:
+        return await collect_output(reader, on_line, capture)
+    finally:
+        transport.close()
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], [m for m in sys.argv[2].split(",") if m])
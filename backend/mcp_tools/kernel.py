@@ -0,0 +1,361 @@
+"""
+Persistent per-run Python kernels for the secure code executor.
+
+A kernel is an isolated interpreter (started with `-I -u`, in its own session)
+that executes successive code cells in one shared namespace, so a DataFrame
+built by one plan step is still in memory for the next. Kernels listen on a
+Unix socket named after their kernel id, which lets any executor process of
+the pool reach the kernel of a run, and exit on their own after being idle.
+
+Protocol (one Unix socket connection per cell, cells run one at a time):
+    kernel   -> executor: {"pid": <kernel pid>}\n
+    executor -> kernel  : {"code": <cell source>, "cpu_seconds": <limit or 0>}\n  or  {"shutdown": true}\n
+    kernel   -> executor: {"stream": "stdout"|"stderr", "line": <text>}\n ...
+                          {"returncode": <0 or 1>}\n
+"""
+import asyncio
+import builtins
+import io
+import json
+import linecache
+import logging
+import os
+import re
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import traceback
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Kernels run with `-I`, which keeps this directory off sys.path: stdlib imports only
+LineCallback = Callable[[str], Awaitable[None]]
+
+READY_MESSAGE = "KERNEL_READY"
+KERNEL_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Longest line sent as one message; longer output without a newline is split
+MAX_LINE_CHARS = 16 * 1024
+
+
+def kernels_supported() -> bool:
+    return hasattr(socket, "AF_UNIX") and sys.platform != "win32"
+
+
+def kernel_dir() -> str:
+    """Private directory holding the kernels' sockets and spawn locks."""
+    path = os.path.join(tempfile.gettempdir(), f"executor-kernels-{os.getuid()}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+
+# --- Kernel side ---
+
+class _LineWriter(io.TextIOBase):
+    """A text stream that sends every complete line of cell output to the executor."""
+
+    def __init__(self, conn: socket.socket, stream_name: str):
+        self._conn = conn
+        self._stream_name = stream_name
+        self._pending = ""
+
+    @property
+    def encoding(self) -> str:
+        return "utf-8"
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            for start in range(0, max(len(line), 1), MAX_LINE_CHARS):
+                self._send(line[start:start + MAX_LINE_CHARS])
+        while len(self._pending) > MAX_LINE_CHARS:
+            self._send(self._pending[:MAX_LINE_CHARS])
+            self._pending = self._pending[MAX_LINE_CHARS:]
+        return len(text)
+
+    def flush(self) -> None:
+        if self._pending:
+            self._send(self._pending)
+            self._pending = ""
+
+    def _send(self, line: str) -> None:
+        try:
+            self._conn.sendall(json.dumps({"stream": self._stream_name, "line": line}).encode("utf-8") + b"\n")
+        except OSError:
+            pass  # The executor gave up on this cell; keep running to completion
+
+
+class CPUTimeLimitExceeded(Exception):
+    """Raised in a cell that used up its CPU time limit (SIGXCPU)."""
+
+
+def _on_cpu_limit(signum, frame):
+    raise CPUTimeLimitExceeded("CPU time limit exceeded")
+
+
+def _set_cpu_limit(seconds: float) -> None:
+    """Lets the kernel use `seconds` more CPU time before SIGXCPU; 0 lifts the limit."""
+    import resource  # Unix only, like the kernels themselves
+
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    else:
+        soft = hard
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+class _Kernel:
+    def __init__(self):
+        self.namespace = {"__name__": "__main__", "__builtins__": builtins}
+        self.cell_count = 0
+
+    def run_cell(self, code: str, conn: socket.socket, cpu_seconds: float = 0) -> int:
+        self.cell_count += 1
+        filename = f"<cell {self.cell_count}>"
+        # Lets tracebacks show the offending source line like a script would
+        linecache.cache[filename] = (len(code), None, code.splitlines(keepends=True), filename)
+
+        stdout, stderr = _LineWriter(conn, "stdout"), _LineWriter(conn, "stderr")
+        sys.stdout, sys.stderr = stdout, stderr
+        returncode = 0
+        try:
+            # The kernel outlives its cells, so each cell gets its own CPU time budget
+            _set_cpu_limit(cpu_seconds)
+            exec(compile(code, filename, "exec"), self.namespace)
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                returncode = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except BaseException as e:
+            # Drop the kernel's own frames so the traceback starts in the cell
+            tb = e.__traceback__
+            while tb is not None and tb.tb_frame.f_code.co_filename != filename:
+                tb = tb.tb_next
+            traceback.print_exception(type(e), e, tb or e.__traceback__)
+            returncode = 1
+        finally:
+            _set_cpu_limit(0)
+            stdout.flush()
+            stderr.flush()
+            sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        return returncode & 0xFF
+
+
+def serve(socket_path: str, idle_timeout: float) -> None:
+    """Kernel main loop: execute cells one connection at a time until idle or shut down."""
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen(16)
+    if idle_timeout > 0:
+        server.settimeout(idle_timeout)
+    print(READY_MESSAGE, flush=True)
+
+    # Ctrl-C style interrupts only abort the running cell
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    kernel = _Kernel()
+    try:
+        while True:
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            except KeyboardInterrupt:
+                continue
+            with conn:
+                conn.settimeout(None)
+                try:
+                    conn.sendall(json.dumps({"pid": os.getpid()}).encode("utf-8") + b"\n")
+                    request_line = conn.makefile("rb").readline()
+                    if not request_line:
+                        continue  # Liveness probe
+                    request = json.loads(request_line)
+                    if request.get("shutdown"):
+                        break
+                    returncode = kernel.run_cell(request["code"], conn, request.get("cpu_seconds", 0))
+                    conn.sendall(json.dumps({"returncode": returncode}).encode("utf-8") + b"\n")
+                except (KeyboardInterrupt, BrokenPipeError, ConnectionResetError):
+                    pass
+                except (OSError, ValueError, KeyError):
+                    traceback.print_exc()
+    finally:
+        server.close()
+        for path in (socket_path, os.path.splitext(socket_path)[0] + ".lock"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# --- Executor side ---
+
+class KernelClient:
+    """Starts, reaches and tears down the kernel of one graph run."""
+
+    def __init__(self, kernel_id: str, idle_timeout: float, startup_timeout: float = 30.0):
+        if not KERNEL_ID_PATTERN.match(kernel_id):
+            raise ValueError(f"Invalid kernel id: {kernel_id!r}")
+        self.kernel_id = kernel_id
+        self.idle_timeout = idle_timeout
+        self.startup_timeout = startup_timeout
+        self.socket_path = os.path.join(kernel_dir(), f"{kernel_id}.sock")
+
+    def _connectable(self) -> bool:
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.close()
+
+    def ensure_started(self, cwd: str, env: dict, preexec_fn: Optional[Callable[[], None]] = None) -> None:
+        """
+        Spawns the kernel unless it is already running. Blocks until it listens.
+
+        `preexec_fn` runs in the kernel process before it starts, e.g. to set rlimits.
+        """
+        import fcntl  # Unix only, like the kernels themselves
+
+        lock_path = os.path.join(kernel_dir(), f"{self.kernel_id}.lock")
+        with open(lock_path, "w") as lock:
+            # Executor processes may race to start the same run's kernel
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self._connectable():
+                return
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)  # Left behind by a killed kernel
+
+            process = subprocess.Popen(
+                [sys.executable, "-I", "-u", os.path.abspath(__file__), self.socket_path, str(self.idle_timeout)],
+                stdout=subprocess.PIPE,
+                stdin=subprocess.DEVNULL,
+                cwd=cwd,
+                env=env,
+                encoding="utf-8",
+                start_new_session=True,
+                preexec_fn=preexec_fn,
+            )
+            selector = selectors.DefaultSelector()
+            selector.register(process.stdout, selectors.EVENT_READ)
+            try:
+                if not selector.select(timeout=self.startup_timeout):
+                    process.kill()
+                    raise RuntimeError(f"Kernel {self.kernel_id} did not start within {self.startup_timeout}s")
+                line = process.stdout.readline().strip()
+                if line != READY_MESSAGE:
+                    raise RuntimeError(f"Kernel {self.kernel_id} failed to start (got {line!r})")
+            finally:
+                selector.close()
+                process.stdout.close()
+        logger.info(f"Started kernel {self.kernel_id} (pid {process.pid})")
+
+    async def run_cell(
+        self,
+        code: str,
+        timeout: float,
+        on_output: Optional[Dict[str, LineCallback]] = None,
+        capture: Optional[Dict[str, Any]] = None,
+        cpu_seconds: float = 0,
+    ) -> subprocess.CompletedProcess:
+        """
+        Executes a cell in the kernel namespace, mirroring subprocess.run semantics.
+
+        `capture` optionally maps "stdout"/"stderr" to bounded output captures
+        (fork_server.OutputCapture); `cpu_seconds` limits the cell's CPU time.
+
+        Raises:
+            subprocess.TimeoutExpired: If the cell outlives `timeout`. The cell is
+                interrupted first; a kernel that does not respond is killed and
+                its state is lost.
+        """
+        callbacks, captures = on_output or {}, capture or {}
+        reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=1 << 22)
+        pid = None
+        try:
+            pid = json.loads(await reader.readline())["pid"]
+            writer.write(json.dumps({"code": code, "cpu_seconds": cpu_seconds}).encode("utf-8") + b"\n")
+            await writer.drain()
+
+            output = {"stdout": [], "stderr": []}
+
+            async def communicate() -> int:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        raise RuntimeError(f"Kernel {self.kernel_id} exited while running a cell")
+                    message = json.loads(line)
+                    if "returncode" in message:
+                        return message["returncode"]
+                    if message["stream"] in captures:
+                        captures[message["stream"]].write(message["line"].encode("utf-8") + b"\n")
+                    else:
+                        output[message["stream"]].append(message["line"])
+                    on_line = callbacks.get(message["stream"])
+                    if on_line is not None:
+                        await on_line(message["line"])
+
+            try:
+                returncode = await asyncio.wait_for(communicate(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await self._interrupt(pid, communicate)
+                raise subprocess.TimeoutExpired(["<cell>"], timeout)
+            except asyncio.CancelledError:
+                self.kill(pid)
+                raise
+            for name, stream_capture in captures.items():
+                stream_capture.close()
+                output[name] = [stream_capture.text().removesuffix("\n")]
+            return subprocess.CompletedProcess(
+                ["<cell>"], returncode, "\n".join(output["stdout"]), "\n".join(output["stderr"])
+            )
+        finally:
+            writer.close()
+
+    async def _interrupt(self, pid: int, communicate) -> None:
+        """Interrupts a runaway cell, keeping the kernel if it recovers quickly."""
+        try:
+            os.kill(pid, signal.SIGINT)
+            await asyncio.wait_for(communicate(), timeout=2)
+        except (asyncio.TimeoutError, RuntimeError, ProcessLookupError, ValueError):
+            self.kill(pid)
+
+    def kill(self, pid: int) -> None:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    async def shutdown(self) -> bool:
+        """Asks the kernel to exit. Returns False if it was not running."""
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        except OSError:
+            return False
+        try:
+            await reader.readline()
+            writer.write(json.dumps({"shutdown": True}).encode("utf-8") + b"\n")
+            await writer.drain()
+        finally:
+            writer.close()
+        return True
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], float(sys.argv[2]))
@@ -0,0 +1,178 @@
+"""
+Sandbox worker daemon: serves secure_code_executor's execution path on a socket,
+so code can run on other cores or machines than the API and its LLM calls.
+
+The backend's WorkerDispatcher (app/services/sandbox_service.py) spreads plan
+steps over the workers listed in SANDBOX_WORKERS. Every request is one connection
+and newline-delimited JSON:
+
+    -> {"tool": "execute_python_code", "arguments": {"code": ..., "timeout": ..., "kernel_id": ...}, "token": ...}
+    <- {"stream": "stdout" | "stderr", "line": ...}     (while the script runs)
+    <- {"result": "Execution Result (code 0): ..."}     (or {"error": ...})
+
+"shutdown_kernel" ({"kernel_id": ...}) and "status" (load and capacity, used
+for health checks) are answered the same way, without output lines. Like the
+output relay of the stdio executor, the connection is the execution's lease:
+when the client hangs up mid-run, the script's process tree is killed.
+With SANDBOX_WORKER_TOKEN set, requests must carry the same token. The worker
+runs arbitrary code, so it refuses to listen on anything but a Unix socket or
+a loopback address without one.
+
+Run it with:
+    python mcp_tools/sandbox_worker.py --unix /tmp/sandbox-1.sock
+    SANDBOX_WORKER_TOKEN=<secret> python mcp_tools/sandbox_worker.py --host 0.0.0.0 --port 7071
+"""
+import argparse
+import asyncio
+import contextlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import signal
+from typing import Optional
+import secure_code_executor as executor
+from fork_server import kill_process_group, running_process_groups
+from kernel import kernels_supported
+
+logger = logging.getLogger(__name__)
+
+WORKER_TOKEN = os.getenv("SANDBOX_WORKER_TOKEN", "")
+
+# Largest request or reply line; results are bounded by EXECUTOR_OUTPUT_LIMIT_BYTES per stream
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+# Requests being served, executions waiting for a slot included
+_active = 0
+
+
+class ConnectionStream(executor.OutputStream):
+    """Relays output over the client's own connection, which is also the execution's lease."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        super().__init__(target="")
+        self._client = (reader, writer)
+
+    async def open(self) -> None:
+        self._reader, self._writer = self._client
+
+    async def close(self) -> None:
+        # The connection stays open for the result; only the relaying stops
+        if self._writer is not None:
+            with contextlib.suppress(ConnectionError, OSError):
+                await self._writer.drain()
+        self._writer = None
+
+
+def unsafe_bind(host: str, unix_path: Optional[str], token: str) -> Optional[str]:
+    """Why listening on `host` would expose code execution without authentication, if it would."""
+    if unix_path or token:
+        return None
+    if host == "localhost":
+        return None
+    try:
+        if ipaddress.ip_address(host).is_loopback:
+            return None
+    except ValueError:
+        pass  # A hostname, which may resolve to any interface
+    return f"Refusing to listen on {host} without SANDBOX_WORKER_TOKEN: anyone who can reach it could run code"
+
+
+def status() -> dict:
+    return {
+        "active": _active,
+        "capacity": executor.MAX_CONCURRENT_EXECUTIONS,
+        "pid": os.getpid(),
+        "fork_server": executor._fork_server is not None and executor._fork_server.running,
+        "kernels": kernels_supported(),
+    }
+
+
+async def _reply(writer: asyncio.StreamWriter, **message) -> None:
+    writer.write(json.dumps(message).encode("utf-8") + b"\n")
+    await writer.drain()
+
+
+async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    global _active
+    try:
+        try:
+            request = json.loads(await reader.readline())
+            tool, arguments = request.get("tool"), request.get("arguments") or {}
+        except (ValueError, AttributeError):
+            return await _reply(writer, error="Malformed request")
+        if WORKER_TOKEN and not hmac.compare_digest(str(request.get("token", "")), WORKER_TOKEN):
+            logger.warning("Rejected a request with an invalid token")
+            return await _reply(writer, error="Invalid worker token")
+
+        if tool == "status":
+            return await _reply(writer, result=status())
+        if tool == "shutdown_kernel" and isinstance(arguments.get("kernel_id"), str):
+            return await _reply(writer, result=await executor.shutdown_kernel(arguments["kernel_id"]))
+        if tool == "execute_python_code" and isinstance(arguments.get("code"), str):
+            _active += 1
+            try:
+                result = await executor.run_code(
+                    arguments["code"],
+                    arguments.get("timeout", executor.DEFAULT_TIMEOUT),
+                    ConnectionStream(reader, writer),
+                    arguments.get("kernel_id"),
+                )
+            finally:
+                _active -= 1
+            return await _reply(writer, result=result)
+        await _reply(writer, error=f"Unknown tool or missing arguments: {tool!r}")
+    except (ConnectionError, OSError):
+        pass  # The client left; an execution in progress was stopped by its lease
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, unix_path: Optional[str] = None) -> None:
+    """Serves requests until SIGTERM or SIGINT."""
+    if unix_path:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(unix_path)  # Left behind by a worker that didn't exit cleanly
+        server = await asyncio.start_unix_server(handle_connection, unix_path, limit=MAX_MESSAGE_BYTES)
+        logger.info(f"Sandbox worker listening on unix:{unix_path}")
+    else:
+        server = await asyncio.start_server(handle_connection, host, port, limit=MAX_MESSAGE_BYTES)
+        logger.info(f"Sandbox worker listening on {host}:{port}")
+
+    stop = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):  # Windows
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+    async with server:
+        await stop.wait()
+    if unix_path:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(unix_path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7071)
+    parser.add_argument("--unix", help="Listen on this Unix socket instead of TCP")
+    args = parser.parse_args()
+    problem = unsafe_bind(args.host, args.unix, WORKER_TOKEN)
+    if problem:
+        parser.error(problem)
+
+    logger.info(f"Max concurrent executions: {executor.MAX_CONCURRENT_EXECUTIONS}")
+    # Pay the library imports once, before the first request arrives
+    executor.start_fork_server()
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix))
+    finally:
+        # Scripts run in their own sessions and would outlive the worker otherwise
+        for pid in list(running_process_groups):
+            kill_process_group(pid)
+        if executor._fork_server is not None:
+            executor._fork_server.stop()
+
+
+if __name__ == "__main__":
+    main()
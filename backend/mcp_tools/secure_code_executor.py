@@ -1,15 +1,33 @@
-import ast
+import asyncio
+import contextlib
+import functools
+import json
 import os
+import signal
 import subprocess
 import sys
 import logging
 import tempfile
 import time
+import uuid
 from pathlib import Path
-from langchain_mcp_adapters.protocol import (
-    tool_from_function,
-    serve_from_stdin_stdout,
+from typing import Awaitable, Dict, Optional
+from mcp.server.fastmcp import FastMCP
+from fork_server import (
+    ForkServer,
+    LineCallback,
+    OutputCapture,
+    apply_resource_limits,
+    collect_output,
+    fork_server_supported,
+    kill_process_group,
+    running_process_groups,
 )
+from kernel import KernelClient, kernels_supported
+
+# The static analysis rules are shared with the backend, which checks code before dispatch
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from app.services.security_service import get_security_analyzer, is_code_safe
 
 # --- Setup Logging ---
 logging.basicConfig(
@@ -24,67 +42,304 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-# --- Enhanced Safety Checks ---
-DENY_LIST_MODULES = {
-    'os', 'shutil', 'subprocess', 'sys', 'importlib', 
-    'exec', 'eval', '__import__', 'compile', 'globals', 'locals'
-}
-DENY_LIST_FUNCTIONS = {
-    'exec', 'eval', '__import__', 'compile', 'open', 'file',
-    'input', 'raw_input', 'execfile', 'reload'
-}
-DENY_LIST_ATTRIBUTES = {
-    '__globals__', '__locals__', '__dict__', '__class__',
-    '__bases__', '__subclasses__'
+# --- Execution Settings ---
+# Fork-server mode runs scripts in children forked from a warm zygote that has
+# already imported the allowed libraries. Disable it to spawn a cold interpreter per run.
+FORK_SERVER_ENABLED = os.getenv("EXECUTOR_FORK_SERVER", "1") == "1" and fork_server_supported()
+PRELOAD_MODULES = [
+    m.strip() for m in os.getenv("EXECUTOR_PRELOAD_MODULES", "pandas,numpy,requests,bs4").split(",") if m.strip()
+]
+
+# Concurrency and timeouts. Each tool call may request its own timeout,
+# which is capped at EXECUTOR_MAX_TIMEOUT seconds.
+MAX_CONCURRENT_EXECUTIONS = int(os.getenv("EXECUTOR_MAX_CONCURRENCY", str(os.cpu_count() or 4)))
+DEFAULT_TIMEOUT = float(os.getenv("EXECUTOR_DEFAULT_TIMEOUT", "30"))
+MAX_TIMEOUT = float(os.getenv("EXECUTOR_MAX_TIMEOUT", "300"))
+
+# Persistent kernels (one interpreter per graph run) exit after this many idle seconds
+KERNEL_IDLE_TIMEOUT = float(os.getenv("EXECUTOR_KERNEL_IDLE_TIMEOUT", "600"))
+
+# Output kept per stream (half head, half tail) and returned with the result. Longer
+# output is also written to a file under workspace/outputs, up to the spill limit.
+OUTPUT_LIMIT_BYTES = int(os.getenv("EXECUTOR_OUTPUT_LIMIT_BYTES", str(64 * 1024)))
+OUTPUT_SPILL_LIMIT_BYTES = int(os.getenv("EXECUTOR_OUTPUT_SPILL_LIMIT_MB", "64")) * 1024 * 1024
+# Output relayed live to the backend per run; the rest is only in the result
+STREAM_LIMIT_BYTES = int(os.getenv("EXECUTOR_STREAM_LIMIT_BYTES", str(1024 * 1024)))
+
+# Kernel-enforced limits on every script (0 disables a limit). The process limit
+# counts all processes of the executor's user, so it is off by default.
+RESOURCE_LIMITS = {
+    "RLIMIT_AS": int(os.getenv("EXECUTOR_LIMIT_MEMORY_MB", "4096")) * 1024 * 1024,
+    "RLIMIT_CPU": int(os.getenv("EXECUTOR_LIMIT_CPU_SECONDS", "60")),
+    "RLIMIT_NOFILE": int(os.getenv("EXECUTOR_LIMIT_OPEN_FILES", "256")),
+    "RLIMIT_FSIZE": int(os.getenv("EXECUTOR_LIMIT_FILE_SIZE_MB", "256")) * 1024 * 1024,
+    "RLIMIT_NPROC": int(os.getenv("EXECUTOR_LIMIT_PROCESSES", "0")),
 }
+# Return codes of scripts killed by a signal the limits send (SIGXCPU, then SIGKILL)
+LIMIT_KILL_CODES = {-getattr(signal, name) for name in ("SIGXCPU", "SIGKILL") if hasattr(signal, name)}
+
+# Last line of a completed run's result; the backend strips it off for its sandbox metrics
+RESOURCES_PREFIX = "[resources]"
+
+_fork_server: Optional[ForkServer] = None
+_fork_server_lock: Optional[asyncio.Lock] = None
+_execution_slots: Optional[asyncio.Semaphore] = None
+
+def start_fork_server() -> Optional[ForkServer]:
+    """Starts the fork server if it is enabled and not running yet. Blocks while preloading."""
+    global _fork_server
+    if not FORK_SERVER_ENABLED:
+        return None
+    if _fork_server is None:
+        _fork_server = ForkServer(PRELOAD_MODULES)
+    if not _fork_server.running:
+        try:
+            _fork_server.start()
+        except Exception as e:
+            logger.error(f"Failed to start fork server, using cold interpreters: {e}")
+            return None
+    return _fork_server
+
+
+async def get_fork_server() -> Optional[ForkServer]:
+    """Returns the running fork server, restarting it off the event loop if it died."""
+    global _fork_server_lock
+    if not FORK_SERVER_ENABLED:
+        return None
+    if _fork_server is not None and _fork_server.running:
+        return _fork_server
+    if _fork_server_lock is None:
+        _fork_server_lock = asyncio.Lock()
+    async with _fork_server_lock:
+        return await asyncio.to_thread(start_fork_server)
+
+
+class OutputStream:
+    """
+    Relays script output to the backend line by line while the script runs.
+
+    `target` has the form "host:port/token" and points at the backend's output
+    relay. Streaming is best effort: if the relay cannot be reached or goes away,
+    the run continues and the full output is still returned with the result.
+    """
+
+    def __init__(self, target: str, limit_bytes: int = STREAM_LIMIT_BYTES):
+        self.target = target
+        self.limit_bytes = limit_bytes
+        self._relayed = 0
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
 
-def is_code_safe(code: str) -> tuple[bool, str]:
-    """Enhanced AST-based safety check for Python code."""
+    async def open(self) -> None:
+        try:
+            address, _, token = self.target.partition("/")
+            host, _, port = address.rpartition(":")
+            self._reader, self._writer = await asyncio.open_connection(host, int(port))
+            self._writer.write(f"{token}\n".encode("utf-8"))
+            await self._writer.drain()
+        except (OSError, ValueError) as e:
+            logger.warning(f"Output streaming unavailable: {e}")
+            self._writer = None
+
+    def callbacks(self) -> Dict[str, LineCallback]:
+        return {name: self._make_callback(name) for name in ("stdout", "stderr")}
+
+    def _make_callback(self, stream_name: str) -> LineCallback:
+        async def on_line(line: str) -> None:
+            # Past the limit the connection stays open: it is still the run's lease
+            if self._writer is None or self._relayed > self.limit_bytes:
+                return
+            self._relayed += len(line) + 1
+            message = {"stream": stream_name, "line": line}
+            if self._relayed > self.limit_bytes:
+                message = {"stream": "stderr", "line": f"[Live output stopped after {self.limit_bytes} bytes; see the result]"}
+            try:
+                self._writer.write(json.dumps(message).encode("utf-8") + b"\n")
+                await self._writer.drain()
+            except (ConnectionError, OSError) as e:
+                logger.warning(f"Output relay disconnected: {e}")
+                self._writer = None
+        return on_line
+
+    async def wait_hangup(self) -> None:
+        """Returns when the backend closes the relay connection, i.e. abandons the run."""
+        try:
+            while await self._reader.read(4096):
+                pass
+        except (ConnectionError, OSError):
+            pass
+
+    async def close(self) -> None:
+        if self._writer is None:
+            return
+        try:
+            self._writer.close()
+            await self._writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+        self._writer = None
+
+
+class ExecutionCancelled(Exception):
+    """The backend hung up on the output relay while the script was running."""
+
+
+async def _run_until_hangup(run: Awaitable[subprocess.CompletedProcess], output_stream: Optional[OutputStream]):
+    """
+    Awaits an execution, cancelling it if the backend hangs up on its output stream.
+
+    Cancelling the run kills the script's process group (or the kernel running the cell).
+    """
+    if output_stream is None or not output_stream.connected:
+        return await run
+    run_task = asyncio.ensure_future(run)
+    hangup = asyncio.create_task(output_stream.wait_hangup())
     try:
-        tree = ast.parse(code)
-        
-        for node in ast.walk(tree):
-            # Check imports
-            if isinstance(node, (ast.Import, ast.ImportFrom)):
-                for alias in node.names:
-                    module_name = alias.name.split('.')[0]  # Get root module
-                    if module_name in DENY_LIST_MODULES:
-                        return False, f"Unsafe import detected: '{alias.name}'"
-            
-            # Check function calls
-            elif isinstance(node, ast.Call):
-                if isinstance(node.func, ast.Name):
-                    if node.func.id in DENY_LIST_FUNCTIONS:
-                        return False, f"Unsafe function call detected: '{node.func.id}()'"
-                elif isinstance(node.func, ast.Attribute):
-                    if node.func.attr in DENY_LIST_FUNCTIONS:
-                        return False, f"Unsafe method call detected: '{node.func.attr}()'"
-            
-            # Check attribute access
-            elif isinstance(node, ast.Attribute):
-                if node.attr in DENY_LIST_ATTRIBUTES:
-                    return False, f"Unsafe attribute access detected: '{node.attr}'"
-            
-            # Check for dangerous assignments
-            elif isinstance(node, ast.Assign):
-                for target in node.targets:
-                    if isinstance(target, ast.Name) and target.id in DENY_LIST_FUNCTIONS:
-                        return False, f"Attempted to override builtin: '{target.id}'"
-                        
-    except SyntaxError as e:
-        return False, f"Code has syntax errors: {e}"
-    except Exception as e:
-        return False, f"Code analysis failed: {e}"
-        
-    return True, "Code passed static analysis."
+        await asyncio.wait({run_task, hangup}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        # The tool call itself was cancelled: stop the run too instead of orphaning it
+        run_task.cancel()
+        with contextlib.suppress(BaseException):
+            await run_task
+        raise
+    finally:
+        hangup.cancel()
+    if not run_task.done():
+        run_task.cancel()
+        with contextlib.suppress(BaseException):
+            await run_task
+        raise ExecutionCancelled()
+    return run_task.result()
+
+
+def _kill_process_tree(process: asyncio.subprocess.Process) -> None:
+    if sys.platform == 'win32':
+        process.kill()
+    else:
+        kill_process_group(process.pid)
 
 
-def execute_python_code(code: str) -> str:
+async def _run_subprocess(
+    script_path: str,
+    cwd: str,
+    env: dict,
+    timeout: float,
+    on_output: Optional[Dict[str, LineCallback]] = None,
+    capture: Optional[Dict[str, OutputCapture]] = None,
+    limits: Optional[Dict[str, int]] = None,
+) -> subprocess.CompletedProcess:
+    """Runs a script in a fresh interpreter placed in its own process group, with `limits` as rlimits."""
+    preexec_fn = functools.partial(apply_resource_limits, limits) if limits and sys.platform != 'win32' else None
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-I", "-u", script_path,  # -u for unbuffered output
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        start_new_session=sys.platform != 'win32',
+        preexec_fn=preexec_fn,
+        creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+    )
+    callbacks, captures = on_output or {}, capture or {}
+    running_process_groups.add(process.pid)
+
+    async def communicate():
+        output = await asyncio.gather(
+            collect_output(process.stdout, callbacks.get("stdout"), captures.get("stdout")),
+            collect_output(process.stderr, callbacks.get("stderr"), captures.get("stderr")),
+        )
+        await process.wait()
+        return output
+
+    try:
+        stdout, stderr = await asyncio.wait_for(communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        _kill_process_tree(process)
+        await process.wait()
+        raise subprocess.TimeoutExpired([script_path], timeout)
+    except asyncio.CancelledError:
+        _kill_process_tree(process)
+        raise
+    finally:
+        running_process_groups.discard(process.pid)
+    return subprocess.CompletedProcess([script_path], process.returncode, stdout, stderr)
+
+
+async def run_script(
+    script_path: str,
+    cwd: str,
+    env: dict,
+    timeout: float,
+    on_output: Optional[Dict[str, LineCallback]] = None,
+    capture: Optional[Dict[str, OutputCapture]] = None,
+    limits: Optional[Dict[str, int]] = None,
+) -> subprocess.CompletedProcess:
+    """Runs a script through the fork server when available, else in a fresh interpreter."""
+    fork_server = await get_fork_server()
+    if fork_server is not None:
+        try:
+            return await fork_server.run(
+                script_path, cwd=cwd, env=env, timeout=timeout, on_output=on_output, capture=capture, limits=limits
+            )
+        except subprocess.TimeoutExpired:
+            raise
+        except Exception as e:
+            logger.error(f"Fork server execution failed, falling back to a cold interpreter: {e}")
+            fork_server.stop()
+
+    return await _run_subprocess(
+        script_path, cwd=cwd, env=env, timeout=timeout, on_output=on_output, capture=capture, limits=limits
+    )
+
+
+async def execute_python_code(
+    code: str,
+    timeout: float = DEFAULT_TIMEOUT,
+    stream_to: Optional[str] = None,
+    kernel_id: Optional[str] = None,
+) -> str:
     """
     Safely executes Python code in an isolated subprocess with enhanced error handling.
+
+    Runs are asynchronous, so a single executor server can serve many callers at once;
+    at most EXECUTOR_MAX_CONCURRENCY scripts run simultaneously and the rest wait.
+    `timeout` is the wall-clock limit in seconds for this run (capped at EXECUTOR_MAX_TIMEOUT).
+    `stream_to` ("host:port/token") asks for stdout/stderr lines to be relayed to the
+    backend as they are produced, in addition to the final result. The stream also acts
+    as a lease: if the backend hangs up on it mid-run, the script's process tree is killed.
+    `kernel_id` runs the code as a cell of that persistent kernel instead, so variables
+    defined by earlier cells of the same kernel are still available. The kernel is
+    started on first use and removed by shutdown_kernel() or after being idle.
+
+    Scripts run under the RESOURCE_LIMITS rlimits (memory, CPU time, open files, file
+    size, processes). Only the head and tail of long output are returned; the whole
+    of it is written to a file under workspace/outputs.
+    Completed runs end with a `[resources] {...}` line giving the execution mode, its
+    wall time, the size of each output stream (with its file when truncated) and,
+    for fork-server runs, the child's CPU time and peak RSS (rusage).
+    """
+    return await run_code(code, timeout, OutputStream(stream_to) if stream_to else None, kernel_id)
+
+
+async def run_code(
+    code: str,
+    timeout: float = DEFAULT_TIMEOUT,
+    output_stream: Optional[OutputStream] = None,
+    kernel_id: Optional[str] = None,
+) -> str:
     """
+    The execution path behind execute_python_code, for callers that bring their own
+    output stream (see sandbox_worker.py, where it is the worker's client connection).
+    """
+    global _execution_slots
     logger.info(f"Received code execution request")
     logger.debug(f"Code to execute:\n{code}")
+
+    timeout = min(max(float(timeout), 1.0), MAX_TIMEOUT)
     
     # Safety check
     is_safe, reason = is_code_safe(code)
@@ -101,43 +356,80 @@ def execute_python_code(code: str) -> str:
         logger.error(f"Failed to create workspace directory: {e}")
         return f"Execution Error: Failed to create workspace directory: {e}"
 
+    if _execution_slots is None:
+        _execution_slots = asyncio.Semaphore(MAX_CONCURRENT_EXECUTIONS)
+
+    kernel = None
+    if kernel_id is not None:
+        if not kernels_supported():
+            return "Execution Error: Persistent kernels are not supported on this platform."
+        try:
+            kernel = KernelClient(kernel_id, idle_timeout=KERNEL_IDLE_TIMEOUT)
+        except ValueError as e:
+            return f"Execution Error: {e}"
+
     # Create temporary script file
     script_path = None
+    capture = None
     try:
-        with tempfile.NamedTemporaryFile(
-            mode='w', 
-            suffix='.py', 
-            dir=workspace_dir, 
-            delete=False,
-            encoding='utf-8'
-        ) as f:
-            f.write(code)
-            script_path = f.name
-            
-        logger.info(f"Created temporary script: {script_path}")
+        if kernel is None:
+            with tempfile.NamedTemporaryFile(
+                mode='w', 
+                suffix='.py', 
+                dir=workspace_dir, 
+                delete=False,
+                encoding='utf-8'
+            ) as f:
+                f.write(code)
+                script_path = f.name
+                
+            logger.info(f"Created temporary script: {script_path}")
         
         # Prepare execution environment
         env = os.environ.copy()
         env['PYTHONPATH'] = str(workspace_dir)
         env['PYTHONIOENCODING'] = 'utf-8'
+
+        # Output is kept bounded; the full output is spilled next to the scripts
+        outputs_dir = workspace_dir / 'outputs'
+        outputs_dir.mkdir(exist_ok=True)
+        run_name = uuid.uuid4().hex[:12]
+        capture = {
+            name: OutputCapture(OUTPUT_LIMIT_BYTES, str(outputs_dir / f"{run_name}.{name}.log"), OUTPUT_SPILL_LIMIT_BYTES)
+            for name in ("stdout", "stderr")
+        }
         
-        # Execute the script
-        logger.info(f"Executing script with timeout=30s")
-        start_time = time.time()
-        
-        result = subprocess.run(
-            [sys.executable, "-I", "-u", script_path],  # -u for unbuffered output
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            timeout=30,
-            cwd=str(workspace_dir),
-            encoding="utf-8",
-            errors="replace",  # Handle encoding errors gracefully
-            env=env,
-            creationflags=subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
-        )
-        
-        execution_time = time.time() - start_time
+        async with _execution_slots:
+            # Execute the script
+            logger.info(f"Executing {'cell in kernel ' + kernel_id if kernel else 'script'} with timeout={timeout:g}s")
+            start_time = time.time()
+
+            on_output = None
+            if output_stream is not None:
+                await output_stream.open()
+                on_output = output_stream.callbacks()
+
+            if kernel is not None:
+                # The kernel's CPU limit is set per cell, the others once for its lifetime
+                kernel_limits = {name: value for name, value in RESOURCE_LIMITS.items() if name != "RLIMIT_CPU"}
+                await asyncio.to_thread(
+                    kernel.ensure_started,
+                    cwd=str(workspace_dir),
+                    env=env,
+                    preexec_fn=functools.partial(apply_resource_limits, kernel_limits),
+                )
+                run = kernel.run_cell(
+                    code, timeout=timeout, on_output=on_output, capture=capture,
+                    cpu_seconds=RESOURCE_LIMITS["RLIMIT_CPU"],
+                )
+            else:
+                run = run_script(
+                    script_path, cwd=str(workspace_dir), env=env, timeout=timeout,
+                    on_output=on_output, capture=capture, limits=RESOURCE_LIMITS,
+                )
+            result = await _run_until_hangup(run, output_stream)
+
+            execution_time = time.time() - start_time
         logger.info(f"Execution completed in {execution_time:.2f}s with return code: {result.returncode}")
         
         # Prepare output
@@ -150,16 +442,31 @@ def execute_python_code(code: str) -> str:
                 output += f"\n[STDERR]: {stderr}"
         else:
             output = f"[ERROR - Return Code {result.returncode}]"
+            if kernel is None and result.returncode in LIMIT_KILL_CODES:
+                output += f"\n[Killed: over the CPU time limit ({RESOURCE_LIMITS['RLIMIT_CPU']}s) or by the system]"
             if stderr:
                 output += f"\n{stderr}"
             if stdout:
                 output += f"\n[STDOUT]: {stdout}"
         
-        return f"Execution Result (code {result.returncode}):\n---_START_OF_OUTPUT_---\n{output}\n---_END_OF_OUTPUT_---"
+        usage = {
+            "mode": "kernel" if kernel is not None else ("fork" if hasattr(result, "resources") else "cold"),
+            "wall": round(execution_time, 4),
+            **getattr(result, "resources", {}),
+            "output": {name: stream_capture.info() for name, stream_capture in capture.items()},
+        }
+        return (
+            f"Execution Result (code {result.returncode}):\n---_START_OF_OUTPUT_---\n{output}\n---_END_OF_OUTPUT_---"
+            f"\n{RESOURCES_PREFIX} {json.dumps(usage)}"
+        )
+
+    except ExecutionCancelled:
+        logger.warning("Execution cancelled: the backend abandoned the run, process tree killed")
+        return "Execution Cancelled: the backend abandoned this run."
 
     except subprocess.TimeoutExpired:
-        logger.error("Execution timed out after 30 seconds")
-        return "Execution Error: Process timed out after 30 seconds."
+        logger.error(f"Execution timed out after {timeout:g} seconds")
+        return f"Execution Error: Process timed out after {timeout:g} seconds."
     
     except subprocess.CalledProcessError as e:
         logger.error(f"Process failed with return code {e.returncode}: {e}")
@@ -178,6 +485,13 @@ def execute_python_code(code: str) -> str:
         return f"Execution Error: An unexpected error occurred: {e}"
     
     finally:
+        # Flush relayed output before the result is returned
+        if output_stream is not None:
+            await output_stream.close()
+        if capture is not None:
+            for stream_capture in capture.values():
+                stream_capture.close()
+
         # Clean up temporary file
         if script_path and os.path.exists(script_path):
             try:
@@ -187,18 +501,45 @@ def execute_python_code(code: str) -> str:
                 logger.warning(f"Failed to clean up temporary script: {e}")
 
 
+async def shutdown_kernel(kernel_id: str) -> str:
+    """Stops a persistent kernel started by execute_python_code(kernel_id=...) and frees its memory."""
+    if not kernels_supported():
+        return "Kernel Shutdown: persistent kernels are not supported on this platform."
+    try:
+        stopped = await KernelClient(kernel_id, idle_timeout=KERNEL_IDLE_TIMEOUT).shutdown()
+    except ValueError as e:
+        return f"Kernel Shutdown Error: {e}"
+    logger.info(f"Kernel {kernel_id} {'stopped' if stopped else 'was not running'}")
+    return f"Kernel Shutdown: {'stopped' if stopped else 'not running'}"
+
+
 if __name__ == "__main__":
     logger.info("=== Secure Code Executor Service Starting ===")
     logger.info(f"Python version: {sys.version}")
     logger.info(f"Platform: {sys.platform}")
+    logger.info(f"Fork server mode: {'enabled' if FORK_SERVER_ENABLED else 'disabled'}")
+
+    logger.info(f"Max concurrent executions: {MAX_CONCURRENT_EXECUTIONS}")
+    logger.info(f"Denied modules: {', '.join(sorted(get_security_analyzer().deny_modules))}")
+
+    # Pay the library imports once, before the first request arrives
+    start_fork_server()
     logger.info("Listening on stdin/stdout for MCP communication...")
     
-    mcp_tool = tool_from_function(execute_python_code)
-    
+    server = FastMCP("secure_executor")
+    server.add_tool(execute_python_code)
+    server.add_tool(shutdown_kernel)
+
     try:
-        serve_from_stdin_stdout([mcp_tool])
+        server.run("stdio")
     except KeyboardInterrupt:
         logger.info("Service stopped by user")
     except Exception as e:
         logger.critical(f"MCP server crashed: {e}", exc_info=True)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        # Scripts run in their own sessions and would outlive the executor otherwise
+        for pid in list(running_process_groups):
+            kill_process_group(pid)
+        if _fork_server is not None:
+            _fork_server.stop()
\ No newline at end of file
@@ -0,0 +1,819 @@
+import asyncio
+import json
+import pytest
+from langchain_core.messages import AIMessage
+from app.orchestor import nodes
+from app.orchestor.graph import create_agent_graph
+from app.orchestor.state_models import AgentState
+from app.services.llm_services import ModelRole
+
+
+class FakeLLM:
+    """Answers every prompt with a fixed message and remembers the prompts and call options."""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.prompts = []
+        self.call_options = []
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        self.call_options.append(kwargs)
+        return AIMessage(content=self.content)
+
+
+def install_fakes(monkeypatch, plan: list, step_seconds: float = 0.0, coder: FakeLLM = None, failing_code: set = ()) -> list:
+    """Replaces the LLMs and the sandbox; returns the (event, step) log of sandbox runs."""
+    planner = FakeLLM(json.dumps({"plan": plan}))
+    coder = coder or FakeLLM("print('ok')")
+    router = FakeLLM("MULTI")  # Every prompt goes to the planner
+
+    async def fake_aget_llm(role, verify_connection=True, use_cache=True):
+        return {ModelRole.PLANNER: planner, ModelRole.ROUTER: router}.get(role, coder)
+
+    log = []
+
+    async def fake_run_in_sandbox(code, step, kernel_id=None):
+        if kernel_id:
+            log.append(("kernel", kernel_id))
+        log.append(("start", step))
+        await asyncio.sleep(step_seconds)
+        log.append(("end", step))
+        if code in failing_code:
+            return f"Execution Result (code 1):\nTraceback (most recent call last):\nNameError: step {step}\n"
+        return f"Execution Result (code 0):\nSTDOUT:\nstep {step}\n"
+
+    monkeypatch.setattr(nodes.llm_services, "aget_llm", fake_aget_llm)
+    monkeypatch.setattr(nodes, "run_in_sandbox", fake_run_in_sandbox)
+    monkeypatch.setattr(nodes.task_memory, "enabled", False)
+    return log
+
+
+def event_data(frame: str) -> dict:
+    """The JSON payload of an SSE frame."""
+    return json.loads(frame.partition("data: ")[2])
+
+
+def test_parse_plan_keeps_flat_plans_sequential_and_drops_forward_dependencies():
+    steps, deps = nodes.parse_plan([
+        {"step": "fetch a", "depends_on": []},
+        {"step": "fetch b", "depends_on": [2]},
+        {"step": "merge", "depends_on": [0, 1, 1]},
+    ])
+    assert steps == ["fetch a", "fetch b", "merge"]
+    assert deps == [[], [], [0, 1]]
+    assert nodes.parse_plan(["a", "b"])[1] == [[], [0]]
+
+
+@pytest.mark.asyncio
+async def test_planner_output_is_constrained_to_the_plan_schema(monkeypatch):
+    install_fakes(monkeypatch, ["only step"])
+    planner = FakeLLM(json.dumps({"plan": ["only step"]}))
+    dag_planner = FakeLLM(json.dumps({"plan": [{"step": "only step", "depends_on": []}]}))
+
+    for llm, parallel, schema in ((planner, False, nodes.PLAN_SCHEMA_SEQUENTIAL), (dag_planner, True, nodes.PLAN_SCHEMA_DAG)):
+        async def fake_aget_llm(role, verify_connection=True, use_cache=True):
+            return llm if role == ModelRole.PLANNER else FakeLLM("MULTI")
+
+        monkeypatch.setattr(nodes.llm_services, "aget_llm", fake_aget_llm)
+        result = await nodes.planner_node(AgentState(original_prompt="do it", parallel=parallel))
+        assert result["plan"] == ["only step"]
+        assert llm.call_options == [{"format": schema}]
+
+
+@pytest.mark.asyncio
+async def test_independent_steps_run_concurrently_before_dependents(monkeypatch):
+    plan = [{"step": f"fetch source {i}", "depends_on": []} for i in range(3)]
+    plan.append({"step": "merge the sources", "depends_on": [0, 1, 2]})
+    log = install_fakes(monkeypatch, plan, step_seconds=0.2)
+    monkeypatch.setattr(nodes, "MAX_PARALLEL_STEPS", 4)
+
+    final = await create_agent_graph().ainvoke({"original_prompt": "merge", "parallel": True})
+
+    assert final.get("error") is None
+    assert sorted(final["step_results"]) == [0, 1, 2, 3]
+    # The three fetches all started before any of them ended, then the merge ran
+    assert max(log.index(("start", i)) for i in range(3)) < min(log.index(("end", i)) for i in range(3))
+    assert log.index(("start", 3)) > max(log.index(("end", i)) for i in range(3))
+
+
+@pytest.mark.asyncio
+async def test_parallel_steps_respect_concurrency_limit(monkeypatch):
+    plan = [{"step": f"fetch source {i}", "depends_on": []} for i in range(4)]
+    log = install_fakes(monkeypatch, plan, step_seconds=0.05)
+    monkeypatch.setattr(nodes, "MAX_PARALLEL_STEPS", 2)
+
+    await create_agent_graph().ainvoke({"original_prompt": "fetch", "parallel": True})
+
+    running = peak = 0
+    for event, _ in log:
+        running += 1 if event == "start" else -1
+        peak = max(peak, running)
+    assert peak == 2
+
+
+class StepCoder(FakeLLM):
+    """Writes numbered code for whichever plan step it is asked about, logging each call."""
+
+    def __init__(self, plan: list):
+        super().__init__("")
+        self.plan = plan
+        self.log = []
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        text = prompt[-1].content
+        if "Failing code" in text:
+            return AIMessage(content="fixed()")
+        step = next(index for index, name in enumerate(self.plan) if f"step: '{name}'" in text)
+        self.log.append(("code", step))
+        return AIMessage(content=f"print({step}, {len(self.prompts)})")
+
+
+@pytest.mark.asyncio
+async def test_pipelined_code_is_generated_while_the_previous_step_runs(monkeypatch):
+    plan = ["step zero", "step one", "step two"]
+    coder = StepCoder(plan)
+    coder.log = log = install_fakes(monkeypatch, plan, step_seconds=0.05, coder=coder)
+
+    final = await create_agent_graph().ainvoke({"original_prompt": "do it", "pipeline": True})
+
+    assert final["current_step"] == 3
+    assert log == [
+        ("code", 0),
+        ("start", 0), ("code", 1), ("end", 0),
+        ("start", 1), ("code", 2), ("end", 1),
+        ("start", 2), ("end", 2),
+    ]
+    assert len(coder.prompts) == 3  # One generation per step
+    assert final["step_code"] == {0: "print(0, 1)", 1: "print(1, 2)", 2: "print(2, 3)"}
+
+
+@pytest.mark.asyncio
+async def test_speculative_code_is_discarded_when_the_step_fails(monkeypatch):
+    plan = ["step zero", "step one"]
+    coder = StepCoder(plan)
+    coder.log = log = install_fakes(monkeypatch, plan, step_seconds=0.05, coder=coder, failing_code={"print(0, 1)"})
+
+    final = await create_agent_graph().ainvoke({"original_prompt": "do it", "pipeline": True})
+
+    assert final.get("error") is None
+    assert log == [
+        ("code", 0),
+        ("start", 0), ("code", 1), ("end", 0),  # Step 0 fails: its speculation is thrown away
+        ("start", 0), ("code", 1), ("end", 0),  # The repaired step 0 speculates again
+        ("start", 1), ("end", 1),
+    ]
+    # Step 1 ran the code generated after the repair, not the discarded one
+    assert final["step_code"] == {0: "fixed()", 1: "print(1, 4)"}
+
+
+async def stream_event_types(inputs: dict) -> list:
+    from app.api import agent_router
+
+    stream = agent_router.agent_event_stream(inputs, inputs["run_id"], False, False)
+    return [event_data(event)["type"] async for event in stream]
+
+
+@pytest.mark.asyncio
+async def test_only_graph_nodes_are_streamed(monkeypatch):
+    install_fakes(monkeypatch, ["fetch", "merge"])
+    sequential = await stream_event_types({"original_prompt": "do it", "run_id": "run-s"})
+    assert sequential == ["run", "classify", "planner", "generate_code", "execute_code", "generate_code", "execute_code", "stream_end"]
+
+    install_fakes(monkeypatch, [{"step": "fetch", "depends_on": []}, {"step": "merge", "depends_on": [0]}])
+    parallel = await stream_event_types({"original_prompt": "do it", "run_id": "run-p", "parallel": True})
+    assert parallel == ["run", "classify", "planner", "execute_batch", "execute_batch", "stream_end"]
+
+
+@pytest.mark.asyncio
+async def test_single_step_prompts_skip_the_planner(monkeypatch):
+    from app.orchestor.nodes import classification
+
+    install_fakes(monkeypatch, ["unused"])
+    router, planner = FakeLLM("SINGLE"), FakeLLM("{}")
+
+    async def fake_aget_llm(role, verify_connection=True, use_cache=True):
+        return {ModelRole.ROUTER: router, ModelRole.PLANNER: planner}.get(role, FakeLLM("print('ok')"))
+
+    monkeypatch.setattr(classification.llm_services, "aget_llm", fake_aget_llm)
+    inputs = {"original_prompt": " print today's date ", "run_id": "run-f"}
+    assert await stream_event_types(inputs) == ["run", "classify", "generate_code", "execute_code", "stream_end"]
+    assert planner.prompts == [] and len(router.prompts) == 1
+
+    result = await create_agent_graph().ainvoke({"original_prompt": "print today's date", "parallel": True})
+    assert result["plan"] == ["print today's date"]
+    assert result["step_results"].keys() == {0}
+
+    # Prompts announcing several steps never reach the router model
+    await create_agent_graph().ainvoke({"original_prompt": "download the file, then count its lines"})
+    assert len(router.prompts) == 2
+    assert len(planner.prompts) == 1
+
+
+@pytest.mark.asyncio
+async def test_router_failure_falls_back_to_the_planner(monkeypatch):
+    install_fakes(monkeypatch, ["only step"])
+    planner = FakeLLM(json.dumps({"plan": ["only step"]}))
+
+    async def fake_aget_llm(role, verify_connection=True, use_cache=True):
+        if role == ModelRole.ROUTER:
+            raise ConnectionError("router model not pulled")
+        return planner if role == ModelRole.PLANNER else FakeLLM("print('ok')")
+
+    monkeypatch.setattr(nodes.llm_services, "aget_llm", fake_aget_llm)
+    result = await create_agent_graph().ainvoke({"original_prompt": "print today's date"})
+    assert result["plan"] == ["only step"] and not result["fast_path"]
+    assert len(planner.prompts) == 1
+
+
+@pytest.mark.asyncio
+async def test_sequential_mode_is_unchanged(monkeypatch):
+    log = install_fakes(monkeypatch, ["step one", "step two"])
+
+    final = await create_agent_graph().ainvoke({"original_prompt": "do it"})
+
+    assert final["current_step"] == 2
+    assert sorted(final["step_results"]) == [0, 1]
+    assert log == [("start", 0), ("end", 0), ("start", 1), ("end", 1)]
+
+
+@pytest.mark.asyncio
+async def test_persistent_kernel_runs_steps_in_one_kernel_with_code_context(monkeypatch):
+    coder = FakeLLM("df = load()")
+    log = install_fakes(monkeypatch, ["load the data", "summarise it"], coder=coder)
+
+    final = await create_agent_graph().ainvoke(
+        {"original_prompt": "analyse", "run_id": "run-1", "persistent_kernel": True}
+    )
+
+    assert [entry for entry in log if entry[0] == "kernel"] == [("kernel", "run-1")] * 2
+    assert final["kernel_history"] == ["df = load()", "df = load()"]
+    first_prompt, second_prompt = (prompt[-1].content for prompt in coder.prompts)
+    assert "already executed" not in first_prompt
+    assert "already executed in this session" in second_prompt and "df = load()" in second_prompt
+
+
+class RepairingCoder(FakeLLM):
+    """Writes broken code for step generation and fixed code when asked to repair."""
+
+    def __init__(self):
+        super().__init__("broken()")
+
+    async def ainvoke(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return AIMessage(content="fixed()" if "Failing code" in prompt[-1].content else "broken()")
+
+
+@pytest.mark.asyncio
+async def test_failed_step_is_repaired_in_place(monkeypatch):
+    coder = RepairingCoder()
+    log = install_fakes(monkeypatch, ["only step"], coder=coder, failing_code={"broken()"})
+
+    final = await create_agent_graph().ainvoke({"original_prompt": "do it"})
+
+    assert final.get("error") is None
+    assert final["generated_code"] == "fixed()"
+    assert final["current_step"] == 1
+    assert log == [("start", 0), ("end", 0), ("start", 0), ("end", 0)]
+    assert "NameError: step 0" in coder.prompts[-1][-1].content
+
+
+@pytest.mark.asyncio
+async def test_tokens_are_streamed_before_each_node_result(monkeypatch):
+    import itertools
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from app.api import agent_router
+
+    install_fakes(monkeypatch, ["only step"])
+    planner = GenericFakeChatModel(messages=iter([AIMessage(content='{"plan": ["only step"]}')]))
+    coder = GenericFakeChatModel(messages=itertools.repeat(AIMessage(content="print('hello world')")))
+
+    async def fake_aget_llm(role, verify_connection=True, use_cache=True):
+        return {ModelRole.PLANNER: planner, ModelRole.ROUTER: FakeLLM("MULTI")}.get(role, coder)
+
+    monkeypatch.setattr(nodes.llm_services, "aget_llm", fake_aget_llm)
+    stream = agent_router.agent_event_stream({"original_prompt": "do it", "run_id": "run-t"}, "run-t", True, False)
+    events = [event_data(event) async for event in stream]
+    types = [event["type"] for event in events]
+
+    plan_deltas = [event["data"]["delta"] for event in events if event["type"] == "plan_delta"]
+    code_deltas = [event["data"]["delta"] for event in events if event["type"] == "code_delta"]
+    assert len(plan_deltas) > 1 and "".join(plan_deltas) == '{"plan": ["only step"]}'
+    assert len(code_deltas) > 1 and "".join(code_deltas) == "print('hello world')"
+    # Every delta arrives before the result of the node that produced it
+    assert max(i for i, t in enumerate(types) if t == "plan_delta") < types.index("planner")
+    assert types.index("planner") < min(i for i, t in enumerate(types) if t == "code_delta")
+    assert max(i for i, t in enumerate(types) if t == "code_delta") < types.index("generate_code")
+
+
+@pytest.mark.asyncio
+async def test_repairs_are_streamed_without_router_events(monkeypatch):
+    install_fakes(monkeypatch, ["only step"], coder=RepairingCoder(), failing_code={"broken()"})
+
+    types = await stream_event_types({"original_prompt": "do it", "run_id": "run-r"})
+    assert types == ["run", "classify", "planner", "generate_code", "execute_code", "diagnose_error", "execute_code", "stream_end"]
+
+
+@pytest.mark.asyncio
+async def test_repairs_are_bounded(monkeypatch):
+    from app.orchestor.nodes import error_diagnosis
+
+    monkeypatch.setattr(error_diagnosis, "MAX_REPAIR_ATTEMPTS", 1)
+    log = install_fakes(monkeypatch, ["step one", "step two"], failing_code={"print('ok')"})
+
+    final = await create_agent_graph().ainvoke({"original_prompt": "do it"})
+
+    assert final["error"].startswith("Step 0 still failed after 1 repair attempt(s)")
+    assert [entry for entry in log if entry[0] == "start"] == [("start", 0), ("start", 0)]
+
+
+@pytest.mark.asyncio
+async def test_parallel_steps_are_repaired_individually(monkeypatch):
+    plan = [{"step": "fetch a", "depends_on": []}, {"step": "fetch b", "depends_on": []}]
+    log = install_fakes(monkeypatch, plan, coder=RepairingCoder(), failing_code={"broken()"})
+
+    final = await create_agent_graph().ainvoke({"original_prompt": "fetch", "parallel": True})
+
+    assert final.get("error") is None
+    assert sorted(final["step_results"]) == [0, 1]
+    assert sum(1 for event, _ in log if event == "start") == 4
+
+
+class BackendCrash(BaseException):
+    """Escapes the nodes' error handling, like the process dying mid-run."""
+
+
+@pytest.mark.asyncio
+async def test_interrupted_run_resumes_from_last_completed_step(monkeypatch, tmp_path):
+    from app.api import agent_router
+    from app.orchestor import graph
+
+    log = install_fakes(monkeypatch, ["step one", "step two", "step three"])
+    fake_run_in_sandbox = nodes.run_in_sandbox
+    crash = {"step": 1}
+
+    async def crashing_run_in_sandbox(code, step, kernel_id=None):
+        if step == crash["step"]:
+            crash["step"] = None
+            raise BackendCrash()
+        return await fake_run_in_sandbox(code, step, kernel_id)
+
+    monkeypatch.setattr(nodes, "run_in_sandbox", crashing_run_in_sandbox)
+    await graph.enable_checkpointing(str(tmp_path / "checkpoints.sqlite"))
+    try:
+        with pytest.raises(BackendCrash):
+            await graph.agent_executor.ainvoke(
+                {"original_prompt": "do it", "run_id": "run-1"}, agent_router.run_config("run-1")
+            )
+
+        run = await agent_router.get_run("run-1")
+        assert run["status"] == "interrupted"
+        assert run["step_results"] == {0: "Execution Result (code 0):\nSTDOUT:\nstep 0\n"}
+        assert run["step_code"] == {0: "print('ok')"}
+
+        events = [e async for e in agent_router.agent_event_stream(None, "run-1", False, False)]
+        assert event_data(events[0])["data"] == {"run_id": "run-1", "resumed": True}
+
+        run = await agent_router.get_run("run-1")
+        assert run["status"] == "completed"
+        assert run["current_step"] == 3
+        assert [step for event, step in log if event == "start"] == [0, 1, 2]  # Step 0 did not run again
+    finally:
+        await graph.disable_checkpointing()
+
+
+@pytest.mark.asyncio
+async def test_closing_the_event_stream_cancels_the_run(monkeypatch, tmp_path):
+    from app.api import agent_router
+    from app.orchestor import graph
+
+    install_fakes(monkeypatch, ["step one", "step two"])
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def hanging_run_in_sandbox(code, step, kernel_id=None):
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    monkeypatch.setattr(nodes, "run_in_sandbox", hanging_run_in_sandbox)
+    await graph.enable_checkpointing(str(tmp_path / "checkpoints.sqlite"))
+    try:
+        stream = agent_router.agent_event_stream({"original_prompt": "do it", "run_id": "run-2"}, "run-2", False, False)
+        await stream.__anext__()
+        await asyncio.wait_for(started.wait(), timeout=2)
+        await stream.aclose()  # What the server does when the client goes away
+
+        await asyncio.wait_for(cancelled.wait(), timeout=2)
+        await asyncio.gather(*agent_router._cleanup_tasks)
+        run = await agent_router.get_run("run-2")
+        assert run["status"] == "cancelled"
+        assert run["cancellation_reason"] == "event stream closed"
+        assert run["next"] == ["execute_code"]
+    finally:
+        await graph.disable_checkpointing()
+
+
+
+@pytest.mark.asyncio
+async def test_resumed_persistent_kernel_run_gets_its_variables_back(monkeypatch, tmp_path):
+    import contextlib
+    import io
+    from app.api import agent_router
+    from app.orchestor import graph
+
+    coder = FakeLLM("")
+
+    async def step_coder(prompt, **kwargs):
+        return AIMessage(content="print(total + 2)" if "step: 'print the total'" in prompt[-1].content else "total = 40")
+
+    coder.ainvoke = step_coder
+    install_fakes(monkeypatch, ["set the total", "print the total"], coder=coder)
+    kernels, started = {}, asyncio.Event()
+
+    async def kernel_run_in_sandbox(code, step, kernel_id=None):
+        if step == 1 and not started.is_set():
+            started.set()
+            await asyncio.sleep(60)  # The client leaves while the second step runs
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                exec(code, kernels.setdefault(kernel_id, {}))
+        except NameError as e:
+            return f"Execution Result (code 1):\nTraceback (most recent call last):\nNameError: {e}\n"
+        return f"Execution Result (code 0):\nSTDOUT:\n{output.getvalue()}"
+
+    async def fake_shutdown_kernel(kernel_id):
+        kernels.pop(kernel_id, None)
+
+    monkeypatch.setattr(nodes, "run_in_sandbox", kernel_run_in_sandbox)
+    monkeypatch.setattr(agent_router, "shutdown_kernel", fake_shutdown_kernel)
+    await graph.enable_checkpointing(str(tmp_path / "checkpoints.sqlite"))
+    try:
+        inputs = {"original_prompt": "total", "run_id": "run-k", "persistent_kernel": True}
+        stream = agent_router.agent_event_stream(inputs, "run-k", False, True)
+        await stream.__anext__()
+        await asyncio.wait_for(started.wait(), timeout=2)
+        await stream.aclose()
+        await asyncio.gather(*agent_router._cleanup_tasks)
+        assert "run-k" not in kernels  # The kernel went with the stream
+
+        events = [event_data(e) async for e in agent_router.agent_event_stream(None, "run-k", False, True)]
+        assert not [event for event in events if event["type"] == "error"]
+        run = await agent_router.get_run("run-k")
+        assert run["status"] == "completed"
+        assert "42" in run["step_results"][1]
+    finally:
+        await graph.disable_checkpointing()
+
+@pytest.mark.asyncio
+async def test_unknown_runs_are_reported():
+    from fastapi import HTTPException
+    from app.api import agent_router
+
+    with pytest.raises(HTTPException) as excinfo:
+        await agent_router.get_run("missing")
+    assert excinfo.value.status_code == 503  # No checkpointer outside the app lifespan
+
+
+@pytest.mark.asyncio
+async def test_queued_run_reports_its_position_and_starts_when_admitted(monkeypatch):
+    from app.api import agent_router
+    from app.services.scheduler_service import RunScheduler
+
+    log = install_fakes(monkeypatch, ["step one"])
+    scheduler = RunScheduler(max_active=1, max_queued=10, max_queued_per_client=10)
+    running = scheduler.enqueue("a")
+    ticket = scheduler.enqueue("b")
+
+    stream = agent_router.agent_event_stream({"original_prompt": "do it", "run_id": "run-3"}, "run-3", False, False, None, ticket)
+    events = [event_data((await stream.__anext__())) for _ in range(2)]
+    assert [event["type"] for event in events] == ["run", "queued"]
+    assert events[1]["data"] == {"position": 1}
+    assert log == []  # Nothing runs before the run is admitted
+
+    running.release()
+    events = [event_data(event) async for event in stream]
+    assert events[-1]["type"] == "stream_end"
+    await asyncio.gather(*agent_router._cleanup_tasks)
+    assert [step for event, step in log if event == "start"] == [0]
+    assert scheduler.info()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_closing_a_queued_stream_gives_up_its_place(monkeypatch):
+    from app.api import agent_router
+    from app.services.scheduler_service import RunScheduler
+
+    log = install_fakes(monkeypatch, ["step one"])
+    scheduler = RunScheduler(max_active=1, max_queued=10, max_queued_per_client=10)
+    running = scheduler.enqueue("a")
+    ticket = scheduler.enqueue("b")
+    behind = scheduler.enqueue("c")
+
+    stream = agent_router.agent_event_stream({"original_prompt": "do it", "run_id": "run-4"}, "run-4", False, False, None, ticket)
+    await stream.__anext__()
+    await stream.__anext__()  # queued
+    await stream.aclose()
+    await asyncio.gather(*agent_router._cleanup_tasks)
+
+    assert ticket.released
+    assert behind.position == 1
+    running.release()
+    assert behind.admitted.is_set()
+    assert log == []
+
+
+def make_test_client(monkeypatch, scheduler):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api import agent_router
+
+    monkeypatch.setattr(agent_router, "run_scheduler", scheduler)
+    app = FastAPI()
+    app.include_router(agent_router.router, prefix="/api")
+    return TestClient(app)
+
+
+def test_full_run_queue_answers_429(monkeypatch):
+    from app.api import agent_router
+    from app.services.scheduler_service import RunScheduler
+
+    scheduler = RunScheduler(max_active=1, max_queued=1, max_queued_per_client=1)
+    scheduler.enqueue("a")
+    scheduler.enqueue("b")
+    monkeypatch.setattr(agent_router, "RUN_QUEUE_RETRY_AFTER", 7)
+
+    response = make_test_client(monkeypatch, scheduler).post("/api/process_prompt", json={"prompt": "do it"})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "7"
+    assert scheduler.stats["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_run_slot_is_released_when_the_response_never_starts():
+    from app.api import agent_router
+    from app.services.scheduler_service import RunScheduler
+
+    scheduler = RunScheduler(max_active=1, max_queued=10, max_queued_per_client=10)
+    ticket = scheduler.enqueue("a")
+
+    async def body():
+        yield "never sent"
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    async def send(message):
+        raise OSError("client went away")  # Fails on http.response.start, before the body is read
+
+    response = agent_router.RunStreamingResponse(body(), ticket)
+    with pytest.raises(Exception):  # The OSError, possibly wrapped in an exception group
+        await response({"type": "http"}, receive, send)
+    assert ticket.released
+    assert scheduler.info()["active"] == 0
+
+
+@pytest.mark.asyncio
+async def test_identical_coalesced_prompts_share_one_run(monkeypatch):
+    from starlette.requests import Request
+    from app.api import agent_router
+    from app.orchestor.state_models import PromptRequest
+    from app.services.scheduler_service import RunScheduler
+    from app.services.single_flight_service import SingleFlight
+
+    log = install_fakes(monkeypatch, ["step one", "step two"], step_seconds=0.05)
+    scheduler = RunScheduler(max_active=4, max_queued=10, max_queued_per_client=10)
+    monkeypatch.setattr(agent_router, "run_scheduler", scheduler)
+    monkeypatch.setattr(agent_router, "run_coalescer", SingleFlight())
+
+    def post(prompt: str, client: str):
+        http_request = Request({"type": "http", "headers": [], "client": (client, 1234)})
+        return agent_router.process_prompt(PromptRequest(prompt=prompt, coalesce=True), http_request, False, False, False)
+
+    async def read(response) -> list:
+        return [event_data(event) async for event in response.body_iterator]
+
+    first = await post("fetch the prices", "10.0.0.1")
+    first_events = [event_data((await first.body_iterator.__anext__()))]
+    # A second dashboard joins mid-run, and a different prompt gets its own run
+    second = await post("fetch  the prices ", "10.0.0.2")
+    other = await post("fetch the volumes", "10.0.0.3")
+    first_events += await read(first)
+    second_events, other_events = await read(second), await read(other)
+    await asyncio.gather(*agent_router._cleanup_tasks)
+
+    assert second_events == first_events
+    assert first_events[-1]["type"] == "stream_end"
+    assert len({event["data"]["run_id"] for event in first_events + other_events if event["type"] == "run"}) == 2
+    assert [step for event, step in log if event == "start"] == [0, 0, 1, 1]  # Two runs of two steps, not three
+    assert scheduler.stats["admitted"] == 2
+    assert scheduler.info()["active"] == 0
+
+
+
+@pytest.mark.asyncio
+async def test_shared_run_slot_belongs_to_the_run_not_the_first_response(monkeypatch):
+    from starlette.requests import Request
+    from app.api import agent_router
+    from app.orchestor.state_models import PromptRequest
+    from app.services.scheduler_service import RunScheduler
+    from app.services.single_flight_service import SingleFlight
+
+    log = install_fakes(monkeypatch, ["step one"], step_seconds=0.05)
+    scheduler = RunScheduler(max_active=4, max_queued=10, max_queued_per_client=10)
+    monkeypatch.setattr(agent_router, "run_scheduler", scheduler)
+    monkeypatch.setattr(agent_router, "run_coalescer", SingleFlight())
+
+    def post(prompt: str):
+        http_request = Request({"type": "http", "headers": [], "client": ("10.0.0.1", 1234)})
+        return agent_router.process_prompt(PromptRequest(prompt=prompt, coalesce=True), http_request, False, False, False)
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    async def send(message):
+        raise OSError("client went away")
+
+    # The first client's response fails while a second client still follows the run
+    first, second = await post("fetch the prices"), await post("fetch the prices")
+    with pytest.raises(Exception):
+        await first({"type": "http"}, receive, send)
+    assert scheduler.info()["active"] == 1
+    assert [event_data(e) async for e in second.body_iterator][-1]["type"] == "stream_end"
+    await asyncio.gather(*agent_router._cleanup_tasks)
+    assert scheduler.info()["active"] == 0
+
+    # A shared run left before its stream ever started gives its slot back too
+    abandoned = await post("fetch the volumes")
+    abandoned.source.unsubscribe()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert scheduler.info()["active"] == 0
+    assert [step for event, step in log if event == "start"] == [0]
+
+@pytest.mark.asyncio
+async def test_completed_runs_are_remembered_and_their_plans_reused(monkeypatch, tmp_path):
+    from app.services.memory_service import TaskMemory
+
+    install_fakes(monkeypatch, ["fetch prices", "plot them"])
+    embeddings = {
+        "chart the prices": [1, 0, 0],
+        "chart the prices!": [0.99, 0.01, 0],  # Near-identical
+        "chart the volumes": [0.8, 0.6, 0],  # Similar
+        "write a poem": [0, 0, 1],
+    }
+
+    async def fake_embed(text):
+        return embeddings[text]
+
+    task_memory = TaskMemory(directory=str(tmp_path))
+    task_memory.embed = fake_embed
+    monkeypatch.setattr(nodes, "task_memory", task_memory)
+    monkeypatch.setattr(nodes.memory_update, "task_memory", task_memory)
+    planner = FakeLLM(json.dumps({"plan": ["fetch volumes", "plot them"]}))
+    coder = FakeLLM("print('new')")
+
+    async def fake_aget_llm(role, verify_connection=True, use_cache=True):
+        return {ModelRole.PLANNER: planner, ModelRole.ROUTER: FakeLLM("MULTI")}.get(role, coder)
+
+    await create_agent_graph().ainvoke({"original_prompt": "chart the prices"})  # The default planner
+    assert [entry.prompt for entry in task_memory.index.entries] == ["chart the prices"]
+    assert task_memory.index.entries[0].plan == ["fetch prices", "plot them"]
+
+    monkeypatch.setattr(nodes.llm_services, "aget_llm", fake_aget_llm)
+    reused = await create_agent_graph().ainvoke({"original_prompt": "chart the prices!"})
+    assert reused["reused_plan"] and reused["plan"] == ["fetch prices", "plot them"]
+    assert reused["step_code"] == {0: "print('ok')", 1: "print('ok')"}  # The remembered code, run again
+    assert planner.prompts == [] and coder.prompts == []
+    assert task_memory.index.count == 1  # A replayed plan isn't stored again
+
+    similar = await create_agent_graph().ainvoke({"original_prompt": "chart the volumes"})
+    assert similar["plan"] == ["fetch volumes", "plot them"]
+    assert 'Request: chart the prices\nPlan: {"plan": ["fetch prices", "plot them"]}' in planner.prompts[0][-1].content
+
+    await create_agent_graph().ainvoke({"original_prompt": "write a poem"})
+    assert "Similar requests" not in planner.prompts[1][-1].content
+    assert task_memory.index.count == 3
+
+
+@pytest.mark.asyncio
+async def test_timings_event_summarizes_the_run_and_metrics_are_exposed(monkeypatch):
+    from fastapi.testclient import TestClient
+    from starlette.requests import Request
+    from app.api import agent_router
+    from app.main import app
+    from app.orchestor.state_models import PromptRequest
+    from app.services.scheduler_service import RunScheduler
+
+    install_fakes(monkeypatch, ["step one", "step two"])
+    monkeypatch.setattr(agent_router, "run_scheduler", RunScheduler(max_active=1, max_queued=1, max_queued_per_client=1))
+    http_request = Request({"type": "http", "headers": [], "client": ("10.0.0.1", 1234)})
+    response = await agent_router.process_prompt(PromptRequest(prompt="chart the prices"), http_request, False, True, False)
+    events = [event_data(event) async for event in response.body_iterator]
+    await asyncio.gather(*agent_router._cleanup_tasks)
+
+    assert [event["type"] for event in events[-2:]] == ["timings", "stream_end"]
+    timings = events[-2]["data"]
+    assert timings["nodes"]["generate_code"]["calls"] == 2
+    assert timings["nodes"]["execute_code"]["calls"] == 2
+    assert set(timings["nodes"]) >= {"classify", "planner", "update_memory"}
+    assert timings["total_seconds"] >= sum(node["seconds"] for node in timings["nodes"].values())
+
+    metrics = TestClient(app).get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'agent_node_duration_seconds_count{node="execute_code"}' in metrics.text
+    assert "agent_run_queue_depth 0" in metrics.text
+
+
+@pytest.mark.asyncio
+async def test_lean_stream_sends_state_changes_and_sandbox_output(monkeypatch):
+    from app.api import agent_router
+
+    install_fakes(monkeypatch, ["fetch", "merge"])
+    fake_run_in_sandbox = nodes.run_in_sandbox
+
+    async def relaying_run_in_sandbox(code, step, kernel_id=None):
+        lines = asyncio.Queue()
+        for item in ({"stream": "stdout", "line": f"working on {step}"}, None):
+            lines.put_nowait(item)
+        await nodes._forward_execution_output(lines, step)
+        return await fake_run_in_sandbox(code, step, kernel_id)
+
+    monkeypatch.setattr(nodes, "run_in_sandbox", relaying_run_in_sandbox)
+    stream = agent_router.agent_event_stream({"original_prompt": "do it", "run_id": "run-l"}, "run-l", False, False, lean=True)
+    frames = [frame async for frame in stream]
+    events = [event_data(frame) for frame in frames]
+
+    assert [event["type"] for event in events] == [
+        "run", "classify", "planner",
+        "generate_code", "execution_output", "execute_code",
+        "generate_code", "execution_output", "execute_code", "stream_end",
+    ]
+    assert [frame.partition("\n")[0] for frame in frames] == [f"id: {index}" for index in range(1, 11)]
+    first_step, second_step = [event for event in events if event["type"] == "execute_code"]
+    assert first_step["data"]["step_results"] == {"0": "Execution Result (code 0):\nSTDOUT:\nstep 0\n"}
+    # The second step only sends its own result and code, and leaves out what didn't change
+    assert "step_results" not in second_step["data"] and "repair_attempts" not in second_step["data"]
+    assert second_step["merge"] == {
+        "step_results": {"1": "Execution Result (code 0):\nSTDOUT:\nstep 1\n"}, "step_code": {"1": "print('ok')"},
+    }
+    assert events[4]["data"] == {"step": 0, "stream": "stdout", "line": "working on 0"}
+
+
+@pytest.mark.asyncio
+async def test_lean_stream_forwards_tokens(monkeypatch):
+    import itertools
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from app.api import agent_router
+
+    install_fakes(monkeypatch, ["only step"])
+    coder = GenericFakeChatModel(messages=itertools.repeat(AIMessage(content="print('hello world')")))
+
+    async def fake_aget_llm(role, verify_connection=True, use_cache=True):
+        return {ModelRole.PLANNER: FakeLLM('{"plan": ["only step"]}'), ModelRole.ROUTER: FakeLLM("MULTI")}.get(role, coder)
+
+    monkeypatch.setattr(nodes.llm_services, "aget_llm", fake_aget_llm)
+    stream = agent_router.agent_event_stream({"original_prompt": "do it", "run_id": "run-lt"}, "run-lt", True, False, lean=True)
+    events = [event_data(frame) async for frame in stream]
+    types = [event["type"] for event in events]
+
+    code_deltas = [event["data"]["delta"] for event in events if event["type"] == "code_delta"]
+    assert len(code_deltas) > 1 and "".join(code_deltas) == "print('hello world')"
+    assert max(i for i, t in enumerate(types) if t == "code_delta") < types.index("generate_code")
+
+
+@pytest.mark.asyncio
+async def test_missed_events_are_replayed_after_the_last_event_id(monkeypatch):
+    from starlette.requests import Request
+    from fastapi import HTTPException
+    from app.api import agent_router
+
+    install_fakes(monkeypatch, ["step one"])
+    frames = [frame async for frame in agent_router.agent_event_stream({"original_prompt": "do it", "run_id": "run-replay"}, "run-replay", False, False)]
+
+    http_request = Request({"type": "http", "headers": [], "client": ("10.0.0.1", 1234)})
+    response = await agent_router.get_run_events("run-replay", http_request, 3)
+    assert [frame async for frame in response.body_iterator] == frames[3:]
+    with pytest.raises(HTTPException) as excinfo:
+        await agent_router.get_run_events("unknown-run", http_request, None)
+    assert excinfo.value.status_code == 404
+
+
+def test_event_streams_are_gzipped_for_clients_that_accept_it(monkeypatch):
+    import zlib
+    from app.api import agent_router
+    from app.services.scheduler_service import RunScheduler
+
+    install_fakes(monkeypatch, ["step one"])
+    monkeypatch.setattr(agent_router, "SSE_GZIP", True)
+    client = make_test_client(monkeypatch, RunScheduler(max_active=1, max_queued=1, max_queued_per_client=1))
+    with client.stream("POST", "/api/process_prompt", json={"prompt": "do it"}, headers={"accept-encoding": "gzip"}) as response:
+        assert response.headers["content-encoding"] == "gzip"
+        body = zlib.decompress(b"".join(response.iter_raw()), 16 + zlib.MAX_WBITS).decode()
+    frames = [frame for frame in body.split("\n\n") if frame]
+    assert event_data(frames[-1])["type"] == "stream_end"
@@ -0,0 +1,172 @@
+import asyncio
+import pytest
+from app.orchestor import nodes
+from app.services.sandbox_service import ExecutorPool, OutputRelay, call_executor_tool
+
+
+@pytest.mark.asyncio
+async def test_steps_run_through_a_real_pooled_executor(monkeypatch):
+    pool = ExecutorPool(size=1, health_check_interval=0)
+    relay = OutputRelay()
+    monkeypatch.setattr(nodes, "executor_pool", pool)
+    monkeypatch.setattr(nodes, "output_relay", relay)
+    try:
+        first = await nodes.run_in_sandbox("print(6 * 7)", 0)
+        second = await nodes.run_in_sandbox("raise SystemExit(3)", 1)
+        assert first == "Execution Result (code 0):\n---_START_OF_OUTPUT_---\n42\n---_END_OF_OUTPUT_---"
+        assert second.startswith("Execution Result (code 3)")
+        assert nodes.execution_failed(second)
+        # Both steps were served by the same executor process
+        assert pool.status()["created"] == 1
+        assert pool.status()["acquired"] == 2
+    finally:
+        await pool.close()
+        await relay.close()
+
+
+@pytest.mark.asyncio
+async def test_tool_errors_are_raised():
+    pool = ExecutorPool(size=1, health_check_interval=0)
+    try:
+        async with pool.session() as session:
+            with pytest.raises(RuntimeError, match="execute_python_code"):
+                await call_executor_tool(session, "execute_python_code", {"timeout": 5})  # No code
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_kernel_is_shut_down_through_the_pool(monkeypatch):
+    import uuid
+    from app.services import sandbox_service
+
+    pool = ExecutorPool(size=1, health_check_interval=0)
+    relay = OutputRelay()
+    monkeypatch.setattr(nodes, "executor_pool", pool)
+    monkeypatch.setattr(nodes, "output_relay", relay)
+    monkeypatch.setattr(sandbox_service, "executor_pool", pool)
+    kernel_id = uuid.uuid4().hex
+    try:
+        await nodes.run_in_sandbox("total = 40", 0, kernel_id=kernel_id)
+        assert "42" in await nodes.run_in_sandbox("print(total + 2)", 1, kernel_id=kernel_id)
+
+        await sandbox_service.shutdown_kernel(kernel_id)
+        async with pool.session() as session:
+            result = await call_executor_tool(session, "shutdown_kernel", {"kernel_id": kernel_id})
+        assert result == "Kernel Shutdown: not running"
+    finally:
+        await pool.close()
+        await relay.close()
+
+
+async def start_workers(tmp_path, count: int, token: str = "") -> list:
+    """Starts sandbox worker daemons on Unix sockets; returns (process, address) pairs once they answer."""
+    import os
+    import sys
+    from pathlib import Path
+    from app.services.sandbox_service import SandboxWorker
+
+    script = Path(__file__).resolve().parents[2] / "mcp_tools" / "sandbox_worker.py"
+    env = {**os.environ, "SANDBOX_WORKER_TOKEN": token, "EXECUTOR_PRELOAD_MODULES": ""}
+    workers = []
+    for index in range(count):
+        address = f"unix:{tmp_path / f'worker-{index}.sock'}"
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, str(script), "--unix", address[len("unix:"):],
+            env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        workers.append((process, address))
+    for _, address in workers:
+        for _ in range(200):
+            if await SandboxWorker(address, token=token).check():
+                break
+            await asyncio.sleep(0.05)
+        else:
+            raise TimeoutError(f"Sandbox worker {address} did not start")
+    return workers
+
+
+async def stop_workers(workers: list) -> None:
+    for process, _ in workers:
+        if process.returncode is None:
+            process.terminate()
+            await process.wait()
+
+
+@pytest.mark.asyncio
+async def test_steps_are_spread_over_sandbox_workers_and_fail_over(monkeypatch, tmp_path):
+    from app.services.sandbox_service import SandboxWorker, WorkerDispatcher
+
+    workers = await start_workers(tmp_path, 2, token="secret")
+    dispatcher = WorkerDispatcher(
+        [address for _, address in workers], health_check_interval=0,
+        worker_factory=lambda address: SandboxWorker(address, token="secret"),
+    )
+    monkeypatch.setattr(nodes, "worker_dispatcher", dispatcher)
+    try:
+        await dispatcher.start()
+        results = await asyncio.gather(*(nodes.run_in_sandbox(f"print({i} * 7)", i) for i in range(4)))
+        assert results[3] == "Execution Result (code 0):\n---_START_OF_OUTPUT_---\n21\n---_END_OF_OUTPUT_---"
+        assert [worker.stats["executions"] for worker in dispatcher.workers] == [2, 2]
+
+        with pytest.raises(RuntimeError, match="Invalid worker token"):
+            await SandboxWorker(workers[0][1], token="wrong").call("status")
+
+        # Steps fail over from a stopped worker, which is then skipped while it is down
+        await stop_workers(workers[:1])
+        for step in (4, 5, 6):
+            assert "42" in await nodes.run_in_sandbox("print(6 * 7)", step)
+        assert not dispatcher.workers[0].healthy
+        assert dispatcher.stats["failovers"] == 1
+    finally:
+        await dispatcher.close()
+        await stop_workers(workers)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_step_stops_its_script_on_the_worker(tmp_path):
+    from app.services.sandbox_service import WorkerDispatcher
+
+    workers = await start_workers(tmp_path, 1)
+    dispatcher = WorkerDispatcher([address for _, address in workers], health_check_interval=0)
+    try:
+        lines = asyncio.Queue()
+        run = asyncio.create_task(dispatcher.execute("import time\nprint('started', flush=True)\ntime.sleep(60)", 120, lines=lines))
+        assert (await asyncio.wait_for(lines.get(), timeout=10))["line"] == "started"
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+
+        worker = dispatcher.workers[0]
+        for _ in range(100):
+            await worker.check()
+            if worker.reported_active == 0:
+                break
+            await asyncio.sleep(0.05)
+        assert worker.healthy and worker.reported_active == 0
+    finally:
+        await stop_workers(workers)
+
+
+@pytest.mark.asyncio
+async def test_worker_refuses_a_public_address_without_a_token():
+    import os
+    import sys
+    from pathlib import Path
+
+    mcp_tools = Path(__file__).resolve().parents[2] / "mcp_tools"
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, str(mcp_tools / "sandbox_worker.py"), "--host", "0.0.0.0", "--port", "0",
+        env={**os.environ, "SANDBOX_WORKER_TOKEN": "", "EXECUTOR_PRELOAD_MODULES": ""},
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await asyncio.wait_for(process.communicate(), timeout=30)
+    assert process.returncode == 2
+    assert b"without SANDBOX_WORKER_TOKEN" in stderr
+
+    sys.path.insert(0, str(mcp_tools))
+    from sandbox_worker import unsafe_bind
+
+    assert unsafe_bind("::", None, "") and unsafe_bind("workers.internal", None, "")
+    assert unsafe_bind("127.0.0.1", None, "") is None and unsafe_bind("localhost", None, "") is None
+    assert unsafe_bind("0.0.0.0", None, "secret") is None and unsafe_bind("0.0.0.0", "/tmp/w.sock", "") is None
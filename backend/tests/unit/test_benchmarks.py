@@ -0,0 +1,64 @@
+import json
+import httpx
+import pytest
+from langchain_ollama import ChatOllama
+from app.orchestor.nodes import PLAN_SCHEMA_DAG, PLAN_SCHEMA_SEQUENTIAL
+from benchmarks.fake_ollama import FakeOllamaConfig, create_app
+from benchmarks.run_benchmark import compare, percentile, summarize
+
+
+def fake_chat_model(config: FakeOllamaConfig) -> ChatOllama:
+    transport = httpx.ASGITransport(app=create_app(config))
+    return ChatOllama(model="fake", base_url="http://fake-ollama", async_client_kwargs={"transport": transport})
+
+
+@pytest.mark.asyncio
+async def test_fake_ollama_answers_each_role_and_reports_token_counts():
+    config = FakeOllamaConfig(prompt_seconds=0, tokens_per_second=0, plan_steps=3, code="print(1)")
+    llm = fake_chat_model(config)
+
+    plan = await llm.ainvoke("plan this", format=PLAN_SCHEMA_SEQUENTIAL)
+    assert json.loads(plan.content)["plan"] == ["Step 1 of the task", "Step 2 of the task", "Step 3 of the task"]
+    dag = json.loads((await llm.ainvoke("plan this", format=PLAN_SCHEMA_DAG)).content)
+    assert dag["plan"][0] == {"step": "Step 1 of the task", "depends_on": []}
+    assert (await llm.ainvoke("Respond with ONLY the word SINGLE or MULTI.")).content == "MULTI"
+
+    code = await llm.ainvoke("write code")
+    assert code.content == "print(1)"
+    assert code.usage_metadata["output_tokens"] == 2  # "prin", "t(1)"
+
+
+@pytest.mark.asyncio
+async def test_fake_ollama_serves_embeddings_and_warmup():
+    app = create_app(FakeOllamaConfig(models=["fake"], load_seconds=0, embedding_dim=8))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://fake-ollama") as client:
+        assert (await client.get("/api/tags")).json()["models"][0]["name"] == "fake"
+        assert (await client.post("/api/generate", json={"model": "fake"})).json()["done"]
+        assert (await client.get("/api/ps")).json()["models"] == [{"name": "fake", "model": "fake"}]
+
+        embed = lambda text: client.post("/api/embed", json={"model": "e", "input": text})
+        first, again, other = [(await embed(text)).json()["embeddings"][0] for text in ("a", "a", "b")]
+    assert first == again != other
+    assert len(first) == 8 and abs(sum(value * value for value in first) - 1) < 1e-9
+
+
+def test_summary_percentiles_and_comparison():
+    assert percentile([4, 1, 3, 2], 50) == 2.5
+    assert percentile([1, 2, 3, 4, 5], 95) == pytest.approx(4.8)
+    assert percentile([], 50) is None
+
+    runs = [
+        {"completed": True, "latency": 1.0 + index, "first_event": 0.01, "first_node_event": 0.1,
+         "timings": {"nodes": {"planner": {"calls": 1, "seconds": 0.5}}, "llm": {}, "sandbox": {}}}
+        for index in range(3)
+    ] + [{"completed": False, "latency": 0.2, "first_event": 0.01, "error": "HTTP 429"}]
+    summary = summarize(runs, wall_seconds=2.0)
+    assert (summary["completed"], summary["failed"], summary["errors"]) == (3, 1, ["HTTP 429"])
+    assert summary["throughput_runs_per_second"] == 1.5
+    assert summary["latency_seconds"]["p50"] == 2.0
+    assert summary["time_to_first_event_seconds"]["count"] == 4
+    assert summary["nodes_seconds"]["planner"]["p99"] == 0.5
+
+    baseline = {"load": summary, "sandbox": None}
+    faster = {"load": {**summary, "latency_seconds": {**summary["latency_seconds"], "p50": 1.0}}, "sandbox": None}
+    assert "-50.0%" in next(line for line in compare(faster, baseline).splitlines() if line.startswith("latency p50"))
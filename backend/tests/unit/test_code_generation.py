@@ -0,0 +1,17 @@
+from langchain_core.messages import AIMessage
+from app.orchestor.nodes.code_generation import extract_code
+
+
+def test_raw_code_is_returned_as_is():
+    code = 'text = "```not a fence"\nprint(text)'
+    assert extract_code(AIMessage(content=f"\n{code}\n")) == code
+
+
+def test_fenced_code_is_extracted_from_surrounding_prose():
+    reply = "Here is the code:\n```python\nx = 1\nprint(x)\n```\nIt prints 1."
+    assert extract_code(AIMessage(content=reply)) == "x = 1\nprint(x)"
+    assert extract_code("```\nprint(2)\n```") == "print(2)"
+
+
+def test_unterminated_fence_of_a_cut_off_reply():
+    assert extract_code(AIMessage(content="```py\nfor i in range(3):\n    print(i)")) == "for i in range(3):\n    print(i)"
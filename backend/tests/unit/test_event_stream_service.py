@@ -0,0 +1,110 @@
+import asyncio
+import json
+import zlib
+import pytest
+from app.services.event_stream_service import (
+    HEARTBEAT,
+    EventLogs,
+    StateDelta,
+    format_event,
+    gzip_frames,
+    with_heartbeats,
+)
+
+
+def test_frames_carry_compact_json_and_an_id():
+    assert format_event({"type": "run", "data": {0: "ok"}}, 7) == 'id: 7\ndata: {"type":"run","data":{"0":"ok"}}\n\n'
+    assert format_event({"type": "run"}) == 'data: {"type":"run"}\n\n'
+
+
+def test_state_delta_sends_only_what_changed():
+    delta = StateDelta()
+    first = delta.diff({"current_step": 1, "step_results": {0: "a"}, "kernel_history": ["x = 1"], "error": None})
+    assert first == {"data": {"current_step": 1, "step_results": {0: "a"}, "kernel_history": ["x = 1"], "error": None}}
+
+    second = delta.diff({"current_step": 2, "step_results": {0: "a", 1: "b"}, "kernel_history": ["x = 1", "y = 2"], "error": None})
+    assert second == {"data": {"current_step": 2}, "merge": {"step_results": {1: "b"}}, "append": {"kernel_history": ["y = 2"]}}
+
+    # A list that didn't only grow, and a dict that lost keys, are sent whole
+    assert delta.diff({"kernel_history": ["z = 3"], "step_results": {}}) == {"data": {"kernel_history": ["z = 3"], "step_results": {}}}
+    assert delta.diff({"current_step": 2}) == {"data": {}}
+
+
+@pytest.mark.asyncio
+async def test_event_log_replays_after_the_last_seen_id_then_follows():
+    log = EventLogs(max_runs=4, max_events=3).open("run-1")
+    for index in range(4):
+        log.emit({"type": "step", "data": {"index": index}})
+
+    # Only the last 3 events are kept, so a client that saw none gets those
+    replay = log.follow(after=0)
+    assert [(await replay.__anext__()).partition("\n")[0] for _ in range(3)] == ["id: 2", "id: 3", "id: 4"]
+    follower = log.follow(after=2)
+    assert await follower.__anext__() == format_event({"type": "step", "data": {"index": 2}}, 3)
+    assert await follower.__anext__() == format_event({"type": "step", "data": {"index": 3}}, 4)
+    waiting = asyncio.ensure_future(follower.__anext__())
+    await asyncio.sleep(0)
+    log.emit({"type": "stream_end", "data": {}})
+    assert (await waiting).startswith("id: 5\n")
+    log.close()
+    assert [frame async for frame in follower] == []
+    assert [frame async for frame in log.follow(after=4)] == [format_event({"type": "stream_end", "data": {}}, 5)]
+
+
+def test_event_logs_keep_numbering_and_drop_the_oldest_finished_runs():
+    logs = EventLogs(max_runs=2)
+    first = logs.open("a")
+    first.emit({"type": "run"})
+    first.close()
+    assert logs.open("a") is first and first.emit({"type": "run"}).startswith("id: 2\n")  # A resumed run
+    logs.open("b").close()
+    logs.open("c")
+    assert logs.get("a") is not None and logs.get("b") is None  # "a" is still being streamed
+
+
+@pytest.mark.asyncio
+async def test_heartbeats_fill_quiet_gaps():
+    async def frames():
+        yield "data: 1\n\n"
+        await asyncio.sleep(0.12)
+        yield "data: 2\n\n"
+
+    received = [frame async for frame in with_heartbeats(frames(), 0.05)]
+    assert received[0] == "data: 1\n\n" and received[-1] == "data: 2\n\n"
+    assert set(received[1:-1]) == {HEARTBEAT} and len(received) >= 3
+
+
+@pytest.mark.asyncio
+async def test_closing_the_heartbeat_stream_stops_the_source():
+    stopped = asyncio.Event()
+
+    async def frames():
+        try:
+            yield "data: 1\n\n"
+            await asyncio.sleep(60)
+        finally:
+            stopped.set()
+
+    stream = with_heartbeats(frames(), 10)
+    await stream.__anext__()
+    waiting = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0.01)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    await stream.aclose()
+    assert stopped.is_set()
+
+
+@pytest.mark.asyncio
+async def test_gzipped_frames_decode_as_they_arrive():
+    async def frames():
+        for index in range(3):
+            yield format_event({"type": "step", "data": {"result": "x" * 500}}, index + 1)
+
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunks = [chunk async for chunk in gzip_frames(frames())]
+    first = decoder.decompress(chunks[0]).decode()
+    assert json.loads(first.partition("data: ")[2]) == {"type": "step", "data": {"result": "x" * 500}}
+    assert sum(len(chunk) for chunk in chunks) < 500  # Repetitive payloads compress well
+    assert zlib.decompress(b"".join(chunks), 16 + zlib.MAX_WBITS).decode().count("\n\n") == 3
@@ -0,0 +1,154 @@
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "mcp_tools"))
+import fork_server  # noqa: E402
+import secure_code_executor as executor  # noqa: E402
+from fork_server import ForkServer, OutputCapture  # noqa: E402
+from test_secure_code_executor import SPAWNS_CHILD, is_running, wait_until_gone  # noqa: E402
+
+
+@pytest.fixture
+def zygote():
+    server = ForkServer([])
+    server.start()
+    yield server
+    server.stop()
+
+
+def write_script(tmp_path, code: str) -> str:
+    path = tmp_path / "script.py"
+    path.write_text(code)
+    return str(path)
+
+
+@pytest.mark.asyncio
+async def test_script_runs_in_a_forked_child(zygote, tmp_path):
+    script = write_script(tmp_path, "import sys\nprint('out')\nprint('err', file=sys.stderr)\nprint(__name__)")
+    lines = []
+
+    async def on_line(line):
+        lines.append(line)
+
+    result = await zygote.run(script, cwd=str(tmp_path), env={"A": "1"}, timeout=10, on_output={"stdout": on_line})
+    assert result.returncode == 0
+    assert result.stdout == "out\n__main__\n"
+    assert result.stderr == "err\n"
+    assert lines == ["out", "__main__"]
+    assert fork_server.running_process_groups == set()
+
+
+def test_output_capture_keeps_head_and_tail_and_spills_the_rest(tmp_path):
+    short = OutputCapture(limit=10, spill_path=str(tmp_path / "short.log"))
+    short.write(b"0123456789")
+    assert (short.text(), short.truncated) == ("0123456789", False)
+    assert not (tmp_path / "short.log").exists()
+
+    spill = tmp_path / "long.log"
+    capture = OutputCapture(limit=10, spill_path=str(spill), spill_limit=25)
+    for chunk in (b"abcdefgh", b"ijklmnopqrstuvwxyz", b"0123456789"):
+        capture.write(chunk)
+    capture.close()
+    assert capture.text() == f"abcde\n[... 26 bytes omitted, full output in {spill} ...]\n56789"
+    assert capture.info() == {"bytes": 36, "truncated": True, "spill_path": str(spill), "spilled_bytes": 25}
+    assert spill.read_bytes() == b"abcdefghijklmnopqrstuvwxy"
+
+
+@pytest.mark.asyncio
+async def test_output_is_bounded_in_memory(zygote, tmp_path):
+    script = write_script(tmp_path, "for i in range(100_000):\n    print(i)")
+    capture = {"stdout": OutputCapture(limit=100, spill_path=str(tmp_path / "out.log"))}
+    result = await zygote.run(script, cwd=str(tmp_path), env={}, timeout=10, capture=capture)
+    assert result.stdout.startswith("0\n1\n2\n") and result.stdout.endswith("99998\n99999\n")
+    assert len(result.stdout) == 100 + len(f"\n[... 588790 bytes omitted, full output in {tmp_path / 'out.log'} ...]\n")
+    assert (tmp_path / "out.log").read_text() == "".join(f"{i}\n" for i in range(100_000))
+
+
+@pytest.mark.asyncio
+async def test_resource_limits_apply_to_the_child(zygote, tmp_path):
+    script = write_script(tmp_path, "block = bytearray(512 * 1024 * 1024)")
+    result = await zygote.run(script, cwd=str(tmp_path), env={}, timeout=10, limits={"RLIMIT_AS": 256 * 1024 * 1024})
+    assert result.returncode == 1 and "MemoryError" in result.stderr
+
+    script = write_script(tmp_path, "while True:\n    pass")
+    result = await zygote.run(script, cwd=str(tmp_path), env={}, timeout=10, limits={"RLIMIT_CPU": 1})
+    assert result.returncode == -signal.SIGXCPU
+    assert result.resources["cpu"] < 3
+
+
+@pytest.mark.asyncio
+async def test_child_resource_usage_is_reported(zygote, tmp_path):
+    script = write_script(tmp_path, "block = bytearray(64 * 1024 * 1024)\nsum(range(2_000_000))")
+    result = await zygote.run(script, cwd=str(tmp_path), env={}, timeout=10)
+    assert result.returncode == 0
+    assert result.resources["cpu"] > 0
+    assert result.resources["max_rss_kb"] >= 64 * 1024
+
+
+@pytest.mark.asyncio
+async def test_failures_report_exit_code_and_script_traceback(zygote, tmp_path):
+    script = write_script(tmp_path, "def fail():\n    raise ValueError('boom')\n\nfail()")
+    result = await zygote.run(script, cwd=str(tmp_path), env={}, timeout=10)
+    assert result.returncode == 1
+    assert result.stderr.startswith("Traceback (most recent call last):\n")
+    assert f'File "{script}", line 4' in result.stderr
+    assert "ValueError: boom" in result.stderr
+    # Only the script's frames are shown, as with a plain `python script.py`
+    assert "runpy" not in result.stderr and "fork_server" not in result.stderr
+
+    script = write_script(tmp_path, "raise SystemExit(7)")
+    assert (await zygote.run(script, cwd=str(tmp_path), env={}, timeout=10)).returncode == 7
+
+
+@pytest.mark.asyncio
+async def test_timeout_kills_the_whole_process_group(zygote, tmp_path):
+    script = write_script(tmp_path, SPAWNS_CHILD)
+    pids = []
+
+    async def on_line(line):
+        pids.append(int(line))
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        await zygote.run(script, cwd=str(tmp_path), env={}, timeout=1, on_output={"stdout": on_line})
+    assert await wait_until_gone(pids[0])
+    assert zygote.running  # Only the script's group is killed
+
+
+@pytest.mark.asyncio
+async def test_runs_execute_concurrently(zygote, tmp_path):
+    script = write_script(tmp_path, "import time\nprint(time.time())\ntime.sleep(0.5)\nprint(time.time())")
+    results = await asyncio.gather(*(zygote.run(script, cwd=str(tmp_path), env={}, timeout=10) for _ in range(3)))
+    spans = [[float(x) for x in result.stdout.split()] for result in results]
+    assert max(start for start, _ in spans) < min(end for _, end in spans)
+
+
+@pytest.mark.asyncio
+async def test_dead_zygote_falls_back_to_a_cold_interpreter(zygote, tmp_path, monkeypatch):
+    async def get_dead_fork_server():
+        return zygote
+
+    monkeypatch.setattr(executor, "get_fork_server", get_dead_fork_server)
+    os.kill(zygote._process.pid, signal.SIGKILL)
+    zygote._process.wait()
+
+    script = write_script(tmp_path, "print('cold')")
+    result = await executor.run_script(script, cwd=str(tmp_path), env=dict(os.environ), timeout=10)
+    assert (result.returncode, result.stdout) == (0, "cold\n")
+    assert not zygote.running
+
+
+@pytest.mark.asyncio
+async def test_dead_zygote_is_restarted(zygote, monkeypatch):
+    monkeypatch.setattr(executor, "FORK_SERVER_ENABLED", True)
+    monkeypatch.setattr(executor, "_fork_server", zygote)
+    os.kill(zygote._process.pid, signal.SIGKILL)
+    zygote._process.wait()
+
+    assert await executor.get_fork_server() is zygote
+    assert zygote.running
+    assert is_running(zygote._process.pid)
@@ -0,0 +1,87 @@
+import asyncio
+import os
+import subprocess
+import sys
+import uuid
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "mcp_tools"))
+from kernel import KernelClient  # noqa: E402
+
+
+def start_kernel(tmp_path, idle_timeout: float = 60) -> KernelClient:
+    kernel = KernelClient(uuid.uuid4().hex, idle_timeout=idle_timeout)
+    kernel.ensure_started(cwd=str(tmp_path), env=dict(os.environ))
+    return kernel
+
+
+@pytest.fixture
+def kernel(tmp_path):
+    kernel = start_kernel(tmp_path)
+    yield kernel
+    asyncio.run(kernel.shutdown())
+
+
+async def wait_until_stopped(kernel: KernelClient, timeout: float = 5.0) -> bool:
+    # Watches the socket file: connecting to probe would count as activity
+    for _ in range(int(timeout / 0.05)):
+        if not os.path.exists(kernel.socket_path):
+            return not kernel._connectable()
+        await asyncio.sleep(0.05)
+    return False
+
+
+@pytest.mark.asyncio
+async def test_cells_share_variables(kernel):
+    assert (await kernel.run_cell("rows = [1, 2, 3]\nprint('loaded')", timeout=10)).stdout == "loaded"
+    result = await kernel.run_cell("print(sum(rows))", timeout=10)
+    assert (result.returncode, result.stdout) == (0, "6")
+
+
+@pytest.mark.asyncio
+async def test_failing_cell_keeps_the_kernel(kernel):
+    await kernel.run_cell("x = 1", timeout=10)
+    result = await kernel.run_cell("raise ValueError('boom')", timeout=10)
+    assert result.returncode == 1
+    assert "ValueError: boom" in result.stderr
+    assert (await kernel.run_cell("print(x)", timeout=10)).stdout == "1"
+
+
+@pytest.mark.asyncio
+async def test_timeout_interrupts_the_cell_and_the_kernel_survives(kernel):
+    await kernel.run_cell("x = 'kept'", timeout=10)
+    with pytest.raises(subprocess.TimeoutExpired):
+        await kernel.run_cell("import time\ntime.sleep(30)", timeout=0.5)
+    assert (await kernel.run_cell("print(x)", timeout=10)).stdout == "kept"
+
+
+@pytest.mark.asyncio
+async def test_shutdown_stops_the_kernel(tmp_path):
+    kernel = start_kernel(tmp_path)
+    assert await kernel.shutdown()
+    assert await wait_until_stopped(kernel)
+    assert not await kernel.shutdown()  # Already gone
+
+
+@pytest.mark.asyncio
+async def test_idle_kernel_exits_on_its_own(tmp_path):
+    kernel = start_kernel(tmp_path, idle_timeout=0.5)
+    await kernel.run_cell("x = 1", timeout=10)
+    assert await wait_until_stopped(kernel)
+
+
+def test_kernel_ids_are_validated():
+    with pytest.raises(ValueError):
+        KernelClient("../escape", idle_timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_cell_over_its_cpu_limit_is_stopped_and_the_kernel_survives(kernel):
+    await kernel.run_cell("x = 'kept'", timeout=10)
+    result = await kernel.run_cell("while True:\n    pass", timeout=10, cpu_seconds=1)
+    assert result.returncode == 1
+    assert "CPUTimeLimitExceeded: CPU time limit exceeded" in result.stderr
+    # The next cell gets a fresh budget
+    result = await kernel.run_cell("sum(range(10 ** 6))\nprint(x)", timeout=10, cpu_seconds=1)
+    assert (result.returncode, result.stdout) == (0, "kept")
@@ -0,0 +1,258 @@
+import asyncio
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+from app.services.llm_services import ResponseCache
+
+
+def make_generations(text: str) -> list:
+    return [ChatGeneration(message=AIMessage(content=text))]
+
+
+def test_response_cache_round_trip(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    assert cache.lookup("prompt", "model-a") is None
+    cache.update("prompt", "model-a", make_generations("hello"))
+
+    hit = cache.lookup("prompt", "model-a")
+    assert hit[0].message.content == "hello"
+    assert cache.lookup("prompt", "model-b") is None
+    assert cache.stats["memory_hits"] == 1
+    assert cache.stats["misses"] == 2
+
+
+def test_response_cache_persists_to_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ResponseCache(path).update("prompt", "model", make_generations("persisted"))
+
+    reopened = ResponseCache(path)
+    hit = reopened.lookup("prompt", "model")
+    assert hit[0].message.content == "persisted"
+    assert reopened.stats["disk_hits"] == 1
+
+
+def test_response_cache_ttl_expiry(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl_seconds=10)
+    now = 1000.0
+    monkeypatch.setattr("app.services.llm_services.time.time", lambda: now)
+    cache.update("prompt", "model", make_generations("old"))
+
+    now = 1011.0
+    assert cache.lookup("prompt", "model") is None
+    assert cache.info()["disk_entries"] == 0
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2, max_memory_entries=1)
+    cache.update("a", "model", make_generations("a"))
+    cache.update("b", "model", make_generations("b"))
+    cache.update("c", "model", make_generations("c"))
+
+    info = cache.info()
+    assert info["disk_entries"] == 2
+    assert info["memory_entries"] == 1
+    assert cache.lookup("a", "model") is None
+    assert cache.lookup("c", "model")[0].message.content == "c"
+
+
+@pytest.mark.asyncio
+async def test_chat_model_reuses_cached_response(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    model = GenericFakeChatModel(messages=iter([AIMessage(content="first"), AIMessage(content="second")]), cache=cache)
+
+    assert (await model.ainvoke("same prompt")).content == "first"
+    assert (await model.ainvoke("same prompt")).content == "first"
+    assert cache.info()["hit_rate"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_tags_snapshot_is_shared_and_refreshed_when_stale(monkeypatch):
+    import httpx
+    from app.services import llm_services
+
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"models": [{"name": "coder:7b"}]})
+
+    client = httpx.AsyncClient(base_url="http://ollama", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(llm_services, "get_http_client", lambda: client)
+
+    tags = llm_services.OllamaTagsCache(ttl_seconds=60)
+    await tags.get()
+    await tags.get()
+    assert calls == ["/api/tags"]
+    assert tags.is_available("coder:7b")
+    assert not tags.is_available("planner:3b")
+
+    # A stale snapshot is served immediately while one refresh runs in the background
+    tags.fetched_at -= 120
+    await tags.get()
+    await tags._refresh_task
+    assert len(calls) == 2
+    await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_model_warmer_pins_models_and_tracks_loaded_state(monkeypatch):
+    import httpx
+    from app.services import llm_services
+
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append((request.url.path, request.content))
+        if request.url.path == "/api/generate":
+            return httpx.Response(200, json={"done": True})
+        return httpx.Response(200, json={"models": [{"name": "planner:3b"}]})
+
+    client = httpx.AsyncClient(base_url="http://ollama", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(llm_services, "get_http_client", lambda: client)
+    monkeypatch.setattr(llm_services, "MODEL_MAP", {
+        llm_services.ModelRole.PLANNER: "planner:3b",
+        llm_services.ModelRole.CODER: "coder:7b",
+        llm_services.ModelRole.ROUTER: "coder:7b",
+    })
+
+    warmer = llm_services.ModelWarmer(keep_alive="45m", repin_interval=0, roles=list(llm_services.ModelRole))
+    await warmer.warm_all()
+    generate_bodies = [body for path, body in requests_seen if path == "/api/generate"]
+    assert len(generate_bodies) == 2  # One load per distinct model
+    assert all(b'"keep_alive": "45m"' in body or b'"keep_alive":"45m"' in body for body in generate_bodies)
+    assert warmer.status["coder:7b"]["warm"]
+
+    await warmer.refresh_loaded()
+    assert warmer.status["planner:3b"]["warm"]
+    assert not warmer.status["coder:7b"]["warm"]
+    await client.aclose()
+
+
+
+@pytest.mark.asyncio
+async def test_health_check_is_served_from_snapshots(monkeypatch):
+    import httpx
+    from app.services import llm_services
+
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"models": [{"name": "coder:7b"}]})
+
+    client = httpx.AsyncClient(base_url="http://ollama", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(llm_services, "get_http_client", lambda: client)
+    monkeypatch.setattr(llm_services, "MODEL_MAP", {role: "coder:7b" for role in llm_services.ModelRole})
+    monkeypatch.setattr(llm_services, "ollama_tags", llm_services.OllamaTagsCache(ttl_seconds=60))
+    warmer = llm_services.ModelWarmer(repin_interval=0, roles=[llm_services.ModelRole.CODER])
+    monkeypatch.setattr(llm_services, "model_warmer", warmer)
+    monkeypatch.setattr(llm_services, "LLM_CACHE_ENABLED", False)
+
+    await llm_services.ollama_tags.get()
+    warmer.status["coder:7b"]["warm"] = True  # As left by the repin loop
+    for _ in range(3):
+        status = await llm_services.health_check()
+    assert calls == ["/api/tags"]  # No /api/ps call per probe
+    assert status["configured_models"]["CODER"]["available"] and status["configured_models"]["CODER"]["warm"]
+    await client.aclose()
+
+def test_model_warmer_only_pins_roles_in_use(monkeypatch):
+    from app.services import llm_services
+
+    monkeypatch.setattr(llm_services, "MODEL_MAP", {
+        llm_services.ModelRole.PLANNER: "planner:3b",
+        llm_services.ModelRole.CODER: "coder:7b",
+        llm_services.ModelRole.ROUTER: "router:1b",
+    })
+    monkeypatch.setattr(llm_services, "MODEL_WARMUP_ROLES", ["planner", "coder"])
+    assert set(llm_services.ModelWarmer().status) == {"planner:3b", "coder:7b"}
+
+
+@pytest.mark.asyncio
+async def test_generations_per_model_are_bounded(monkeypatch):
+    from langchain_ollama.chat_models import ChatOllama
+    from app.services import llm_services
+
+    in_flight = {"now": 0, "max": 0}
+
+    async def fake_chat_stream(self, messages, stop=None, **kwargs):
+        in_flight["now"] += 1
+        in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        await asyncio.sleep(0.02)
+        in_flight["now"] -= 1
+        yield {"model": self.model, "message": {"role": "assistant", "content": "ok"}, "done": True, "done_reason": "stop"}
+
+    monkeypatch.setattr(ChatOllama, "_acreate_chat_stream", fake_chat_stream)
+    monkeypatch.setattr(llm_services, "_model_slots", {})
+    monkeypatch.setattr(llm_services, "OLLAMA_MAX_CONCURRENT_PER_MODEL", 2)
+    coder = llm_services.ScheduledChatOllama(model="coder")
+    planner = llm_services.ScheduledChatOllama(model="planner")
+
+    responses = await asyncio.gather(*(coder.ainvoke("hi") for _ in range(5)))
+    assert [response.content for response in responses] == ["ok"] * 5
+    assert in_flight["max"] == 2
+
+    # Each model has its own slots
+    in_flight["max"] = 0
+    await asyncio.gather(coder.ainvoke("hi"), coder.ainvoke("hi"), planner.ainvoke("hi"))
+    assert in_flight["max"] == 3
+
+
+@pytest.mark.asyncio
+async def test_roles_get_their_generation_options_and_planner_schema_reaches_ollama(monkeypatch):
+    from app.orchestor.nodes import PLAN_SCHEMA_SEQUENTIAL
+    from app.services import llm_services
+
+    monkeypatch.setattr(llm_services, "MODEL_MAP", {role: "shared:3b" for role in llm_services.ModelRole})
+    monkeypatch.setattr(llm_services, "_llm_cache", {})
+    monkeypatch.setitem(llm_services.ROLE_OPTIONS, llm_services.ModelRole.PLANNER, {"num_predict": 512, "num_ctx": 8192})
+    monkeypatch.setitem(llm_services.ROLE_OPTIONS, llm_services.ModelRole.ROUTER, {"num_predict": 4, "temperature": 0.0})
+
+    planner = llm_services.get_llm(llm_services.ModelRole.PLANNER, use_cache=False)
+    router = llm_services.get_llm(llm_services.ModelRole.ROUTER, use_cache=False)
+    assert planner is not router  # Same model, different options
+    assert (router.num_predict, router.temperature) == (4, 0.0)
+
+    requests_seen = []
+
+    async def fake_chat(**params):
+        requests_seen.append(params)
+
+        async def parts():
+            yield {"model": params["model"], "message": {"role": "assistant", "content": '{"plan": ["a"]}'}, "done": True}
+        return parts()
+
+    monkeypatch.setattr(planner._async_client, "chat", fake_chat)
+    await planner.ainvoke("plan it", format=PLAN_SCHEMA_SEQUENTIAL)
+    assert requests_seen[0]["format"] == PLAN_SCHEMA_SEQUENTIAL
+    assert requests_seen[0]["options"]["num_predict"] == 512
+    assert requests_seen[0]["options"]["num_ctx"] == 8192
+
+
+@pytest.mark.asyncio
+async def test_model_warmer_loads_models_with_their_context_size(monkeypatch):
+    import httpx
+    from app.services import llm_services
+
+    bodies = []
+
+    def handler(request):
+        bodies.append(request.content)
+        return httpx.Response(200, json={"done": True})
+
+    client = httpx.AsyncClient(base_url="http://ollama", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(llm_services, "get_http_client", lambda: client)
+    monkeypatch.setattr(llm_services, "MODEL_MAP", {
+        llm_services.ModelRole.PLANNER: "planner:3b",
+        llm_services.ModelRole.CODER: "coder:7b",
+        llm_services.ModelRole.ROUTER: "router:1b",
+    })
+    monkeypatch.setitem(llm_services.ROLE_OPTIONS, llm_services.ModelRole.CODER, {"num_ctx": 8192})
+    monkeypatch.setitem(llm_services.ROLE_OPTIONS, llm_services.ModelRole.PLANNER, {"num_predict": 512})
+
+    warmer = llm_services.ModelWarmer(roles=[llm_services.ModelRole.PLANNER, llm_services.ModelRole.CODER])
+    assert await warmer.warm("coder:7b") and await warmer.warm("planner:3b")
+    assert b'"num_ctx":8192' in bodies[0].replace(b" ", b"")
+    assert b"options" not in bodies[1]
+    await client.aclose()
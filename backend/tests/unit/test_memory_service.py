@@ -0,0 +1,92 @@
+import json
+import numpy as np
+import pytest
+from app.services import memory_service
+from app.services.memory_service import Memory, TaskMemory, VectorIndex
+
+
+def memory(prompt: str) -> Memory:
+    return Memory(prompt=prompt, plan=[f"do {prompt}"], code=[f"print({prompt!r})"], outcome="ok")
+
+
+def test_search_returns_the_most_similar_entries_first(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    index.add([1, 0, 0], memory("x"))
+    index.add([0, 1, 0], memory("y"))
+    index.add([1, 1, 0], memory("xy"))
+
+    results = index.search([2, 0.1, 0], k=2)
+    assert [entry.prompt for _, entry in results] == ["x", "xy"]
+    assert results[0][0] == pytest.approx(0.9988, abs=1e-3)
+    assert len(index.search([0, 0, 1], k=10)) == 3
+
+
+def test_index_grows_and_persists(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory_service, "INITIAL_CAPACITY", 2)
+    index = VectorIndex(str(tmp_path))
+    vectors = np.random.default_rng(0).standard_normal((5, 8))
+    for i, vector in enumerate(vectors):
+        index.add(vector, memory(f"task {i}"))
+
+    reopened = VectorIndex(str(tmp_path))
+    assert reopened.count == 5 and reopened.dim == 8
+    assert reopened.search(vectors[3], k=1)[0][1].prompt == "task 3"
+    with pytest.raises(ValueError):
+        reopened.add([1, 2, 3], memory("wrong size"))
+
+
+def test_half_written_append_is_dropped_on_open(tmp_path):
+    index = VectorIndex(str(tmp_path))
+    index.add([1, 0], memory("kept"))
+    # A crash after the entry was written but before the count was
+    with open(tmp_path / "entries.jsonl", "a") as f:
+        f.write(json.dumps(memory("lost").__dict__) + "\n")
+
+    reopened = VectorIndex(str(tmp_path))
+    assert [entry.prompt for entry in reopened.entries] == ["kept"]
+    reopened.add([0, 1], memory("next"))
+    assert [entry.prompt for entry in VectorIndex(str(tmp_path)).entries] == ["kept", "next"]
+
+
+@pytest.mark.asyncio
+async def test_task_memory_recalls_similar_prompts_and_survives_embedding_failures(tmp_path):
+    embeddings = {"fetch prices": [1, 0, 0, 5], "fetch the prices": [0.9, 0.1, 0, -5], "draw a chart": [0, 1, 0, 0]}
+
+    async def fake_embed(text):
+        return embeddings[text]
+
+    task_memory = TaskMemory(directory=str(tmp_path), model="embed:v1", dim=3)
+    task_memory.embed = fake_embed
+    assert await task_memory.remember(memory("fetch prices"))
+    assert await task_memory.remember(memory("draw a chart"))
+
+    # Only the first 3 dimensions are compared
+    recalled = await task_memory.recall("fetch the prices", k=2, threshold=0.9)
+    assert [entry.prompt for _, entry in recalled] == ["fetch prices"]
+    assert task_memory.info()["entries"] == 2
+
+    failures = []
+
+    async def failing_embed(text):
+        failures.append(text)
+        raise ConnectionError("embedding model not pulled")
+
+    task_memory.embed = failing_embed
+    assert await task_memory.recall("fetch prices") == []
+    # Later runs skip the memory for a while instead of waiting for the embedding to fail again
+    assert await task_memory.recall("fetch prices") == []
+    assert not await task_memory.remember(memory("fetch prices"))
+    assert failures == ["fetch prices"] and not task_memory.info()["available"]
+
+    task_memory.embed = fake_embed
+    task_memory._unavailable_until = 0.0  # The retry interval is over
+    assert len(await task_memory.recall("fetch the prices", k=2, threshold=0.9)) == 1
+
+
+def test_remembered_code_is_reused_only_in_the_same_kernel_mode():
+    from app.orchestor.nodes.memory_update import reusable_plan
+
+    past = Memory(prompt="total", plan=["set it", "print it"], code=["total = 1", "print(total)"], outcome="1", persistent_kernel=True)
+    assert reusable_plan([(0.99, past)], parallel=False, persistent_kernel=True)["reused_code"] == {0: "total = 1", 1: "print(total)"}
+    update = reusable_plan([(0.99, past)], parallel=False)
+    assert update["plan"] == ["set it", "print it"] and "reused_code" not in update
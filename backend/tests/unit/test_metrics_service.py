@@ -0,0 +1,78 @@
+import pytest
+from app.services import metrics_service
+from app.services.metrics_service import (
+    CallbackMetric,
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    RunMetrics,
+    current_run,
+    record_llm_call,
+    record_sandbox_run,
+    timed_node,
+)
+
+
+def test_registry_renders_the_prometheus_text_format():
+    registry = MetricsRegistry()
+    tokens = registry.register(Counter("tokens_total", "Tokens.", ["model"]))
+    latency = registry.register(Histogram("latency_seconds", "Latency.", ["node"], buckets=(0.1, 1)))
+    registry.register(CallbackMetric("queue_depth", "Waiting runs.", lambda: {(): 3}))
+    registry.register(CallbackMetric("broken", "Unreadable.", lambda: 1 / 0))
+
+    tokens.inc(5, model='q"wen')
+    latency.observe(0.1, node="planner")  # Bucket bounds are inclusive
+    latency.observe(2.5, node="planner")
+
+    assert registry.render().splitlines() == [
+        "# HELP tokens_total Tokens.",
+        "# TYPE tokens_total counter",
+        'tokens_total{model="q\\"wen"} 5',
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{node="planner",le="0.1"} 1',
+        'latency_seconds_bucket{node="planner",le="1"} 1',
+        'latency_seconds_bucket{node="planner",le="+Inf"} 2',
+        'latency_seconds_sum{node="planner"} 2.6',
+        'latency_seconds_count{node="planner"} 2',
+        "# HELP queue_depth Waiting runs.",
+        "# TYPE queue_depth gauge",
+        "queue_depth 3",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_nodes_llm_calls_and_sandbox_runs_are_recorded_into_the_current_run(monkeypatch):
+    monkeypatch.setattr(metrics_service, "node_duration", Histogram("n", "n", ["node"]))
+    monkeypatch.setattr(metrics_service, "llm_tokens", Counter("t", "t", ["model", "type"]))
+
+    async def planner(state):
+        """Plans."""
+        record_llm_call("qwen", 2.0, {
+            "done": True, "prompt_eval_count": 120, "eval_count": 40,
+            "eval_duration": 1_000_000_000, "load_duration": 500_000_000,
+        })
+        record_sandbox_run({"mode": "fork", "wall": 0.3, "cpu": 0.2, "max_rss_kb": 1024})
+        return {"plan": ["a"]}
+
+    wrapped = timed_node("planner", planner)
+    assert wrapped.__doc__ == "Plans."
+    run = RunMetrics()
+    token = current_run.set(run)
+    try:
+        assert await wrapped(None) == {"plan": ["a"]}
+    finally:
+        current_run.reset(token)
+
+    summary = run.summary()
+    assert summary["nodes"]["planner"]["calls"] == 1
+    assert summary["llm"] == {
+        "calls": 1, "seconds": 2.0, "load_seconds": 0.5, "prompt_tokens": 120, "completion_tokens": 40,
+    }
+    assert summary["sandbox"]["executions"] == 1 and summary["sandbox"]["max_rss_bytes"] == 1024 * 1024
+    assert metrics_service.llm_tokens.values == {("qwen", "prompt"): 120, ("qwen", "completion"): 40}
+    assert metrics_service.node_duration.values[("planner",)][0][-1] == 0  # Not in the +Inf bucket
+
+    # Outside of a run only the process-wide metrics are updated
+    record_llm_call("qwen", 1.0, None)
+    assert run.llm["calls"] == 1
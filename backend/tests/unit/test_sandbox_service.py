@@ -0,0 +1,288 @@
+import asyncio
+import json
+import pytest
+from app.services.sandbox_service import (
+    ExecutorPool,
+    OutputRelay,
+    WorkerDispatcher,
+    WorkerUnavailable,
+    split_resource_usage,
+)
+
+
+class FakeExecutorSession:
+    """Stands in for ExecutorSession without spawning an MCP server."""
+
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        self.session = object()
+        self.uses = 0
+        self.broken = False
+        self.closed = False
+        self.healthy = True
+
+    async def start(self):
+        pass
+
+    @property
+    def alive(self):
+        return not self.broken and not self.closed
+
+    async def ping(self, timeout: float = 5.0):
+        if not self.healthy:
+            self.broken = True
+        return self.healthy
+
+    async def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs) -> ExecutorPool:
+    kwargs.setdefault("size", 2)
+    kwargs.setdefault("max_uses", 10)
+    kwargs.setdefault("health_check_interval", 0)
+    kwargs.setdefault("acquire_timeout", 1)
+    return ExecutorPool(session_factory=FakeExecutorSession, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_reused():
+    pool = make_pool()
+    first = await pool.acquire()
+    await pool.release(first)
+    second = await pool.acquire()
+    assert second is first
+    await pool.release(second)
+    assert pool.stats["created"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_bounds_concurrent_sessions():
+    pool = make_pool(size=2, acquire_timeout=0.05)
+    a = await pool.acquire()
+    b = await pool.acquire()
+    with pytest.raises(TimeoutError):
+        await pool.acquire()
+    await pool.release(a)
+    c = await pool.acquire()
+    assert c is a
+    await pool.release(b)
+    await pool.release(c)
+
+
+@pytest.mark.asyncio
+async def test_session_recycled_after_max_uses():
+    pool = make_pool(max_uses=2)
+    executor = await pool.acquire()
+    await pool.release(executor)
+    executor = await pool.acquire()
+    await pool.release(executor)
+    assert executor.closed
+    fresh = await pool.acquire()
+    assert fresh is not executor
+    await pool.release(fresh)
+
+
+@pytest.mark.asyncio
+async def test_error_inside_session_recycles_executor():
+    pool = make_pool()
+    with pytest.raises(RuntimeError):
+        async with pool.session():
+            raise RuntimeError("transport died")
+    assert pool.status()["idle"] == 0
+    assert pool.stats["recycled"] == 1
+
+
+@pytest.mark.asyncio
+async def test_health_check_drops_unhealthy_sessions():
+    pool = make_pool()
+    await pool.start()
+    assert pool.status()["idle"] == 2
+    pool._idle[0].healthy = False
+    await pool.check_health()
+    assert pool.status()["idle"] == 1
+    await pool.close()
+    assert pool.status()["idle"] == 0
+
+
+@pytest.mark.asyncio
+async def test_output_relay_delivers_lines_in_order():
+    relay = OutputRelay()
+    target, lines = await relay.open_stream()
+    address, _, token = target.partition("/")
+    host, _, port = address.rpartition(":")
+
+    _, writer = await asyncio.open_connection(host, int(port))
+    writer.write(f"{token}\n".encode())
+    for i in range(3):
+        writer.write(json.dumps({"stream": "stdout", "line": f"line {i}"}).encode() + b"\n")
+    await writer.drain()
+    writer.close()
+
+    received = []
+    while (item := await asyncio.wait_for(lines.get(), timeout=2)) is not None:
+        received.append(item["line"])
+    assert received == ["line 0", "line 1", "line 2"]
+    assert relay.is_connected(target)
+    relay.close_stream(target)
+    await relay.close()
+
+
+@pytest.mark.asyncio
+async def test_output_relay_drops_lines_past_its_buffer():
+    relay = OutputRelay(max_pending=2)
+    target, lines = await relay.open_stream()
+    address, _, token = target.partition("/")
+    host, _, port = address.rpartition(":")
+
+    _, writer = await asyncio.open_connection(host, int(port))
+    writer.write(f"{token}\n".encode())
+    for i in range(5):
+        writer.write(json.dumps({"stream": "stdout", "line": f"line {i}"}).encode() + b"\n")
+    await writer.drain()
+    writer.close()
+    await asyncio.sleep(0.05)  # Nothing is consumed while the lines arrive
+
+    received = []
+    while (item := await asyncio.wait_for(lines.get(), timeout=2)) is not None:
+        received.append(item["line"])
+    assert received == ["line 0", "line 1", "[3 output lines dropped from the live view]"]
+    await relay.close()
+
+
+@pytest.mark.asyncio
+async def test_output_relay_ignores_unknown_tokens():
+    relay = OutputRelay()
+    target, lines = await relay.open_stream()
+    address = target.partition("/")[0]
+    host, _, port = address.rpartition(":")
+
+    _, writer = await asyncio.open_connection(host, int(port))
+    writer.write(b"not-a-token\n" + json.dumps({"stream": "stdout", "line": "x"}).encode() + b"\n")
+    await writer.drain()
+    writer.close()
+    await asyncio.sleep(0.05)
+
+    assert lines.empty()
+    assert not relay.is_connected(target)
+    await relay.close()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_stream_hangs_up_on_the_executor():
+    relay = OutputRelay()
+    target, _ = await relay.open_stream()
+    address, _, token = target.partition("/")
+    host, _, port = address.rpartition(":")
+
+    reader, writer = await asyncio.open_connection(host, int(port))
+    writer.write(f"{token}\n".encode())
+    await writer.drain()
+    while not relay.is_connected(target):
+        await asyncio.sleep(0.01)
+
+    relay.cancel_stream(target)
+    assert await asyncio.wait_for(reader.read(), timeout=2) == b""  # The executor sees EOF and stops the run
+    writer.close()
+    await relay.close()
+
+
+def test_resource_usage_line_is_split_off():
+    result = 'Execution Result (code 0):\n---_START_OF_OUTPUT_---\n[resources] printed\n---_END_OF_OUTPUT_---'
+    usage = {"mode": "fork", "wall": 0.5, "cpu": 0.25, "max_rss_kb": 2048}
+    assert split_resource_usage(f"{result}\n[resources] {json.dumps(usage)}") == (result, usage)
+    assert split_resource_usage(result) == (result, None)
+    assert split_resource_usage("Execution Error: Process timed out after 1 seconds.")[1] is None
+
+
+class FakeSandboxWorker:
+    """Stands in for SandboxWorker without a worker daemon; answers with its own address."""
+
+    def __init__(self, address: str):
+        self.address = address
+        self.healthy = True
+        self.reachable = True
+        self.in_flight = 0
+        self.capacity = 1
+        self.calls = []
+
+    @property
+    def load(self):
+        return self.in_flight / self.capacity
+
+    async def call(self, tool, arguments=None, on_output=None):
+        if not self.reachable:
+            raise WorkerUnavailable(f"Sandbox worker {self.address} is unreachable")
+        self.calls.append((tool, arguments))
+        if on_output is not None:
+            on_output({"stream": "stdout", "line": f"running on {self.address}"})
+        return f"ran on {self.address}"
+
+    async def check(self):
+        self.healthy = self.reachable
+        return self.healthy
+
+
+def make_dispatcher(count: int = 2) -> WorkerDispatcher:
+    return WorkerDispatcher([f"worker-{i}:7071" for i in range(count)], health_check_interval=0, worker_factory=FakeSandboxWorker)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_picks_the_least_loaded_worker():
+    dispatcher = make_dispatcher(3)
+    busy, idle, half = dispatcher.workers
+    busy.in_flight, half.in_flight, half.capacity = 2, 1, 2
+    assert await dispatcher.execute("print(1)", 5) == "ran on worker-1:7071"
+
+    idle.in_flight = 2
+    assert {await dispatcher.execute("print(1)", 5) for _ in range(2)} == {"ran on worker-2:7071"}
+    # Equally loaded workers take turns
+    half.in_flight = 4
+    assert {await dispatcher.execute("print(1)", 5) for _ in range(3)} == {f"ran on worker-{i}:7071" for i in range(3)}
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_fails_over_and_recovers_unreachable_workers():
+    dispatcher = make_dispatcher(2)
+    first, second = dispatcher.workers
+    first.reachable = False
+    results = [await dispatcher.execute("print(1)", 5) for _ in range(3)]
+    assert results == ["ran on worker-1:7071"] * 3
+    assert not first.healthy and dispatcher.stats["failovers"] == 1  # Tried once, then skipped while down
+
+    second.reachable = False
+    with pytest.raises(RuntimeError, match="No sandbox worker could be reached"):
+        await dispatcher.execute("print(1)", 5)
+
+    first.reachable = True
+    await dispatcher.check_health()
+    assert first.healthy and not second.healthy
+    assert await dispatcher.execute("print(1)", 5) == "ran on worker-0:7071"
+
+
+@pytest.mark.asyncio
+async def test_kernel_cells_stay_on_the_worker_that_started_the_kernel():
+    dispatcher = make_dispatcher(2)
+    await dispatcher.execute("total = 40", 5, kernel_id="run-1")
+    home = next(worker for worker in dispatcher.workers if worker.calls)
+    home.in_flight = 5  # Busier than the other worker, but it has the kernel
+    assert await dispatcher.execute("print(total)", 5, kernel_id="run-1") == f"ran on {home.address}"
+
+    await dispatcher.shutdown_kernel("run-1")
+    assert home.calls[-1] == ("shutdown_kernel", {"kernel_id": "run-1"})
+    assert await dispatcher.shutdown_kernel("run-1") == "Kernel Shutdown: not running"
+
+    await dispatcher.execute("x = 1", 5, kernel_id="run-2")
+    home = next(worker for worker in dispatcher.workers if worker.calls and worker.calls[-1][1].get("kernel_id") == "run-2")
+    home.reachable = False
+    with pytest.raises(RuntimeError, match="Kernel run-2 lives on sandbox worker"):
+        await dispatcher.execute("print(x)", 5, kernel_id="run-2")
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_delivers_worker_output_lines():
+    dispatcher = make_dispatcher(1)
+    lines = asyncio.Queue()
+    await dispatcher.execute("print(1)", 5, lines=lines)
+    assert lines.get_nowait() == {"stream": "stdout", "line": "running on worker-0:7071"}
+    assert lines.get_nowait() is None
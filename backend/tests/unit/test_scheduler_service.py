@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from app.services.scheduler_service import QueueFull, RunScheduler
+
+
+def admitted_clients(tickets) -> list:
+    return [ticket.client_id for ticket in tickets if ticket.admitted.is_set()]
+
+
+@pytest.mark.asyncio
+async def test_runs_are_admitted_up_to_the_limit():
+    scheduler = RunScheduler(max_active=2, max_queued=10, max_queued_per_client=10)
+    first, second, third = (scheduler.enqueue("a") for _ in range(3))
+    assert first.admitted.is_set() and second.admitted.is_set()
+    assert not third.admitted.is_set()
+    assert scheduler.info()["active"] == 2
+
+    first.release()
+    first.release()  # Releasing twice frees only one slot
+    assert third.admitted.is_set()
+    assert scheduler.info()["active"] == 2
+
+
+@pytest.mark.asyncio
+async def test_queue_is_served_round_robin_across_clients():
+    scheduler = RunScheduler(max_active=1, max_queued=10, max_queued_per_client=10)
+    running = scheduler.enqueue("a")
+    queued = [scheduler.enqueue(client_id) for client_id in ("a", "a", "a", "b", "c", "c")]
+
+    order = []
+    while running is not None:
+        running.release()
+        running = next((ticket for ticket in queued if ticket.admitted.is_set() and not ticket.released), None)
+        if running is not None:
+            order.append(running.client_id)
+    # A burst from "a" doesn't hold back "b" and "c"
+    assert order == ["a", "b", "c", "a", "c", "a"]
+
+
+@pytest.mark.asyncio
+async def test_positions_follow_the_round_robin_order():
+    scheduler = RunScheduler(max_active=1, max_queued=10, max_queued_per_client=10)
+    scheduler.enqueue("a")
+    a1, a2, b1, c1, c2 = (scheduler.enqueue(client_id) for client_id in ("a", "a", "b", "c", "c"))
+
+    assert [ticket.position for ticket in (a1, b1, c1, a2, c2)] == [1, 2, 3, 4, 5]
+
+    b1.release()  # Leaving the queue moves the runs behind it up
+    assert [ticket.position for ticket in (a1, c1, a2, c2)] == [1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_wait_for_turn_reports_position_changes_until_admitted():
+    scheduler = RunScheduler(max_active=1, max_queued=10, max_queued_per_client=10)
+    running = scheduler.enqueue("a")
+    ahead = scheduler.enqueue("b")
+    ticket = scheduler.enqueue("c")
+
+    async def watch():
+        return [position async for position in ticket.wait_for_turn()]
+
+    watcher = asyncio.ensure_future(watch())
+    await asyncio.sleep(0)
+    running.release()
+    await asyncio.sleep(0)
+    ahead.release()
+    assert await asyncio.wait_for(watcher, timeout=1) == [2, 1]
+    assert ticket.admitted.is_set()
+
+
+@pytest.mark.asyncio
+async def test_full_queues_reject_new_runs():
+    scheduler = RunScheduler(max_active=1, max_queued=3, max_queued_per_client=2)
+    scheduler.enqueue("a")
+    scheduler.enqueue("a")
+    scheduler.enqueue("a")
+    with pytest.raises(QueueFull, match="this client"):
+        scheduler.enqueue("a")
+
+    scheduler.enqueue("b")
+    with pytest.raises(QueueFull, match="queue is full"):
+        scheduler.enqueue("c")
+    assert scheduler.stats["rejected"] == 2
+    assert scheduler.info()["waiting"] == 3
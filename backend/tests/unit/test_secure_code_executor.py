@@ -0,0 +1,153 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+import pytest
+from app.services.sandbox_service import OutputRelay
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "mcp_tools"))
+import secure_code_executor as executor  # noqa: E402
+
+# Prints the pid of a child process, so tests can check the whole process group is killed
+SPAWNS_CHILD = """
+import multiprocessing, time
+
+def sleeper():
+    time.sleep(60)
+
+if __name__ == "__main__":
+    child = multiprocessing.Process(target=sleeper)
+    child.start()
+    print(child.pid, flush=True)
+    time.sleep(60)
+"""
+
+
+def is_running(pid: int) -> bool:
+    try:
+        state = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0]
+    except (FileNotFoundError, IndexError):
+        return False
+    return state not in ("Z", "X")
+
+
+async def wait_until_gone(pid: int, timeout: float = 5.0) -> bool:
+    for _ in range(int(timeout / 0.05)):
+        if not is_running(pid):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def cold_executor(monkeypatch):
+    """Runs scripts in fresh interpreters; the fork server has its own tests."""
+    monkeypatch.setattr(executor, "FORK_SERVER_ENABLED", False)
+    monkeypatch.setattr(executor, "_execution_slots", None)
+    return executor
+
+
+async def first_output_line(coro, relay: OutputRelay):
+    target, lines = await relay.open_stream()
+    run = asyncio.ensure_future(coro(target))
+    item = await asyncio.wait_for(lines.get(), timeout=10)
+    return run, int(item["line"])
+
+
+@pytest.mark.asyncio
+async def test_executions_run_concurrently(cold_executor, monkeypatch):
+    monkeypatch.setattr(cold_executor, "MAX_CONCURRENT_EXECUTIONS", 3)
+    code = "import time\nprint(time.time())\ntime.sleep(0.5)\nprint(time.time())"
+    results = await asyncio.gather(*(cold_executor.execute_python_code(code, timeout=10) for _ in range(3)))
+
+    spans = [[float(x) for x in result.split("---_START_OF_OUTPUT_---\n")[1].split("\n---")[0].split()] for result in results]
+    assert max(start for start, _ in spans) < min(end for _, end in spans)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_capped(cold_executor, monkeypatch):
+    monkeypatch.setattr(cold_executor, "MAX_CONCURRENT_EXECUTIONS", 1)
+    code = "import time\nprint(time.time())\ntime.sleep(0.2)\nprint(time.time())"
+    results = await asyncio.gather(*(cold_executor.execute_python_code(code, timeout=10) for _ in range(2)))
+
+    (start_a, end_a), (start_b, end_b) = sorted(
+        [float(x) for x in result.split("---_START_OF_OUTPUT_---\n")[1].split("\n---")[0].split()] for result in results
+    )
+    assert end_a <= start_b
+
+
+@pytest.mark.asyncio
+async def test_results_end_with_the_resource_usage(cold_executor):
+    result = await cold_executor.execute_python_code("print('hi')", timeout=10)
+    output, usage_line = result.rsplit("\n", 1)
+    assert output.endswith("hi\n---_END_OF_OUTPUT_---")
+    prefix, usage = usage_line.split(" ", 1)
+    assert prefix == cold_executor.RESOURCES_PREFIX
+    usage = json.loads(usage)
+    assert usage["mode"] == "cold" and usage["wall"] > 0
+
+
+@pytest.mark.asyncio
+async def test_long_output_is_truncated_and_saved_in_full(cold_executor, monkeypatch):
+    monkeypatch.setattr(cold_executor, "OUTPUT_LIMIT_BYTES", 1000)
+    result = await cold_executor.execute_python_code("for i in range(50_000):\n    print('row', i)", timeout=10)
+    output, usage = result.rsplit("\n", 1)
+    assert len(output) < 2000
+    assert "row 0\n" in output and output.endswith("row 49999\n---_END_OF_OUTPUT_---")
+
+    stdout = json.loads(usage.split(" ", 1)[1])["output"]["stdout"]
+    assert stdout["truncated"] and stdout["bytes"] == sum(len(f"row {i}\n") for i in range(50_000))
+    spill = Path(stdout["spill_path"])
+    try:
+        assert f"full output in {spill}" in output
+        assert spill.read_text().splitlines()[-1] == "row 49999"
+    finally:
+        spill.unlink()
+
+
+@pytest.mark.asyncio
+async def test_scripts_run_under_resource_limits(cold_executor, monkeypatch):
+    monkeypatch.setitem(cold_executor.RESOURCE_LIMITS, "RLIMIT_CPU", 1)
+    result = await cold_executor.execute_python_code("while True:\n    pass", timeout=10)
+    assert result.startswith("Execution Result (code -24)")
+    assert "over the CPU time limit (1s)" in result
+
+    monkeypatch.setitem(cold_executor.RESOURCE_LIMITS, "RLIMIT_AS", 256 * 1024 * 1024)
+    result = await cold_executor.execute_python_code("block = bytearray(512 * 1024 * 1024)", timeout=10)
+    assert result.startswith("Execution Result (code 1)") and "MemoryError" in result
+
+
+@pytest.mark.asyncio
+async def test_requested_timeout_is_capped(cold_executor, monkeypatch):
+    monkeypatch.setattr(cold_executor, "MAX_TIMEOUT", 1.0)
+    result = await cold_executor.execute_python_code("import time\ntime.sleep(30)", timeout=120)
+    assert result == "Execution Error: Process timed out after 1 seconds."
+
+
+@pytest.mark.asyncio
+async def test_timeout_kills_the_whole_process_group(cold_executor):
+    relay = OutputRelay()
+    try:
+        run, child_pid = await first_output_line(
+            lambda target: cold_executor.execute_python_code(SPAWNS_CHILD, timeout=1, stream_to=target), relay
+        )
+        assert is_running(child_pid)
+        assert (await run).startswith("Execution Error: Process timed out")
+        assert await wait_until_gone(child_pid)
+    finally:
+        await relay.close()
+
+
+@pytest.mark.asyncio
+async def test_cancellation_kills_the_whole_process_group(cold_executor):
+    relay = OutputRelay()
+    try:
+        run, child_pid = await first_output_line(
+            lambda target: cold_executor.execute_python_code(SPAWNS_CHILD, timeout=30, stream_to=target), relay
+        )
+        run.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await run
+        assert await wait_until_gone(child_pid)
+    finally:
+        await relay.close()
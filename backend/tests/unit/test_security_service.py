@@ -0,0 +1,55 @@
+import pytest
+from app.services.security_service import SAFE_MESSAGE, SecurityAnalyzer
+
+
+@pytest.mark.parametrize("code, reason", [
+    ("import os", "Unsafe import detected: 'os'"),
+    ("import os.path as p", "Unsafe import detected: 'os.path'"),
+    ("from subprocess import run", "Unsafe import detected: 'subprocess'"),
+    ("eval('1 + 1')", "Unsafe function call detected: 'eval()'"),
+    ("builtins.exec('x = 1')", "Unsafe method call detected: 'exec()'"),
+    ("x = ().__class__", "Unsafe attribute access detected: '__class__'"),
+    ("open = print", "Attempted to override builtin: 'open'"),
+])
+def test_blocks_default_rules(code, reason):
+    assert SecurityAnalyzer().check(code) == (False, reason)
+
+
+def test_allows_regular_code():
+    code = "import requests\nfrom bs4 import BeautifulSoup\nrows = [len(x) for x in ['a', 'bb']]\nprint(rows)"
+    assert SecurityAnalyzer().check(code) == (True, SAFE_MESSAGE)
+
+
+def test_reports_syntax_errors():
+    is_safe, reason = SecurityAnalyzer().check("print(")
+    assert not is_safe
+    assert reason.startswith("Code has syntax errors")
+
+
+def test_deny_lists_are_configurable():
+    analyzer = SecurityAnalyzer(deny_modules={"socket"}, deny_functions=set(), deny_attributes=set())
+    assert analyzer.check("import os")[0]
+    assert analyzer.check("import socket") == (False, "Unsafe import detected: 'socket'")
+
+
+def test_verdicts_are_cached_by_content():
+    analyzer = SecurityAnalyzer(cache_size=2)
+    analyzer.check("import os")
+    analyzer.check("import os")
+    assert analyzer.stats == {"hits": 1, "misses": 1, "blocked": 1}
+
+    analyzer.check("print(1)")
+    analyzer.check("print(2)")
+    assert analyzer.info()["cached_verdicts"] == 2
+    analyzer.check("import os")  # Evicted as least recently used
+    assert analyzer.stats["misses"] == 4
+
+
+def test_environment_overrides_default_deny_lists(monkeypatch):
+    from app.services import security_service
+
+    monkeypatch.setenv("EXECUTOR_DENY_MODULES", "socket, ctypes")
+    monkeypatch.setattr(security_service, "_default_analyzer", None)
+    assert security_service.is_code_safe("import ctypes")[0] is False
+    assert security_service.is_code_safe("import os")[0] is True
+    monkeypatch.setattr(security_service, "_default_analyzer", None)
@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+from app.orchestor.nodes.input_processing import coalescing_key, normalize_prompt
+from app.orchestor.state_models import PromptRequest
+from app.services.single_flight_service import SingleFlight
+
+
+class Source:
+    """An event stream fed by the test, recording how many times it was started and whether it was closed."""
+
+    def __init__(self):
+        self.events = asyncio.Queue()
+        self.started = 0
+        self.closed = False
+
+    async def stream(self):
+        self.started += 1
+        try:
+            while (event := await self.events.get()) is not None:
+                yield event
+        finally:
+            self.closed = True
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_late_subscribers_get_a_replay_then_the_live_stream():
+    coalescer, source = SingleFlight(), Source()
+    first = coalescer.join("k", source.stream)
+    source.events.put_nowait("one")
+    assert await first.__anext__() == "one"
+
+    late = coalescer.join("k", source.stream)
+    source.events.put_nowait("two")
+    source.events.put_nowait(None)
+    assert [event async for event in first] == ["two"]
+    assert [event async for event in late] == ["one", "two"]
+    assert source.started == 1
+    assert coalescer.stats == {"started": 1, "joined": 1}
+
+
+@pytest.mark.asyncio
+async def test_finished_runs_are_forgotten():
+    coalescer, source = SingleFlight(), Source()
+    first = coalescer.join("k", source.stream)
+    source.events.put_nowait(None)
+    assert [event async for event in first] == []
+    await settle()
+
+    coalescer.join("k", source.stream)
+    await settle()
+    assert source.started == 2
+    assert coalescer.stats["joined"] == 0
+
+
+@pytest.mark.asyncio
+async def test_run_is_cancelled_when_its_last_subscriber_leaves():
+    coalescer, source = SingleFlight(), Source()
+    first, second = coalescer.join("k", source.stream), coalescer.join("k", source.stream)
+    await settle()
+
+    first.unsubscribe()
+    first.unsubscribe()  # Leaving twice counts once
+    await settle()
+    assert not source.closed
+    second.unsubscribe()
+    await settle()
+    assert source.closed
+    assert coalescer.info()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_run_left_before_it_started_is_forgotten():
+    coalescer, source = SingleFlight(), Source()
+    coalescer.join("k", source.stream).unsubscribe()
+    await settle()
+    assert source.started == 0
+    assert coalescer.info()["in_flight"] == 0
+
+
+
+@pytest.mark.asyncio
+async def test_only_the_most_recent_events_are_kept_for_late_subscribers():
+    coalescer, source = SingleFlight(max_events=2), Source()
+    first = coalescer.join("k", source.stream)
+    for event in ("one", "two", "three"):
+        source.events.put_nowait(event)
+        assert await first.__anext__() == event
+
+    late = coalescer.join("k", source.stream)
+    source.events.put_nowait(None)
+    assert [event async for event in late] == ["two", "three"]
+
+
+@pytest.mark.asyncio
+async def test_done_callbacks_run_for_flights_cancelled_before_they_started():
+    coalescer, source = SingleFlight(), Source()
+    calls = []
+    subscriber = coalescer.join("k", source.stream)
+    subscriber.flight.add_done_callback(lambda: calls.append("done"))
+    subscriber.unsubscribe()
+    await settle()
+    assert source.started == 0 and calls == ["done"]
+
+def test_coalescing_key_ignores_whitespace_but_not_case_or_options():
+    assert normalize_prompt("  fetch\tthe \n\n prices ") == "fetch the prices"
+    key = coalescing_key(PromptRequest(prompt="fetch the prices"), False)
+    assert coalescing_key(PromptRequest(prompt=" fetch  the prices\n", coalesce=True), False) == key
+    assert coalescing_key(PromptRequest(prompt="Fetch the prices"), False) != key
+    assert coalescing_key(PromptRequest(prompt="fetch the prices", parallel=True), False) != key
+    assert coalescing_key(PromptRequest(prompt="fetch the prices"), True) != key